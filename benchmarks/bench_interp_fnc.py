@@ -0,0 +1,36 @@
+"""
+Compare evaluation time of :func:`qsource3.massfilter.interp_fnc`
+with ``scipy.interpolate.interp1d``.
+
+Run (with the package installed): ``python benchmarks/bench_interp_fnc.py``
+"""
+import timeit
+
+import numpy as np
+from scipy import interpolate
+
+from qsource3.massfilter import interp_fnc
+
+calib_pnts = np.array([[100, 0.95], [200, 0.98], [300, 0.955], [400, 0.97]])
+
+f_scipy = interpolate.interp1d(
+    calib_pnts[:, 0], calib_pnts[:, 1], fill_value="extrapolate", kind="quadratic"
+)
+f_native = interp_fnc(calib_pnts)
+
+mz = 123.4
+mz_vec = np.arange(0, 500, 0.1)
+
+
+def per_call(stmt, number):
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number
+
+
+for label, number, args in [("scalar", 10000, mz), ("vector (5000)", 200, mz_vec)]:
+    t_scipy = per_call(lambda: f_scipy(args), number)
+    t_native = per_call(lambda: f_native(args), number)
+    print(
+        f"{label:14s} interp1d {t_scipy * 1e6:9.2f} us"
+        f"   interp_fnc {t_native * 1e6:9.2f} us"
+        f"   speedup {t_scipy / t_native:6.1f}x"
+    )
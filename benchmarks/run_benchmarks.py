@@ -0,0 +1,271 @@
+"""
+Performance benchmarks of qsource3 package.
+
+Every benchmark reports the best time per call (minimum of several repeats).
+The results can be saved to a JSON file and later runs compared with it.
+The comparison fails (exit code 1) if any benchmark is slower than
+``tolerance`` times its saved value.
+
+Run (with the package installed)::
+
+    # save results of a release
+    python benchmarks/run_benchmarks.py --save benchmarks-0.1.0.json
+
+    # compare current code with the saved results
+    python benchmarks/run_benchmarks.py --compare benchmarks-0.1.0.json
+
+    # run selected benchmarks only
+    python benchmarks/run_benchmarks.py -k scan
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+import timeit
+
+import numpy as np
+
+from qsource3.qsource3driver import QSource3Driver
+from qsource3.massfilter import Quadrupole, interp_fnc
+from qsource3.simulator import SimulatedQSource3Adapter
+from qsource3.scan import ScanExecutor
+
+CALIB_PNTS = [[100, 0.95], [200, 0.98], [300, 0.955], [400, 0.97]]
+
+BENCHMARKS = {}
+
+
+def benchmark(name, number):
+    """
+    Register benchmark. The decorated function prepares the benchmark
+    and returns the callable to be timed, or a tuple ``(callable, timer)``
+    where ``timer`` is the clock of :func:`timeit.repeat` (e.g. time measured
+    by a child process).
+    """
+
+    def decorator(setup):
+        BENCHMARKS[name] = (setup, number)
+        return setup
+
+    return decorator
+
+
+def simulated_quadrupole(**kwargs):
+    adapter = SimulatedQSource3Adapter(processing_delay=0.0, realtime=False)
+    driver = QSource3Driver(adapter, **kwargs)
+    return Quadrupole(
+        frequency=1e6,
+        r0=3e-3,
+        driver=driver,
+        calib_pnts_rf=CALIB_PNTS,
+        calib_pnts_dc=CALIB_PNTS,
+    )
+
+
+@benchmark("interp_fnc construction", number=200)
+def bench_interp_fnc_construction():
+    return lambda: interp_fnc(CALIB_PNTS)
+
+
+@benchmark("interp_fnc scalar", number=20000)
+def bench_interp_fnc_scalar():
+    f = interp_fnc(CALIB_PNTS)
+    return lambda: f(123.4)
+
+
+@benchmark("interp_fnc vector 5000", number=500)
+def bench_interp_fnc_vector():
+    f = interp_fnc(CALIB_PNTS)
+    mz = np.linspace(0, 500, 5000)
+    return lambda: f(mz)
+
+
+@benchmark("Quadrupole.calc_uv", number=20000)
+def bench_calc_uv():
+    q = simulated_quadrupole()
+    return lambda: q.calc_uv(123.4)
+
+
+@benchmark("Quadrupole.calc_uv_array 5000", number=500)
+def bench_calc_uv_array():
+    q = simulated_quadrupole()
+    mz = np.linspace(0, 500, 5000)
+    return lambda: q.calc_uv_array(mz)
+
+
+@benchmark("Quadrupole.mz setter", number=5000)
+def bench_mz_setter():
+    q = simulated_quadrupole(register_cache=False)
+
+    def run():
+        q.mz = 123.4
+
+    return run
+
+
+@benchmark("QSource3Driver.set_voltages", number=5000)
+def bench_set_voltages():
+    driver = QSource3Driver(
+        SimulatedQSource3Adapter(processing_delay=0.0, realtime=False),
+        register_cache=False,
+    )
+    return lambda: driver.set_voltages(1.234, -1.234, 123.4)
+
+
+@benchmark("QSource3Driver.encode_voltages 5000", number=100)
+def bench_encode_voltages():
+    driver = QSource3Driver(SimulatedQSource3Adapter(realtime=False))
+    rng = np.random.default_rng(0)
+    dc1, dc2, ac = rng.uniform(0, 100, (3, 5000))
+
+    def run():
+        driver.encode_voltages(*driver.voltages_to_mv(dc1, dc2, ac))
+
+    return run
+
+
+@benchmark("Quadrupole.compile_scan 5000", number=50)
+def bench_compile_scan():
+    q = simulated_quadrupole()
+    mz = np.linspace(0, 500, 5000)
+    return lambda: q.compile_scan(mz)
+
+
+@benchmark("ScanPlan.run 1000 (simulated)", number=10)
+def bench_scan_plan_run():
+    q = simulated_quadrupole()
+    plan = q.compile_scan(np.linspace(0, 500, 1000))
+    return plan.run
+
+
+@benchmark("ScanPlan.run 1000 pipelined (simulated)", number=10)
+def bench_scan_plan_run_pipelined():
+    q = simulated_quadrupole()
+    plan = q.compile_scan(np.linspace(0, 500, 1000))
+
+    def run():
+        with q._driver.pipelined(window=16):
+            plan.run()
+
+    return run
+
+
+@benchmark("ScanExecutor 200 x 100 us (realtime)", number=1)
+def bench_scan_executor():
+    adapter = SimulatedQSource3Adapter(processing_delay=20e-6)
+    q = Quadrupole(frequency=1e6, r0=3e-3, driver=QSource3Driver(adapter))
+    plan = q.compile_scan(np.linspace(0, 500, 200), dwell=100e-6)
+    return ScanExecutor(plan).run
+
+
+@benchmark("mz setter loop 1000 (simulated)", number=5)
+def bench_mz_loop():
+    q = simulated_quadrupole()
+    mz_vec = np.linspace(0, 500, 1000).tolist()
+
+    def run():
+        for mz in mz_vec:
+            q.mz = mz
+
+    return run
+
+
+@benchmark("import qsource3.massfilter", number=1)
+def bench_import():
+    code = (
+        "import time; t0 = time.perf_counter(); import qsource3.massfilter; "
+        "print(time.perf_counter() - t0)"
+    )
+
+    # only the import time printed by the child is counted, not the interpreter startup
+    elapsed = [0.0]
+
+    def run():
+        result = subprocess.run(
+            [sys.executable, "-c", code], check=True, capture_output=True, text=True
+        )
+        elapsed[0] += float(result.stdout.strip().splitlines()[-1])
+
+    return run, lambda: elapsed[0]
+
+
+def run_benchmarks(selected=None, repeat=5):
+    """
+    Run benchmarks.
+
+    :param selected: substring of benchmark names to run (all if None)
+    :param repeat: number of repeats, the minimum is reported
+    :returns: dictionary {name: seconds per call}
+    """
+    results = {}
+    for name, (setup, number) in BENCHMARKS.items():
+        if selected and selected not in name:
+            continue
+        fnc = setup()
+        timer = time.perf_counter
+        if isinstance(fnc, tuple):
+            fnc, timer = fnc
+        fnc()  # warm up
+        t = min(timeit.repeat(fnc, timer=timer, number=number, repeat=repeat)) / number
+        results[name] = t
+        print(f"{name:45s} {t * 1e6:12.2f} us")
+    return results
+
+
+def compare(results, reference, tolerance):
+    """
+    Compare results with reference results.
+
+    :returns: list of names of benchmarks slower than ``tolerance`` times reference
+    """
+    regressions = []
+    print()
+    print(f"{'benchmark':45s} {'reference':>12s} {'current':>12s} {'ratio':>7s}")
+    for name, t in results.items():
+        if name not in reference:
+            continue
+        ratio = t / reference[name]
+        flag = ""
+        if ratio > tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(
+            f"{name:45s} {reference[name] * 1e6:10.2f}us {t * 1e6:10.2f}us"
+            f" {ratio:7.2f}{flag}"
+        )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--save", help="save results to JSON file")
+    parser.add_argument("--compare", help="compare with results saved in JSON file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.3,
+        help="allowed ratio of current and reference time (default 1.3)",
+    )
+    parser.add_argument("-k", dest="selected", help="run benchmarks matching substring")
+    parser.add_argument("--repeat", type=int, default=5, help="number of repeats")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.selected, args.repeat)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)
+        regressions = compare(results, reference, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
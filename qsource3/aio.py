@@ -0,0 +1,457 @@
+import asyncio
+
+from qsource3.qsource3driver import QSource3Driver
+from qsource3.massfilter import QuadrupoleCalibration
+
+
+def _to_mv(value, low, high):
+    # truncate to the range and convert Volts to integer mV (see QSource3Driver)
+    return int(round(min(max(value, low), high) * 1000.0))
+
+
+class AsyncQSource3Driver:
+    r"""
+    Asyncio communication driver for QSource3 device.
+
+    Provides the same commands as :class:`qsource3.qsource3driver.QSource3Driver`
+    as coroutines. The driver communicates via asyncio streams, so it never blocks
+    the event loop. Use :meth:`open_serial` to connect to a serial port
+    (requires `pyserial-asyncio <https://pypi.org/project/pyserial-asyncio/>`_).
+
+    Commands issued from concurrent tasks are serialized,
+    so the request/response pairing is preserved. Setters compare the value with
+    the register model, send the command and update the model under the same lock.
+    Writes of values which the device already holds are suppressed
+    in the same way as by :class:`qsource3.qsource3driver.QSource3Driver`.
+
+    If a reply is not read (timeout or cancellation of the task), the register model
+    is invalidated and the late reply is read and discarded before the next command,
+    so the following replies are not paired with wrong commands.
+
+    :param reader: :class:`asyncio.StreamReader` connected to the device
+    :param writer: :class:`asyncio.StreamWriter` connected to the device
+    :param name: A name
+    :param timeout: timeout for reading the reply in seconds (None - wait forever)
+    :param register_cache: suppress writes of values the device already holds
+    """
+
+    MAX_RF_AMP_PP = QSource3Driver.MAX_RF_AMP_PP  # Volts peak-to-peak
+    MAX_DC = QSource3Driver.MAX_DC  # Volts
+    DC_RESOLUTION = QSource3Driver.DC_RESOLUTION  # Volts
+    AC_RESOLUTION = QSource3Driver.AC_RESOLUTION  # Volts peak-to-peak
+
+    READ_TERMINATION = b"\r"
+    WRITE_TERMINATION = b"\r"
+
+    def __init__(
+        self, reader, writer, name="AsyncQSource3Driver", timeout=1.0, register_cache=True
+    ):
+        self._reader = reader
+        self._writer = writer
+        self.name = name
+        self.timeout = timeout
+        self._lock = asyncio.Lock()
+        self._unread = 0  # replies of timed out or cancelled commands
+
+        self.register_cache = register_cache
+        self._registers = {"dc1": None, "dc2": None, "ac": None}  # mV, None => unknown
+
+    @classmethod
+    async def open_serial(cls, port: str, baud_rate: int = 1000000, **kwargs):
+        """
+        Open serial port and create the driver.
+
+        :param port: name of the serial port, e.g. ``"COM1"`` or ``"/dev/ttyUSB0"``
+        :param baud_rate: baud rate
+        :param kwargs: keyword arguments passed to the driver
+        """
+        try:
+            import serial_asyncio
+        except ImportError as e:
+            raise ImportError(
+                "AsyncQSource3Driver.open_serial requires pyserial-asyncio package"
+            ) from e
+
+        reader, writer = await serial_asyncio.open_serial_connection(
+            url=port, baudrate=baud_rate
+        )
+        return cls(reader, writer, **kwargs)
+
+    async def close(self):
+        """
+        Close the connection.
+        """
+        self._writer.close()
+        await self._writer.wait_closed()
+
+    async def ask(self, command: str) -> str:
+        """
+        Write a command and return the reply without termination.
+
+        :param command: command string
+        """
+        async with self._lock:
+            return await self._ask_unlocked(command)
+
+    async def _ask_unlocked(self, command: str) -> str:
+        # the caller holds self._lock
+        if self._unread:
+            await self._discard_unread(command)
+        self._writer.write(command.encode() + self.WRITE_TERMINATION)
+        try:
+            await self._writer.drain()
+            response = await asyncio.wait_for(
+                self._reader.readuntil(self.READ_TERMINATION), self.timeout
+            )
+        except BaseException:
+            # the reply may still arrive, it belongs to this command
+            self._unread += 1
+            self.invalidate_registers()
+            raise
+        return response[: -len(self.READ_TERMINATION)].decode()
+
+    async def _discard_unread(self, command):
+        # read late replies of the commands which were not answered in time,
+        # the connection stays out of sync (no command is sent) until they arrive
+        while self._unread:
+            try:
+                await asyncio.wait_for(
+                    self._reader.readuntil(self.READ_TERMINATION), self.timeout
+                )
+            except asyncio.TimeoutError:
+                raise ConnectionError(
+                    f"Late reply of a timed out command not received (command {command!r} not sent)"
+                ) from None
+            self._unread -= 1
+
+    async def _ask_ok(self, s):
+        async with self._lock:
+            await self._ask_ok_unlocked(s)
+
+    async def _ask_ok_unlocked(self, s):
+        # the caller holds self._lock
+        response = await self._ask_unlocked(s)
+        if response != "OK":
+            self.invalidate_registers()
+            raise ConnectionError(f"Invalid response: {response} (command {s!r})")
+
+    @property
+    def registers(self) -> dict:
+        """
+        Copy of the register model ``{"dc1": mV, "dc2": mV, "ac": mV}``
+        (``None`` if the value is unknown).
+        """
+        return dict(self._registers)
+
+    def invalidate_registers(self):
+        """
+        Forget the register model, so the next setpoints are always sent.
+        """
+        self._registers = {"dc1": None, "dc2": None, "ac": None}
+
+    async def test_communication(self):
+        """
+        Communication test
+        """
+        await self._ask_ok("#Q")
+
+    async def get_serial_number(self) -> str:
+        """
+        Get serial number, returns three character string
+        """
+        return await self.ask("#N")
+
+    async def set_rs485_mode(self):
+        """
+        Set RS485 communication mode.
+        """
+        await self._ask_ok("#R 1")
+
+    async def set_dc_voltage(self, output, voltage):
+        """
+        Set DC voltage in Volts.
+
+        See :meth:`qsource3.qsource3driver.QSource3Driver.set_dc_voltage`.
+
+        :param output: Output channel - 1 or 2.
+        :param voltage: voltage in Volts.
+        """
+        v = _to_mv(voltage, -self.MAX_DC, self.MAX_DC)
+        key = f"dc{output}"
+        # the model is compared and updated under the lock of the command
+        async with self._lock:
+            if self.register_cache and self._registers.get(key) == v:
+                return
+            await self._ask_ok_unlocked(f"#DC{output} {v}")
+            self._registers[key] = v
+
+    async def set_ac_voltage(self, ac):
+        """
+        Set AC voltage with peak to peak value in Volts.
+
+        See :meth:`qsource3.qsource3driver.QSource3Driver.set_ac_voltage`.
+        """
+        v = _to_mv(ac, 0, self.MAX_RF_AMP_PP)
+        async with self._lock:
+            if self.register_cache and self._registers["ac"] == v:
+                return
+            await self._ask_ok_unlocked(f"#AC {v}")
+            self._registers["ac"] = v
+
+    async def set_voltages(self, dc1, dc2, ac):
+        """
+        Set DC and AC voltages.
+
+        See :meth:`qsource3.qsource3driver.QSource3Driver.set_voltages`.
+
+        :param dc1: DC voltage of channel 1 in Volts.
+        :param dc2: DC voltage of channel 2 in Volts.
+        :param ac: AC voltage with peak to peak value in Volts.
+        """
+        _dc1 = _to_mv(dc1, -self.MAX_DC, self.MAX_DC)
+        _dc2 = _to_mv(dc2, -self.MAX_DC, self.MAX_DC)
+        _ac = _to_mv(ac, 0, self.MAX_RF_AMP_PP)
+        registers = {"dc1": _dc1, "dc2": _dc2, "ac": _ac}
+        async with self._lock:
+            if self.register_cache and self._registers == registers:
+                return
+            await self._ask_ok_unlocked(f"#C {_dc1} {_dc2} {_ac}")
+            self._registers = registers
+
+    async def set_frequency(self, frequency):
+        """
+        Set frequency of the generator at the actual range in Hz.
+        """
+        await self._ask_ok(f"#F {int(round(frequency / 100.0))}")
+
+    async def get_frequency(self) -> float:
+        """
+        Get frequency of the generator at the actual range in Hz.
+        """
+        response = await self.ask("#G")
+        return float(response) * 100
+
+    async def get_current(self) -> float:
+        """
+        Get excitation current in mA
+        """
+        response = await self.ask("#U")
+        return float(response) / 10.0  # convert to mA
+
+    async def set_range(self, range):
+        """
+        Changes resonant frequency and corresponding mass measurement range.
+
+        See :attr:`qsource3.qsource3driver.QSource3Driver.range`.
+        """
+        if range not in (0, 1, 2):
+            raise ValueError(f"Value of {range} is not in the discrete set [0, 1, 2]")
+        self.invalidate_registers()
+        await self._ask_ok(f"#B {range}")
+
+    async def store_frequency(self):
+        """
+        Store actual value of frequency at the actual range into Flash memory.
+        """
+        await self._ask_ok("#S")
+
+
+class AsyncQSource3:
+    r"""
+    Asyncio variant of :class:`qsource3.qsource3.QSource3`.
+
+    The values are read by properties and set by coroutines, e.g.
+    ``await q.set_dc_offst(-10)``.
+
+    :param driver: instance of :class:`AsyncQSource3Driver`
+    """
+
+    def __init__(self, driver: AsyncQSource3Driver, name="QSource3"):
+        self._driver = driver
+        self.name = name
+
+        self._dc1 = None
+        self._dc2 = None
+        self._rf = None
+
+    async def set_voltages(self, dc1: float, dc2: float, rf: float):
+        r"""
+        Set DC voltages and RF amplitude simultaneosly.
+
+        :param dc1: DC voltage :math:`U_1`  (in Volts)
+        :param dc2: DC voltage :math:`U_2`  (in Volts)
+        :param rf: RF amplitude :math:`V` (in Volts, 0-to-peak)
+        """
+        await self._driver.set_voltages(dc1, dc2, 2.0 * rf)
+        self._dc1 = dc1
+        self._dc2 = dc2
+        self._rf = rf
+
+    @property
+    def rf(self) -> float:
+        r"""RF amplitude :math:`V` (in Volts, 0-to-peak)"""
+        return self._rf
+
+    async def set_rf(self, v):
+        r"""Set RF amplitude :math:`V` (in Volts, 0-to-peak)"""
+        await self._driver.set_ac_voltage(2.0 * v)  # amp 0-P to amp P-P
+        self._rf = v
+
+    @property
+    def dc1(self) -> float:
+        r"""DC voltage :math:`U_1`  (in Volts)"""
+        return self._dc1
+
+    async def set_dc1(self, v):
+        r"""Set DC voltage :math:`U_1`  (in Volts)"""
+        await self._driver.set_dc_voltage(1, v)
+        self._dc1 = v
+
+    @property
+    def dc2(self) -> float:
+        r"""DC voltage :math:`U_2`  (in Volts)"""
+        return self._dc2
+
+    async def set_dc2(self, v):
+        r"""Set DC voltage :math:`U_2`  (in Volts)"""
+        await self._driver.set_dc_voltage(2, v)
+        self._dc2 = v
+
+    @property
+    def dc_offst(self) -> float:
+        r"""DC offset :math:`U_{\text{ofst}} = (U_1 + U_2) / 2` (in Volts)"""
+        return (self.dc1 + self.dc2) / 2.0
+
+    async def set_dc_offst(self, v):
+        r"""
+        Set DC offset :math:`U_{\text{ofst}}` (in Volts).
+
+        :math:`U_1 := U_{\text{ofst}} + U_{\text{diff}}`,
+        :math:`U_2 := U_{\text{ofst}} - U_{\text{diff}}`.
+        """
+        diff = self.dc_diff
+        await self.set_dc1(v + diff)
+        await self.set_dc2(v - diff)
+
+    @property
+    def dc_diff(self) -> float:
+        r"""DC difference :math:`U_{\text{diff}} = (U_1 - U_2) / 2` (in Volts)"""
+        return (self.dc1 - self.dc2) / 2.0
+
+    async def set_dc_diff(self, v):
+        r"""
+        Set DC difference :math:`U_{\text{diff}}` (in Volts).
+
+        :math:`U_1 := U_{\text{ofst}} + U_{\text{diff}}`,
+        :math:`U_2 := U_{\text{ofst}} - U_{\text{diff}}`.
+        """
+        offst = self.dc_offst
+        await self.set_dc1(offst + v)
+        await self.set_dc2(offst - v)
+
+
+class AsyncQuadrupole(QuadrupoleCalibration, AsyncQSource3):
+    r"""
+    Asyncio variant of :class:`qsource3.massfilter.Quadrupole`.
+
+    Use :meth:`create` to construct the instance and reset the voltages:
+
+    .. code-block:: python
+
+        driver = await AsyncQSource3Driver.open_serial("COM1")
+        q = await AsyncQuadrupole.create(frequency=1e6, r0=3e-3, driver=driver)
+        await q.set_mz(100)
+
+    :param frequency: RF frequency of the quadrupole :math:`f` in Hertz
+    :param r0: characteristic radius of the quadrupole :math:`r_0` in meters
+    :param driver: instance of :class:`AsyncQSource3Driver`
+    :param calib_pnts_rf: calibration points for RF amplitude (m/z calibration), optional
+    :param calib_pnts_dc: calibration points for DC difference (resolution), optional
+    :param uv_cache_size: size of :meth:`calc_uv` cache (0 - no cache), optional
+    """
+
+    def __init__(
+        self,
+        frequency: float,
+        r0: float,
+        driver: AsyncQSource3Driver,
+        calib_pnts_rf=[],
+        calib_pnts_dc=[],
+        name="Quadrupole",
+        uv_cache_size=0,
+    ):
+        super().__init__(driver=driver, name=name)
+
+        self._init_calibration(frequency, r0, calib_pnts_rf, calib_pnts_dc, uv_cache_size)
+
+        self._mz = None
+
+        self._is_rod_polarity_positive = True  # rods polarity
+        self._is_dc_on = True  #  True => mass filter, False => ion guide
+
+    @classmethod
+    async def create(cls, *args, **kwargs):
+        """
+        Create the instance and reset voltages.
+
+        Takes the same parameters as the constructor.
+        """
+        q = cls(*args, **kwargs)
+        await q.set_voltages(0, 0, 0)
+        return q
+
+    @property
+    def mz(self) -> float:
+        r""":math:`m/z` (last value set by :meth:`set_mz`)"""
+        return self._mz
+
+    async def set_mz(self, mz: float):
+        r"""
+        Set RF amplitude and DC difference according to given :math:`m/z`.
+
+        See :attr:`qsource3.massfilter.Quadrupole.mz`.
+        """
+        if mz < 0:
+            mz = 0
+        U, V = self.calc_uv(mz)
+        await self.set_uv(U, V)
+        self._mz = mz
+
+    @property
+    def is_rod_polarity_positive(self) -> bool:
+        r"""Polarity of DC difference applied to rods."""
+        return self._is_rod_polarity_positive
+
+    async def set_is_rod_polarity_positive(self, v):
+        r"""
+        Set polarity of DC difference applied to rods.
+
+        DC offset, RF amplitude and absolute value of DC difference is preserved.
+        """
+        if v != self._is_rod_polarity_positive:
+            self._is_rod_polarity_positive = v
+            await self.set_dc_diff(-self.dc_diff)
+
+    @property
+    def is_dc_on(self) -> bool:
+        r"""Flag if DC difference is applied to rods (True - mass filter, False - ion guide)."""
+        return self._is_dc_on
+
+    async def set_is_dc_on(self, v):
+        r"""
+        Switch between mass filter (True) and ion guide (False).
+
+        DC offset and RF amplitude is preserved.
+        """
+        if v != self._is_dc_on:
+            self._is_dc_on = v
+            await self.set_mz(self.mz)  # reset mz => set correct DC voltages
+
+    async def set_uv(self, u: float, v: float):
+        r"""
+        Set RF amplitude :math:`V` and DC difference :math:`U_{\text{diff}}`.
+
+        See :meth:`qsource3.massfilter.Quadrupole.set_uv`.
+        """
+        dc1, dc2 = self._dc_from_u(u)
+        await self.set_voltages(dc1, dc2, v)
@@ -0,0 +1,157 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from qsource3.scan import ScanTiming, wait_until
+
+
+class QSource3Bus:
+    r"""
+    Manager of several QSource3 units dispatching setpoints to all of them concurrently.
+
+    The units are instances of :class:`qsource3.massfilter.Quadrupole` (or
+    :class:`qsource3.qsource3.QSource3`). Units sharing one driver (one port, e.g.
+    RS485 bus) are served one after another by a worker thread of the port,
+    different ports are served in parallel. The latency of a call is therefore
+    given by the slowest port, not by the sum over all units.
+
+    .. code-block:: python
+
+        with QSource3Bus([q1, q2, q3]) as bus:
+            bus.compile_scans([mz_vec1, mz_vec2, mz_vec3])
+            for k in range(len(mz_vec1)):
+                bus.set_point(k)
+
+    :param units: list of units
+    """
+
+    def __init__(self, units):
+        self.units = list(units)
+
+        # group units by driver (port), keep the order of the units
+        self._ports = {}
+        for i, unit in enumerate(self.units):
+            self._ports.setdefault(id(unit._driver), []).append(i)
+        self._executors = {
+            port: ThreadPoolExecutor(max_workers=1, thread_name_prefix="QSource3Bus")
+            for port in self._ports
+        }
+        self.plans = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Stop the worker threads.
+        """
+        for executor in self._executors.values():
+            executor.shutdown()
+
+    def dispatch(self, fnc, args=None) -> list:
+        r"""
+        Call ``fnc(unit, arg)`` for all units concurrently and wait for the results.
+
+        If any call raises an exception, the remaining calls are still finished
+        and the first exception (in order of the units) is raised.
+
+        :param fnc: callable with parameters ``(unit, arg)``
+        :param args: list of arguments, one per unit (None - ``arg`` is None for all units)
+        :returns: list of results in order of the units
+        """
+        if args is None:
+            args = [None] * len(self.units)
+        elif len(args) != len(self.units):
+            raise ValueError(f"Expected {len(self.units)} arguments, got {len(args)}")
+
+        def run_port(indices):
+            results = {}
+            for i in indices:
+                try:
+                    results[i] = (fnc(self.units[i], args[i]), None)
+                except Exception as e:
+                    results[i] = (None, e)
+            return results
+
+        futures = [
+            self._executors[port].submit(run_port, indices)
+            for port, indices in self._ports.items()
+        ]
+        results = {}
+        for future in futures:
+            results.update(future.result())
+
+        for i in range(len(self.units)):
+            error = results[i][1]
+            if error is not None:
+                raise error
+        return [results[i][0] for i in range(len(self.units))]
+
+    def set_mz(self, mz_values):
+        r"""
+        Set :attr:`~qsource3.massfilter.Quadrupole.mz` of all units.
+
+        :param mz_values: list of :math:`m/z`, one per unit
+        """
+        def set_mz(unit, mz):
+            unit.mz = mz
+
+        self.dispatch(set_mz, mz_values)
+
+    def set_voltages(self, voltages):
+        r"""
+        Set DC voltages and RF amplitude of all units
+        (see :meth:`qsource3.qsource3.QSource3.set_voltages`).
+
+        :param voltages: list of tuples (dc1, dc2, rf), one per unit
+        """
+        self.dispatch(lambda unit, v: unit.set_voltages(*v), voltages)
+
+    def compile_scans(self, mz_vecs, dwell=0.0):
+        r"""
+        Precompile scans of all units (see :meth:`qsource3.massfilter.Quadrupole.compile_scan`).
+        The plans are stored in :attr:`plans` and used by :meth:`set_point`.
+
+        :param mz_vecs: list of 1D arrays of :math:`m/z`, one per unit (the same length)
+        :param dwell: dwell time per point (used by :meth:`run`)
+        """
+        if len({len(mz_vec) for mz_vec in mz_vecs}) > 1:
+            raise ValueError("All the scans must have the same number of points")
+        self.plans = [
+            unit.compile_scan(mz_vec, dwell) for unit, mz_vec in zip(self.units, mz_vecs)
+        ]
+        return self.plans
+
+    def set_point(self, k: int):
+        r"""
+        Send setpoint ``k`` of the compiled scans to all units concurrently.
+
+        :param k: index of the point
+        """
+        self.dispatch(lambda unit, plan: plan.set_point(k), self.plans)
+
+    def run(self, spin: float = 0.002) -> ScanTiming:
+        r"""
+        Run the compiled scans of all units step by step against absolute deadlines
+        (see :class:`qsource3.scan.ScanExecutor`). The dwell times of the first plan are used.
+
+        :param spin: busy-wait interval before each deadline in seconds
+        :returns: instance of :class:`qsource3.scan.ScanTiming`
+        """
+        dwell = self.plans[0].dwell
+        offsets = np.concatenate(([0.0], np.cumsum(dwell)))
+        errors = np.zeros(len(dwell))
+
+        t0 = time.perf_counter()
+        deadlines = (t0 + offsets).tolist()
+        for k in range(len(dwell)):
+            wait_until(deadlines[k], spin)
+            errors[k] = time.perf_counter() - deadlines[k]
+            self.set_point(k)
+        wait_until(deadlines[-1], spin)
+
+        return ScanTiming(offsets[:-1], errors, time.perf_counter() - t0)
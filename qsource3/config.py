@@ -0,0 +1,358 @@
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+from qsource3.massfilter import PiecewisePolynomial, Quadrupole, interp_fnc
+from qsource3.scan import ScanPlan
+
+_MAGIC = b"QS3CONF1"
+_ALIGN = 64
+
+
+def _scan_arrays(mz_vec, dwell):
+    # normalize m/z and dwell the same way as ScanPlan does
+    mz = np.maximum(np.asarray(mz_vec, dtype=float), 0.0)
+    dwell = np.broadcast_to(np.asarray(dwell, dtype=float), mz.shape)
+    return mz, dwell
+
+
+def config_key(frequency, r0, calib_pnts_rf, calib_pnts_dc, scans=(), state=None) -> str:
+    r"""
+    Content hash of the inputs of a quadrupole configuration.
+
+    Everything stored by :class:`QuadrupoleConfig` (interpolators and tables of DAC codes)
+    is computed from these inputs, so the hash identifies the configuration.
+
+    :param frequency: RF frequency in Hertz
+    :param r0: characteristic radius in meters
+    :param calib_pnts_rf: calibration points for RF amplitude
+    :param calib_pnts_dc: calibration points for DC difference
+    :param scans: list of tuples ``(mz_vec, dwell)``
+    :param state: dictionary of the quadrupole state (see :meth:`QuadrupoleConfig.from_quadrupole`)
+    :returns: hexadecimal SHA-256 digest
+    """
+    h = hashlib.sha256(_MAGIC)
+    params = {"frequency": float(frequency), "r0": float(r0), "state": state or {}}
+    h.update(json.dumps(params, sort_keys=True).encode())
+    arrays = [calib_pnts_rf, calib_pnts_dc]
+    for mz_vec, dwell in scans:
+        arrays.extend(_scan_arrays(mz_vec, dwell))
+    for a in arrays:
+        a = np.ascontiguousarray(a, dtype=float)
+        h.update(str(a.shape).encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+class QuadrupoleConfig:
+    r"""
+    Configuration of :class:`qsource3.massfilter.Quadrupole` which can be saved
+    to a compact binary file and loaded without any recomputation.
+
+    The configuration contains frequency, :math:`r_0`, calibration points,
+    coefficients of the calibration interpolators (see
+    :class:`qsource3.massfilter.PiecewisePolynomial`) and optionally tables
+    of DAC codes (mV) of precompiled scans (see :class:`qsource3.scan.ScanPlan`).
+    The arrays of a loaded configuration are memory mapped from the file.
+
+    .. code-block:: python
+
+        config = QuadrupoleConfig.from_quadrupole(q, plans=[plan])
+        config.save("q1.qs3")
+
+        # next start
+        config = QuadrupoleConfig.load("q1.qs3")
+        q = config.create_quadrupole(driver)
+        plan = config.plans(q)[0]
+
+    :param frequency: RF frequency in Hertz
+    :param r0: characteristic radius in meters
+    :param calib_pnts_rf: calibration points for RF amplitude
+    :param calib_pnts_dc: calibration points for DC difference
+    :param rf_fnc: interpolator of ``calib_pnts_rf`` (None - built by :func:`qsource3.massfilter.interp_fnc`)
+    :param dc_fnc: interpolator of ``calib_pnts_dc`` (None - built by :func:`qsource3.massfilter.interp_fnc`)
+    :param scans: list of dictionaries with 1D arrays ``mz``, ``dwell``,
+                  ``dc1_mv``, ``dc2_mv`` and ``ac_mv``
+    :param state: dictionary of the quadrupole state the scans were compiled with
+    """
+
+    def __init__(
+        self,
+        frequency,
+        r0,
+        calib_pnts_rf=(),
+        calib_pnts_dc=(),
+        rf_fnc=None,
+        dc_fnc=None,
+        scans=(),
+        state=None,
+    ):
+        self.frequency = float(frequency)
+        self.r0 = float(r0)
+        self.calib_pnts_rf = np.asarray(calib_pnts_rf, dtype=float)
+        self.calib_pnts_dc = np.asarray(calib_pnts_dc, dtype=float)
+        self.rf_fnc = interp_fnc(self.calib_pnts_rf) if rf_fnc is None else rf_fnc
+        self.dc_fnc = interp_fnc(self.calib_pnts_dc) if dc_fnc is None else dc_fnc
+        self.scans = list(scans)
+        self.state = dict(state or {})
+
+    @classmethod
+    def from_quadrupole(cls, quadrupole, plans=()):
+        """
+        Create configuration of the quadrupole.
+
+        :param quadrupole: instance of :class:`qsource3.massfilter.Quadrupole`
+        :param plans: list of :class:`qsource3.scan.ScanPlan` compiled by the quadrupole
+        """
+        scans = [
+            {
+                "mz": plan.mz,
+                "dwell": plan.dwell,
+                "dc1_mv": plan.dc1_mv,
+                "dc2_mv": plan.dc2_mv,
+                "ac_mv": plan.ac_mv,
+            }
+            for plan in plans
+        ]
+        return cls(
+            quadrupole.frequency,
+            quadrupole.r0,
+            quadrupole._calib_pnts_rf,
+            quadrupole._calib_pnts_dc,
+            quadrupole._interp_fnc_calib_pnts_rf,
+            quadrupole._interp_fnc_calib_pnts_dc,
+            scans,
+            cls._quadrupole_state(quadrupole),
+        )
+
+    @staticmethod
+    def _quadrupole_state(quadrupole):
+        driver = quadrupole._driver
+        return {
+            "dc_offst": float(quadrupole.dc_offst or 0.0),
+            "is_dc_on": bool(quadrupole.is_dc_on),
+            "is_rod_polarity_positive": bool(quadrupole.is_rod_polarity_positive),
+            "max_dc": float(driver.MAX_DC),
+            "max_rf_amp_pp": float(driver.MAX_RF_AMP_PP),
+        }
+
+    @property
+    def key(self) -> str:
+        """Content hash of the configuration (see :func:`config_key`)."""
+        return config_key(
+            self.frequency,
+            self.r0,
+            self.calib_pnts_rf,
+            self.calib_pnts_dc,
+            [(scan["mz"], scan["dwell"]) for scan in self.scans],
+            self.state,
+        )
+
+    def _arrays(self):
+        arrays = {
+            "calib_pnts_rf": self.calib_pnts_rf,
+            "calib_pnts_dc": self.calib_pnts_dc,
+            "rf_breaks": self.rf_fnc.breaks,
+            "rf_coeffs": self.rf_fnc.coeffs,
+            "dc_breaks": self.dc_fnc.breaks,
+            "dc_coeffs": self.dc_fnc.coeffs,
+        }
+        for i, scan in enumerate(self.scans):
+            arrays[f"scan{i}_mz"] = np.asarray(scan["mz"], dtype=np.float64)
+            arrays[f"scan{i}_dwell"] = np.asarray(scan["dwell"], dtype=np.float64)
+            for name in ("dc1_mv", "dc2_mv", "ac_mv"):
+                arrays[f"scan{i}_{name}"] = np.asarray(scan[name], dtype=np.int32)
+        return arrays
+
+    def save(self, path):
+        """
+        Save the configuration to binary file.
+
+        The file starts with a JSON header (parameters, content hash and layout of the arrays)
+        followed by the raw arrays aligned to 64 bytes. The file is written atomically.
+
+        :param path: path to the file
+        """
+        arrays = {name: np.ascontiguousarray(a) for name, a in self._arrays().items()}
+        layout = {}
+        offset = 0
+        for name, a in arrays.items():
+            layout[name] = [a.dtype.str, list(a.shape), offset]
+            offset += -(-a.nbytes // _ALIGN) * _ALIGN
+        header = json.dumps(
+            {
+                "key": self.key,
+                "frequency": self.frequency,
+                "r0": self.r0,
+                "state": self.state,
+                "n_scans": len(self.scans),
+                "arrays": layout,
+            }
+        ).encode()
+        start = -(-(len(_MAGIC) + 4 + len(header)) // _ALIGN) * _ALIGN
+
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_MAGIC + struct.pack("<I", len(header)) + header)
+            for name, a in arrays.items():
+                f.seek(start + layout[name][2])
+                f.write(a.tobytes())
+            f.truncate(start + offset)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, verify=False):
+        """
+        Load the configuration saved by :meth:`save`.
+
+        The arrays are memory mapped (read-only), the interpolators are created from
+        the saved coefficients, so nothing is recomputed.
+
+        :param path: path to the file
+        :param verify: recompute the content hash and compare it with the saved one
+        :raises ValueError: if the file is not a configuration or the hash does not match
+        """
+        with open(path, "rb") as f:
+            magic = f.read(len(_MAGIC))
+            if magic != _MAGIC:
+                raise ValueError(f"Not a quadrupole configuration: {path}")
+            (size,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(size))
+        start = -(-(len(_MAGIC) + 4 + size) // _ALIGN) * _ALIGN
+
+        arrays = {}
+        for name, (dtype, shape, offset) in header["arrays"].items():
+            shape = tuple(shape)
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(
+                    path, dtype=dtype, mode="r", offset=start + offset, shape=shape
+                )
+
+        scans = [
+            {
+                name: arrays[f"scan{i}_{name}"]
+                for name in ("mz", "dwell", "dc1_mv", "dc2_mv", "ac_mv")
+            }
+            for i in range(header["n_scans"])
+        ]
+        config = cls(
+            header["frequency"],
+            header["r0"],
+            arrays["calib_pnts_rf"],
+            arrays["calib_pnts_dc"],
+            PiecewisePolynomial(arrays["rf_breaks"], arrays["rf_coeffs"]),
+            PiecewisePolynomial(arrays["dc_breaks"], arrays["dc_coeffs"]),
+            scans,
+            header["state"],
+        )
+        if verify and config.key != header["key"]:
+            raise ValueError(f"Content hash of {path} does not match")
+        return config
+
+    def create_quadrupole(self, driver, name="Quadrupole", **kwargs) -> Quadrupole:
+        """
+        Create quadrupole with this configuration.
+
+        :param driver: instance of :class:`qsource3.qsource3driver.QSource3Driver`
+        :param name: name of the quadrupole
+        :param kwargs: other keyword arguments of :class:`qsource3.massfilter.Quadrupole`
+        """
+        q = Quadrupole(self.frequency, self.r0, driver, name=name, **kwargs)
+        q._set_calib_pnts_rf(self.calib_pnts_rf, self.rf_fnc)
+        q._set_calib_pnts_dc(self.calib_pnts_dc, self.dc_fnc)
+        q._is_dc_on = self.state.get("is_dc_on", True)
+        q._is_rod_polarity_positive = self.state.get("is_rod_polarity_positive", True)
+        if self.state.get("dc_offst"):
+            q.dc_offst = self.state["dc_offst"]
+        return q
+
+    def plans(self, quadrupole) -> list:
+        """
+        Create the precompiled scans from the saved tables (see :meth:`qsource3.scan.ScanPlan.from_tables`).
+
+        :param quadrupole: quadrupole created by :meth:`create_quadrupole`
+        :returns: list of :class:`qsource3.scan.ScanPlan`
+        """
+        return [ScanPlan.from_tables(quadrupole, **scan) for scan in self.scans]
+
+
+class QuadrupoleCache:
+    r"""
+    Directory of quadrupole configurations named by their content hash.
+
+    :meth:`load_or_create` computes the hash of the inputs and loads the configuration
+    if it was saved before (warm start), otherwise the quadrupole is created,
+    the scans are compiled and the configuration is saved.
+
+    .. code-block:: python
+
+        cache = QuadrupoleCache("~/.qsource3")
+        q, plans = cache.load_or_create(
+            driver, frequency, r0, calib_pnts_rf, calib_pnts_dc, mz_vecs=[mz_vec], dwell=0.01
+        )
+
+    :param directory: directory of the files (created if it does not exist)
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.expanduser(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        """Path to the file of configuration ``key``."""
+        return os.path.join(self.directory, f"{key}.qs3")
+
+    def load_or_create(
+        self,
+        driver,
+        frequency,
+        r0,
+        calib_pnts_rf=(),
+        calib_pnts_dc=(),
+        mz_vecs=(),
+        dwell=0.0,
+        **kwargs,
+    ):
+        r"""
+        Load or create quadrupole and its precompiled scans.
+
+        :param driver: instance of :class:`qsource3.qsource3driver.QSource3Driver`
+        :param frequency: RF frequency in Hertz
+        :param r0: characteristic radius in meters
+        :param calib_pnts_rf: calibration points for RF amplitude
+        :param calib_pnts_dc: calibration points for DC difference
+        :param mz_vecs: list of 1D arrays of :math:`m/z` of the scans
+        :param dwell: dwell time per point (scalar or 1D array, the same for all the scans)
+        :param kwargs: other keyword arguments of :class:`qsource3.massfilter.Quadrupole`
+        :returns: tuple (:class:`qsource3.massfilter.Quadrupole`, list of :class:`qsource3.scan.ScanPlan`)
+        """
+        state = {
+            "dc_offst": 0.0,
+            "is_dc_on": True,
+            "is_rod_polarity_positive": True,
+            "max_dc": float(driver.MAX_DC),
+            "max_rf_amp_pp": float(driver.MAX_RF_AMP_PP),
+        }
+        key = config_key(
+            frequency,
+            r0,
+            calib_pnts_rf,
+            calib_pnts_dc,
+            [(mz_vec, dwell) for mz_vec in mz_vecs],
+            state,
+        )
+        path = self.path(key)
+        if os.path.exists(path):
+            config = QuadrupoleConfig.load(path)
+            q = config.create_quadrupole(driver, **kwargs)
+            return q, config.plans(q)
+
+        q = Quadrupole(frequency, r0, driver, calib_pnts_rf, calib_pnts_dc, **kwargs)
+        plans = [q.compile_scan(mz_vec, dwell) for mz_vec in mz_vecs]
+        QuadrupoleConfig.from_quadrupole(q, plans).save(path)
+        return q, plans
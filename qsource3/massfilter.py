@@ -1,9 +1,102 @@
+from bisect import bisect_right
+from collections import OrderedDict
+
 import numpy as np
-from scipy import interpolate
-import scipy.constants as sc
-from pymeasure.instruments import Instrument
+from qsource3 import tracing
 from qsource3.qsource3driver import QSource3Driver
 from qsource3.qsource3 import QSource3
+from qsource3.scan import ScanPlan
+
+# physical constants (CODATA 2022), avoids importing scipy.constants
+PI = np.pi
+ATOMIC_MASS = 1.66053906892e-27  # kg
+ELEMENTARY_CHARGE = 1.602176634e-19  # C
+
+
+class PiecewisePolynomial:
+    r"""
+    Piecewise polynomial function with precomputed table of coefficients.
+
+    On interval :math:`[x_i, x_{i+1})` the function is
+    :math:`f(x) = \sum_m c_{m,i} (x - x_i)^{k-m}`
+    (the same convention as
+    `scipy.interpolate.PPoly <https://docs.scipy.org/doc/scipy/reference/generated/scipy.interpolate.PPoly.html>`_).
+    The first and the last polynomial are used for extrapolation.
+
+    The interval is found by bisection. Python scalars are evaluated without numpy,
+    arrays are evaluated by one vectorized pass (:func:`numpy.searchsorted`).
+
+    :param breaks: 1D array of increasing breakpoints :math:`x_0, x_1, ..., x_n`
+    :param coeffs: 2D array of coefficients with shape (k + 1, n)
+    """
+
+    def __init__(self, breaks, coeffs):
+        self.breaks = np.asarray(breaks, dtype=float)
+        self.coeffs = np.asarray(coeffs, dtype=float)
+
+        self._starts = self.breaks[:-1]
+        self._inner = self.breaks[1:-1]
+        # python lists for the scalar fast path
+        self._starts_list = self._starts.tolist()
+        self._inner_list = self._inner.tolist()
+        self._coeffs_list = self.coeffs.T.tolist()
+
+    def __call__(self, x):
+        if isinstance(x, (float, int)):
+            i = bisect_right(self._inner_list, x)
+            dx = x - self._starts_list[i]
+            y = 0.0
+            for c in self._coeffs_list[i]:
+                y = y * dx + c
+            return y
+
+        x = np.asarray(x, dtype=float)
+        i = np.searchsorted(self._inner, x, side="right")
+        dx = x - self._starts[i]
+        y = self.coeffs[0][i]
+        for c in self.coeffs[1:]:
+            y = y * dx + c[i]
+        return y
+
+    @classmethod
+    def constant(cls, y: float):
+        """
+        Create constant function f(x) = y.
+        """
+        return cls([0.0, 0.0], [[y]])
+
+    @classmethod
+    def linear(cls, x0, y0, x1, y1):
+        """
+        Create linear function passing through points (x0, y0) and (x1, y1).
+        """
+        if x1 < x0:
+            x0, y0, x1, y1 = x1, y1, x0, y0
+        return cls([x0, x1], [[(y1 - y0) / (x1 - x0)], [y0]])
+
+    @classmethod
+    def quadratic_spline(cls, x, y):
+        """
+        Create quadratic interpolating spline of points (x, y).
+
+        The spline is identical to ``scipy.interpolate.interp1d(x, y, kind="quadratic")``.
+        Scipy is imported only when this method is called.
+        """
+        from scipy import interpolate
+
+        order = np.argsort(x)
+        x = np.asarray(x, dtype=float)[order]
+        y = np.asarray(y, dtype=float)[order]
+
+        spline = interpolate.make_interp_spline(x, y, k=2)
+        breaks = np.unique(spline.t)
+        starts = breaks[:-1]
+        coeffs = [
+            spline(starts, nu=2) / 2.0,
+            spline(starts, nu=1),
+            spline(starts),
+        ]
+        return cls(breaks, coeffs)
 
 
 def interp_fnc(xy):
@@ -11,119 +104,112 @@ def interp_fnc(xy):
     Create function f(x) interpolaing points (x\ :sub:`0`, y\ :sub:`0`), (x\ :sub:`1`, y\ :sub:`1`), ... .
 
     - f(x) = y\ :sub:`0` for xy = [[x0, y0]]
-    - f(x) = y\ :sub:`0` + (y\ :sub:`1` - y\ :sub:`0`) / (x\ :sub:`1` - x\ :sub:`0`) * x
+    - f(x) = y\ :sub:`0` + (y\ :sub:`1` - y\ :sub:`0`) / (x\ :sub:`1` - x\ :sub:`0`) * (x - x\ :sub:`0`)
       for xy = [[x\ :sub:`0`, y\ :sub:`0`], [x\ :sub:`1`, y\ :sub:`1`]]
     - f(x) is  `quadratic spline interpolation function
       <https://docs.scipy.org/doc/scipy/reference/generated/scipy.interpolate.interp1d.html#scipy.interpolate.interp1d>`_
       for higher number of xy points
     - f(x) = 0 otherwise
 
+    The function is extrapolated outside of the points.
+    The coefficients are precomputed, see :class:`PiecewisePolynomial`.
+
     :param xy: 2D array [[x\ :sub:`0`, y\ :sub:`0`], [x\ :sub:`1`, y\ :sub:`1`], ...]
-    :returns: 1D function
+    :returns: 1D function (instance of :class:`PiecewisePolynomial`)
     """
     array = np.array(xy)
 
     if array.shape[0] == 1:
-        return lambda v: array[0, 1] * np.ones_like(v)
+        return PiecewisePolynomial.constant(array[0, 1])
 
     if array.shape[0] == 2:
-        return interpolate.interp1d(
-            array[:, 0], array[:, 1], fill_value="extrapolate", kind="slinear"
+        return PiecewisePolynomial.linear(
+            array[0, 0], array[0, 1], array[1, 0], array[1, 1]
         )
 
     if array.shape[0] > 2:
-        return interpolate.interp1d(
-            array[:, 0], array[:, 1], fill_value="extrapolate", kind="quadratic"
-        )
+        return PiecewisePolynomial.quadratic_spline(array[:, 0], array[:, 1])
 
-    return lambda v: np.zeros_like(v)
+    return PiecewisePolynomial.constant(0.0)
 
 
-class Quadrupole(QSource3):
+class QuadrupoleCalibration:
     r"""
-    Quadrupole mass filter high-level class.
+    Calibration and voltage calculations shared by :class:`Quadrupole`
+    and :class:`qsource3.aio.AsyncQuadrupole`.
 
-    Voltage applied to quadrupole poles A and B is:
-
-    .. math::
-        {\phi}_{\text{A}} = U_{\text{ofst}} + U_{\text{diff}} + V \cos(2{\pi} f)
-
-        {\phi}_{\text{B}} = U_{\text{ofst}} - U_{\text{diff}} - V \cos(2{\pi} f)
-
-    RF amplitude :math:`V` is given by:
-
-    .. math::
-        V = q_0 ({\pi} f r_0)^2 [1 + {\delta}(m/z)] (m/z)
-        :label: eq_V
-
-    where :math:`q_0 = 0.706`, :math:`f` is frequency (in Hertz),
-    :math:`r_0` is characteristic radius of quadrupole,
-    :math:`(m/z)` is mass over charge ratio (in u/e),
-    and :math:`{\delta}(m/z)` is mass calibration function.
-
-    In mass filtering mode, the DC difference :math:`U_{\text{diff}}` is given by:
-
-    .. math::
-        U_{\text{diff}} = \frac{1}{2} \frac{a_0}{q_0} [1 + {\rho}(m/z)] V(m/z)
-        :label: eq_U
-
-    where :math:`a_0 = 0.237`,
-    and :math:`{\rho}(m/z) < 0` is resolution calibration function (the resolution is infinitive for :math:`{\rho}(m/z) = 0`).
+    The class does not communicate with the device.
+    """
 
-    If :math:`U_{\text{diff}} = 0` then the quadrupole acts as an ion guide. This option can be switched by :attr:`is_dc_on`.
+    # number of intervals of the table used by :meth:`mz_from_rf`
+    INVERSE_TABLE_SIZE = 4096
 
-    The functions :math:`{\delta}(m/z)` and :math:`{\rho}(m/z)` are interpolated from 2D arrays
-    [[:math:`(m/z)_0`, :math:`{\delta}_0`], [:math:`(m/z)_1`, :math:`{\delta}_1`], ...]
-    and
-    [[:math:`(m/z)_0`, :math:`{\rho}_0`], [:math:`(m/z)_1`, :math:`{\rho}_1`], ...].
-    See :attr:`calib_pnts_rf`, :attr:`calib_pnts_dc`, :attr:`interp_fnc`.
-
-    :param frequency: RF frequency of the quadrupole :math:`f` in Hertz
-    :param r0: characteristic radius of the quadrupole :math:`r_0` in meters
-    :param driver: instance of :class:`qsource3.qsource3driver.QSource3Driver`
-    :param calib_pnts_rf: calibration points for RF amplitude (m/z calibration), optional
-    :param calib_pnts_dc: calibration points for DC difference (resolution), optional
-    """
-    def __init__(
-        self,
-        frequency: float,
-        r0: float,
-        driver: QSource3Driver,
-        calib_pnts_rf=[],
-        calib_pnts_dc=[],
-        name="Quadrupole",
-        **kwargs
+    def _init_calibration(
+        self, frequency, r0, calib_pnts_rf, calib_pnts_dc, uv_cache_size=0
     ):
-        super().__init__(driver=driver, name=name, **kwargs)
+        self._uv_cache = OrderedDict()  # quantized m/z => (U, V)
+        self._uv_cache_size = uv_cache_size
+        self._uv_cache_hits = 0
+        self._uv_cache_misses = 0
 
         self._set_calib_pnts_rf(calib_pnts_rf)
         self._set_calib_pnts_dc(calib_pnts_dc)
 
-        self._mz = None
+        self._frequency = frequency
+        self._r0 = r0
+        self._update_rf_factor()
 
-        self._is_rod_polarity_positive = True  # rods polarity
-        self._is_dc_on = True  #  True => mass filter, False => ion guide
+        # 1/2 * a0/q0 = 0.16784 - theoretical value for infinity resolution
+        self._dcFactor = 0.5 * 0.237 / 0.706
 
+    def _update_rf_factor(self):
         # RF_amp = _rfFactor * (m/z)
         # _rfFactor = q0 * pi**2 * (r0 * frequency)**2
         # q0 = 0.706
         self._rfFactor = (
             0.706
-            * sc.pi**2
-            * sc.atomic_mass
-            / sc.elementary_charge
-            * (r0 * frequency) ** 2
+            * PI**2
+            * ATOMIC_MASS
+            / ELEMENTARY_CHARGE
+            * (self._r0 * self._frequency) ** 2
         )
 
-        # 1/2 * a0/q0 = 0.16784 - theoretical value for infinity resolution
-        self._dcFactor = 0.5 * 0.237 / 0.706
+        # step of m/z corresponding to the resolution of RF amplitude (0-to-peak)
+        self._mz_quantum = self._driver.AC_RESOLUTION / 2 / self._rfFactor
 
-        # reset voltages
-        self.set_voltages(0, 0, 0)
+        self._uv_cache.clear()
+        self._inverse_table = None
+
+    @property
+    def frequency(self) -> float:
+        r"""
+        RF frequency of the quadrupole :math:`f` in Hertz.
+        """
+        return self._frequency
 
-    def _set_calib_pnts_rf(self, xy):
+    @frequency.setter
+    def frequency(self, v):
+        self._frequency = v
+        self._update_rf_factor()
+
+    @property
+    def r0(self) -> float:
+        r"""
+        Characteristic radius of the quadrupole :math:`r_0` in meters.
+        """
+        return self._r0
+
+    @r0.setter
+    def r0(self, v):
+        self._r0 = v
+        self._update_rf_factor()
+
+    def _set_calib_pnts_rf(self, xy, fnc=None):
+        # fnc - already built interpolation function of xy (see qsource3.config)
         self._calib_pnts_rf = np.array(xy)
-        self._interp_fnc_calib_pnts_rf = interp_fnc(self._calib_pnts_rf)
+        self._interp_fnc_calib_pnts_rf = interp_fnc(self._calib_pnts_rf) if fnc is None else fnc
+        self._inverse_table = None  # rebuilt by mz_from_rf on demand
+        self._uv_cache.clear()
 
     @property
     def calib_pnts_rf(self):
@@ -154,9 +240,10 @@ class Quadrupole(QSource3):
         """
         return self._interp_fnc_calib_pnts_rf(mz)
 
-    def _set_calib_pnts_dc(self, xy):
+    def _set_calib_pnts_dc(self, xy, fnc=None):
         self._calib_pnts_dc = np.array(xy)
-        self._interp_fnc_calib_pnts_dc = interp_fnc(self._calib_pnts_dc)
+        self._interp_fnc_calib_pnts_dc = interp_fnc(self._calib_pnts_dc) if fnc is None else fnc
+        self._uv_cache.clear()
 
     @property
     def calib_pnts_dc(self):
@@ -187,6 +274,278 @@ class Quadrupole(QSource3):
         """
         return self._interp_fnc_calib_pnts_dc(mz)
 
+    def calc_uv(self, mz: float) -> (float, float):
+        r"""
+        Calculate RF amplitude :math:`V` and DC difference :math:`U_{\text{diff}}`.
+        for given :math:`m/z` according to :eq:`eq_V` and :eq:`eq_U`
+
+        If the cache is enabled (see :attr:`uv_cache_size`), scalar :math:`m/z`
+        is rounded to the step corresponding to the resolution of RF amplitude
+        of the device and the result is cached.
+
+        :param mz: :math:`m/z`
+        :returns: (:math:`U_{\text{diff}}`, :math:`V`)
+        """
+        tracer = tracing.active
+        if tracer is None:
+            return self._calc_uv_cached(mz)
+        start = tracer.clock()
+        uv = self._calc_uv_cached(mz)
+        tracer.add("calc_uv", "calibration", start)
+        return uv
+
+    def _calc_uv_cached(self, mz):
+        if not self._uv_cache_size or not isinstance(mz, (float, int)):
+            return self._calc_uv(mz)
+
+        cache = self._uv_cache
+        key = round(mz / self._mz_quantum)
+        uv = cache.get(key)
+        if uv is not None:
+            cache.move_to_end(key)
+            self._uv_cache_hits += 1
+            return uv
+
+        self._uv_cache_misses += 1
+        uv = self._calc_uv(key * self._mz_quantum)
+        cache[key] = uv
+        if len(cache) > self._uv_cache_size:
+            cache.popitem(last=False)
+        return uv
+
+    def _calc_uv(self, mz):
+        v = self._rfFactor * (1.0 + self.interp_fnc_calib_pnts_rf(mz)) * mz
+        u = self._dcFactor * (1.0 + self.interp_fnc_calib_pnts_dc(mz)) * v
+        return u, v
+
+    @property
+    def uv_cache_size(self) -> int:
+        r"""
+        Maximum number of cached results of :meth:`calc_uv` (0 - cache disabled).
+
+        The least recently used results are dropped. The cache is cleared when
+        :attr:`calib_pnts_rf`, :attr:`calib_pnts_dc`, :attr:`frequency` or :attr:`r0` is set.
+        """
+        return self._uv_cache_size
+
+    @uv_cache_size.setter
+    def uv_cache_size(self, v):
+        self._uv_cache_size = v
+        while len(self._uv_cache) > v:
+            self._uv_cache.popitem(last=False)
+
+    def uv_cache_info(self) -> dict:
+        r"""
+        Statistics of :meth:`calc_uv` cache.
+
+        :returns: dictionary with keys ``hits``, ``misses``, ``size`` and ``maxsize``
+        """
+        return {
+            "hits": self._uv_cache_hits,
+            "misses": self._uv_cache_misses,
+            "size": len(self._uv_cache),
+            "maxsize": self._uv_cache_size,
+        }
+
+    def calc_uv_array(self, mz_vec) -> (np.ndarray, np.ndarray):
+        r"""
+        Vectorized version of :meth:`calc_uv`.
+
+        Both calibration functions are evaluated once for the whole array.
+
+        :param mz_vec: 1D array of :math:`m/z` values
+        :returns: (:math:`U_{\text{diff}}`, :math:`V`) as 1D numpy arrays
+        """
+        mz = np.asarray(mz_vec, dtype=float)
+        v = self._rfFactor * (1.0 + self._interp_fnc_calib_pnts_rf(mz)) * mz
+        u = self._dcFactor * (1.0 + self._interp_fnc_calib_pnts_dc(mz)) * v
+        return u, v
+
+    def calc_voltages_array(self, mz_vec) -> (np.ndarray, np.ndarray, np.ndarray):
+        r"""
+        Calculate DC voltages :math:`U_1`, :math:`U_2` and RF amplitude :math:`V`
+        for the whole array of :math:`m/z` values.
+
+        The result is the same as setting :attr:`mz` point by point, i.e. negative
+        :math:`m/z` are treated as 0 and the actual :attr:`dc_offst`, :attr:`is_dc_on`
+        and :attr:`is_rod_polarity_positive` are taken into account.
+
+        :param mz_vec: 1D array of :math:`m/z` values
+        :returns: (:math:`U_1`, :math:`U_2`, :math:`V`) as 1D numpy arrays (in Volts,
+                  :math:`V` is 0-to-peak)
+        """
+        mz = np.maximum(np.asarray(mz_vec, dtype=float), 0.0)
+        u, v = self.calc_uv_array(mz)
+
+        offst = self.dc_offst
+        if not self.is_dc_on:
+            u = np.zeros_like(v)
+        elif not self.is_rod_polarity_positive:
+            u = -u
+
+        return offst + u, offst - u, v
+
+    def _dc_from_u(self, u: float) -> (float, float):
+        # DC voltages U1, U2 for DC difference u respecting is_dc_on and rods polarity
+        dc1 = self.dc_offst
+        dc2 = self.dc_offst
+
+        if self.is_dc_on:
+            if self.is_rod_polarity_positive:
+                dc1 += u
+                dc2 -= u
+            else:
+                dc1 -= u
+                dc2 += u
+
+        return dc1, dc2
+
+    def _build_inverse_table(self):
+        v_max = self._driver.MAX_RF_AMP_PP / 2
+        mz_max = self.max_mz
+        for _ in range(100):  # extend the table if delta(m/z) < 0 at max_mz
+            if self.calc_uv_array([mz_max])[1][0] >= v_max:
+                break
+            mz_max *= 1.05
+
+        mz = np.linspace(0.0, mz_max, self.INVERSE_TABLE_SIZE + 1)
+        v = self.calc_uv_array(mz)[1]
+        if np.any(np.diff(v) <= 0):
+            raise ValueError(
+                "RF amplitude is not monotone function of m/z, check calib_pnts_rf"
+            )
+        self._inverse_table = (v, mz)
+
+        # estimate the error in the middle of the intervals
+        mz_mid = 0.5 * (mz[1:] + mz[:-1])
+        v_mid = self.calc_uv_array(mz_mid)[1]
+        self._inverse_error = float(np.max(np.abs(self._mz_from_rf(v_mid) - mz_mid)))
+
+    def _mz_from_rf(self, v):
+        v_tab, mz_tab = self._inverse_table
+        mz = np.interp(v, v_tab, mz_tab)
+
+        # one Newton step with the slope of the table interval
+        i = np.clip(np.searchsorted(mz_tab, mz, side="right") - 1, 0, len(mz_tab) - 2)
+        slope = (v_tab[i + 1] - v_tab[i]) / (mz_tab[i + 1] - mz_tab[i])
+        mz = mz + (v - self.calc_uv_array(mz)[1]) / slope
+        return np.maximum(mz, 0.0)
+
+    def mz_from_rf(self, v_array) -> np.ndarray:
+        r"""
+        Calculate :math:`m/z` from RF amplitude :math:`V` - inverse of :eq:`eq_V`
+        including mass calibration :math:`{\delta}(m/z)`.
+
+        The inverse function is tabulated (:attr:`INVERSE_TABLE_SIZE` intervals
+        from 0 to the maximum RF amplitude), the table is created on the first call
+        after :attr:`calib_pnts_rf` was set.
+        The values are interpolated from the table and refined by one Newton step.
+        The maximum error is given by :attr:`mz_from_rf_error`.
+
+        :param v_array: RF amplitude :math:`V` (in Volts, 0-to-peak), scalar or array,
+                        e.g. logged values of :attr:`qsource3.qsource3.QSource3.rf`
+        :returns: :math:`m/z` as numpy array
+        :raises ValueError: if :math:`V(m/z)` is not monotone
+        """
+        if self._inverse_table is None:
+            self._build_inverse_table()
+        return self._mz_from_rf(np.asarray(v_array, dtype=float))
+
+    @property
+    def mz_from_rf_error(self) -> float:
+        r"""
+        Estimated maximum absolute error of :meth:`mz_from_rf` (in :math:`m/z` units)
+        within the range of the device.
+        """
+        if self._inverse_table is None:
+            self._build_inverse_table()
+        return self._inverse_error
+
+    @property
+    def max_mz(self) -> float:
+        r"""
+        Maximum :math:`m/z` of this quadrupole.
+
+        :math:`{\delta}(m/z)` and :math:`{\rho}(m/z)` are not accounted.
+        """
+        return self._driver.MAX_RF_AMP_PP / 2 / self._rfFactor
+
+
+class Quadrupole(QuadrupoleCalibration, QSource3):
+    r"""
+    Quadrupole mass filter high-level class.
+
+    Voltage applied to quadrupole poles A and B is:
+
+    .. math::
+        {\phi}_{\text{A}} = U_{\text{ofst}} + U_{\text{diff}} + V \cos(2{\pi} f)
+
+        {\phi}_{\text{B}} = U_{\text{ofst}} - U_{\text{diff}} - V \cos(2{\pi} f)
+
+    RF amplitude :math:`V` is given by:
+
+    .. math::
+        V = q_0 ({\pi} f r_0)^2 [1 + {\delta}(m/z)] (m/z)
+        :label: eq_V
+
+    where :math:`q_0 = 0.706`, :math:`f` is frequency (in Hertz),
+    :math:`r_0` is characteristic radius of quadrupole,
+    :math:`(m/z)` is mass over charge ratio (in u/e),
+    and :math:`{\delta}(m/z)` is mass calibration function.
+
+    In mass filtering mode, the DC difference :math:`U_{\text{diff}}` is given by:
+
+    .. math::
+        U_{\text{diff}} = \frac{1}{2} \frac{a_0}{q_0} [1 + {\rho}(m/z)] V(m/z)
+        :label: eq_U
+
+    where :math:`a_0 = 0.237`,
+    and :math:`{\rho}(m/z) < 0` is resolution calibration function (the resolution is infinitive for :math:`{\rho}(m/z) = 0`).
+
+    If :math:`U_{\text{diff}} = 0` then the quadrupole acts as an ion guide. This option can be switched by :attr:`is_dc_on`.
+
+    The functions :math:`{\delta}(m/z)` and :math:`{\rho}(m/z)` are interpolated from 2D arrays
+    [[:math:`(m/z)_0`, :math:`{\delta}_0`], [:math:`(m/z)_1`, :math:`{\delta}_1`], ...]
+    and
+    [[:math:`(m/z)_0`, :math:`{\rho}_0`], [:math:`(m/z)_1`, :math:`{\rho}_1`], ...].
+    See :attr:`calib_pnts_rf`, :attr:`calib_pnts_dc`, :attr:`interp_fnc`.
+
+    :param frequency: RF frequency of the quadrupole :math:`f` in Hertz
+    :param r0: characteristic radius of the quadrupole :math:`r_0` in meters
+    :param driver: instance of :class:`qsource3.qsource3driver.QSource3Driver`
+    :param calib_pnts_rf: calibration points for RF amplitude (m/z calibration), optional
+    :param calib_pnts_dc: calibration points for DC difference (resolution), optional
+    :param uv_cache_size: size of :meth:`calc_uv` cache (0 - no cache), optional
+    """
+    _state_attrs = QSource3._state_attrs + (
+        "_mz",
+        "_is_rod_polarity_positive",
+        "_is_dc_on",
+    )
+
+    def __init__(
+        self,
+        frequency: float,
+        r0: float,
+        driver: QSource3Driver,
+        calib_pnts_rf=[],
+        calib_pnts_dc=[],
+        name="Quadrupole",
+        uv_cache_size=0,
+        **kwargs
+    ):
+        super().__init__(driver=driver, name=name, **kwargs)
+
+        self._init_calibration(frequency, r0, calib_pnts_rf, calib_pnts_dc, uv_cache_size)
+
+        self._mz = None
+
+        self._is_rod_polarity_positive = True  # rods polarity
+        self._is_dc_on = True  #  True => mass filter, False => ion guide
+
+        # reset voltages
+        self.set_voltages(0, 0, 0)
+
     @property
     def mz(self)->float:
         r"""
@@ -207,9 +566,14 @@ class Quadrupole(QSource3):
     def mz(self, mz:float):
         if mz < 0:
             mz = 0
+        tracer = tracing.active
+        if tracer is not None:
+            start = tracer.clock()
         U, V = self.calc_uv(mz)
         self.set_uv(U, V)
         self._mz = mz
+        if tracer is not None:
+            tracer.add("mz", "point", start)
 
     @property
     def is_rod_polarity_positive(self)->bool:
@@ -244,17 +608,17 @@ class Quadrupole(QSource3):
             self._is_dc_on = v
             self.mz = self.mz  # reset mz => set correct DC voltages
 
-    def calc_uv(self, mz: float) -> (float, float):
+    def compile_scan(self, mz_vec, dwell=0.0) -> ScanPlan:
         r"""
-        Calculate RF amplitude :math:`V` and DC difference :math:`U_{\text{diff}}`.
-        for given :math:`m/z` according to :eq:`eq_V` and :eq:`eq_U`
+        Precompile scan over given :math:`m/z` values.
 
-        :param mz: :math:`m/z`
-        :returns: (:math:`U_{\text{diff}}`, :math:`V`)
+        See :class:`qsource3.scan.ScanPlan`.
+
+        :param mz_vec: 1D array of :math:`m/z` values
+        :param dwell: dwell time per point in seconds (scalar or 1D array)
+        :returns: instance of :class:`qsource3.scan.ScanPlan`
         """
-        v = self._rfFactor * (1.0 + self.interp_fnc_calib_pnts_rf(mz)) * mz
-        u = self._dcFactor * (1.0 + self.interp_fnc_calib_pnts_dc(mz)) * v
-        return u, v
+        return ScanPlan(self, mz_vec, dwell)
 
     def set_uv(self, u: float, v: float):
         r"""
@@ -267,24 +631,5 @@ class Quadrupole(QSource3):
         :param u: DC difference :math:`U_{\text{diff}}`
         :param v: RF amplitude :math:`V`
         """
-        dc1 = self.dc_offst
-        dc2 = self.dc_offst
-
-        if self.is_dc_on:
-            if self.is_rod_polarity_positive:
-                dc1 += u
-                dc2 -= u
-            else:
-                dc1 -= u
-                dc2 += u
-
+        dc1, dc2 = self._dc_from_u(u)
         self.set_voltages(dc1, dc2, v)
-
-    @property
-    def max_mz(self) -> float:
-        r"""
-        Maximum :math:`m/z` of this quadrupole.
-
-        :math:`{\delta}(m/z)` and :math:`{\rho}(m/z)` are not accounted.
-        """
-        return self._driver.MAX_RF_AMP_PP / 2 / self._rfFactor
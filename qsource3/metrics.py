@@ -0,0 +1,165 @@
+from bisect import bisect_right
+from collections import namedtuple
+
+CommandEvent = namedtuple(
+    "CommandEvent", ["kind", "command", "latency", "bytes_sent", "bytes_received", "error"]
+)
+CommandEvent.__doc__ = """
+Record of one command passed to the hooks of :class:`DriverMetrics`.
+
+:param kind: ``"ask_ok"`` (command expecting ``OK`` reply) or ``"ask"`` (query)
+:param command: command type, e.g. ``"#C"``
+:param latency: round trip time in seconds (from writing the command to reading the reply)
+:param bytes_sent: number of bytes written including the termination
+:param bytes_received: number of bytes read including the termination (0 on timeout)
+:param error: None or description of the error (invalid reply or exception)
+"""
+
+
+class LatencyHistogram:
+    r"""
+    Histogram of latencies with logarithmic bins.
+
+    The bins are ``bins_per_decade`` per decade from ``min_latency`` to ``max_latency``,
+    plus underflow and overflow bins.
+
+    :param min_latency: lower edge of the first bin in seconds
+    :param max_latency: upper edge of the last bin in seconds
+    :param bins_per_decade: number of bins per decade
+    """
+
+    def __init__(self, min_latency=1e-6, max_latency=10.0, bins_per_decade=10):
+        n = 0
+        self.edges = []
+        while True:
+            edge = min_latency * 10.0 ** (n / bins_per_decade)
+            if edge > max_latency * (1 + 1e-9):
+                break
+            self.edges.append(edge)
+            n += 1
+        self.counts = [0] * (len(self.edges) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def record(self, latency: float):
+        """Add one latency in seconds."""
+        self.counts[bisect_right(self.edges, latency)] += 1
+        self.count += 1
+        self.total += latency
+        if latency < self.min:
+            self.min = latency
+        if latency > self.max:
+            self.max = latency
+
+    @property
+    def mean(self) -> float:
+        """Mean latency in seconds (NaN if empty)."""
+        return self.total / self.count if self.count else float("nan")
+
+    def percentile(self, q: float) -> float:
+        """
+        Estimate of percentile ``q`` (0 - 100) in seconds, given by the upper edge of the bin.
+        The result is limited by the observed minimum and maximum (NaN if empty).
+        """
+        if not self.count:
+            return float("nan")
+        rank = q / 100.0 * self.count
+        cumulative = 0
+        for i, c in enumerate(self.counts):
+            cumulative += c
+            if c and cumulative >= rank:
+                edge = self.edges[i] if i < len(self.edges) else self.max
+                return min(max(edge, self.min), self.max)
+        return self.max
+
+
+class DriverMetrics:
+    r"""
+    Counters of the communication of :class:`qsource3.qsource3driver.QSource3Driver`.
+
+    Enabled by :meth:`qsource3.qsource3driver.QSource3Driver.enable_metrics`.
+    Every command updates the counters and is passed as :class:`CommandEvent`
+    to the hooks (e.g. exporter of metrics).
+
+    .. code-block:: python
+
+        metrics = driver.enable_metrics()
+        metrics.add_hook(lambda event: print(event))
+        plan.run()
+        print(metrics.summary())
+
+    :param termination_length: length of the termination characters added to every
+                               command and reply
+    """
+
+    def __init__(self, termination_length=1):
+        self.termination_length = termination_length
+        self.hooks = []
+        self.reset()
+
+    def reset(self):
+        """Clear all the counters (the hooks are kept)."""
+        self.commands = {}  # command type => count
+        self.errors = {}  # command type => count
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency = {"ask_ok": LatencyHistogram(), "ask": LatencyHistogram()}
+
+    def add_hook(self, hook):
+        """
+        Add callable called with :class:`CommandEvent` after every command.
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """Remove the hook added by :meth:`add_hook`."""
+        self.hooks.remove(hook)
+
+    def record(self, kind, command, latency, response, error=None):
+        """
+        Record one command.
+
+        :param kind: ``"ask_ok"`` or ``"ask"``
+        :param command: command as ``str`` (without termination) or ``bytes`` (with termination)
+        :param latency: round trip time in seconds
+        :param response: reply without termination (None if no reply was received)
+        :param error: None or description of the error
+        """
+        if isinstance(command, bytes):
+            sent = len(command)
+            command = command.decode(errors="replace")
+        else:
+            sent = len(command) + self.termination_length
+        name = command.split(None, 1)[0] if command.strip() else command
+        received = 0 if response is None else len(response) + self.termination_length
+
+        self.commands[name] = self.commands.get(name, 0) + 1
+        self.bytes_sent += sent
+        self.bytes_received += received
+        self.latency[kind].record(latency)
+        if error is not None:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+        if self.hooks:
+            event = CommandEvent(kind, name, latency, sent, received, error)
+            for hook in self.hooks:
+                hook(event)
+
+    def summary(self) -> str:
+        """Summary of the counters as text."""
+        lines = [
+            f"bytes sent: {self.bytes_sent}, bytes received: {self.bytes_received}",
+            f"{'command':10s} {'count':>8s} {'errors':>8s}",
+        ]
+        for name, count in sorted(self.commands.items()):
+            lines.append(f"{name:10s} {count:8d} {self.errors.get(name, 0):8d}")
+        for kind, h in self.latency.items():
+            if h.count:
+                lines.append(
+                    f"{kind} latency: mean {h.mean * 1e6:.1f} us, "
+                    f"p50 {h.percentile(50) * 1e6:.1f} us, p99 {h.percentile(99) * 1e6:.1f} us, "
+                    f"max {h.max * 1e6:.1f} us"
+                )
+        return "\n".join(lines)
@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+
 from pymeasure.instruments import Instrument
 from qsource3.qsource3driver import QSource3Driver
 
@@ -20,6 +22,8 @@ class QSource3(Instrument):
     with DC offset (:math:`U_{\text{ofst}} = (U_1 + U_2) / 2`)
     and DC difference (:math:`U_{\text{diff}} = (U_1 - U_2) / 2`).
 
+    Several changes can be sent to the device together using :meth:`batch`.
+
     :param driver: driver class for communication with QSource3 device.
     """
     def __init__(self, driver: QSource3Driver, name="QSource3", **kwargs):
@@ -30,6 +34,56 @@ class QSource3(Instrument):
         self._dc2 = None
         self._rf = None
 
+        self._batch_depth = 0
+
+    # attributes restored when a batch fails
+    _state_attrs = ("_dc1", "_dc2", "_rf")
+
+    @contextmanager
+    def batch(self):
+        r"""
+        Context manager gathering changes of voltages.
+
+        Inside the context the setters only update the state of this object.
+        On exit the changes are sent to the device by
+        :meth:`qsource3.qsource3driver.QSource3Driver.update_voltages`,
+        i.e. as one ``#C`` command or the smallest set of commands.
+        If an exception is raised inside the context (or while sending),
+        the changes are discarded and the previous state is restored.
+
+        .. code-block:: python
+
+            with q.batch():
+                q.dc_offst = -10
+                q.dc_diff = 5  # sent together with dc_offst as one command
+
+        Nested contexts are sent on exit of the outermost one.
+        """
+        if self._batch_depth:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+            return
+
+        snapshot = {a: getattr(self, a) for a in self._state_attrs}
+        self._batch_depth = 1
+        try:
+            yield self
+            self._batch_depth = 0
+            self._driver.update_voltages(
+                self._dc1,
+                self._dc2,
+                None if self._rf is None else 2.0 * self._rf,  # amp 0-P to amp P-P
+            )
+        except BaseException:
+            for a, v in snapshot.items():
+                setattr(self, a, v)
+            raise
+        finally:
+            self._batch_depth = 0
+
     def set_voltages(self, dc1: float, dc2: float, rf: float):
         r"""
         Set DC voltages and RF amplitude simultaneosly.
@@ -38,7 +92,8 @@ class QSource3(Instrument):
         :param dc2: DC voltage :math:`U_2`  (in Volts)
         :param rf: RF amplitude :math:`V` (in Volts, 0-to-peak)
         """
-        self._driver.set_voltages(dc1, dc2, 2.0 * rf)
+        if not self._batch_depth:
+            self._driver.set_voltages(dc1, dc2, 2.0 * rf)
         self._dc1 = dc1
         self._dc2 = dc2
         self._rf = rf
@@ -51,7 +106,8 @@ class QSource3(Instrument):
 
     @rf.setter
     def rf(self, v):
-        self._driver.ac = 2.0 * v  # amp 0-P to amp P-P
+        if not self._batch_depth:
+            self._driver.ac = 2.0 * v  # amp 0-P to amp P-P
         self._rf = v
 
     @property
@@ -62,7 +118,8 @@ class QSource3(Instrument):
 
     @dc1.setter
     def dc1(self, v):
-        self._driver.dc1 = v
+        if not self._batch_depth:
+            self._driver.dc1 = v
         self._dc1 = v
 
     @property
@@ -73,7 +130,8 @@ class QSource3(Instrument):
 
     @dc2.setter
     def dc2(self, v):
-        self._driver.dc2 = v
+        if not self._batch_depth:
+            self._driver.dc2 = v
         self._dc2 = v
 
     @property
@@ -1,19 +1,50 @@
+from collections import deque
+from contextlib import contextmanager
+from threading import get_ident
+from time import perf_counter
+
+import numpy as np
 from pymeasure.instruments import Instrument
 from pymeasure.instruments.validators import truncated_range, strict_discrete_set
 
+from qsource3 import tracing
+from qsource3.metrics import DriverMetrics
+from qsource3.recorder import CommandRecorder
+from qsource3.scheduler import PRIORITY_QUERY, PRIORITY_SETPOINT, PriorityLock
+
 
 class QSource3Driver(Instrument):
     """
     Communication driver for QSource3 device.
 
+    The driver keeps a write-through model of the DC and AC registers of the device
+    (integer mV, i.e. after truncation and rounding). Setting a value which the device
+    already holds is not sent to the device. The model is invalidated by any invalid reply
+    and by :meth:`set_range`; use :meth:`invalidate_registers` if the device was changed
+    by other means (e.g. power cycle).
+
+    The driver can be shared by several threads. Every command (write and reading of
+    its reply) holds a :class:`qsource3.scheduler.PriorityLock`, commands expecting ``OK``
+    (setpoints) are served before queries and queries before telemetry
+    (see :meth:`priority` and :class:`qsource3.scheduler.Poller`). Setters compare
+    the value with the register model, send the command and update the model
+    under the same lock.
+
     :param adapter: A communication port
     :param name: A name
+    :param register_cache: suppress writes of values the device already holds
+    :param fast_io: write commands expecting ``OK`` directly to the connection
+                    (see :attr:`fast_io`)
     """
 
     MAX_RF_AMP_PP = 650.0  # Volts peak-to-peak
     MAX_DC = 100.0  # Volts
+    DC_RESOLUTION = 0.0023  # Volts, 16 bits DAC
+    AC_RESOLUTION = 0.0094  # Volts peak-to-peak, 16 bits DAC
     
-    def __init__(self, adapter, name="QSource3Driver", **kwargs):
+    def __init__(
+        self, adapter, name="QSource3Driver", register_cache=True, fast_io=True, **kwargs
+    ):
         super().__init__(
             adapter,
             name,
@@ -25,10 +56,399 @@ class QSource3Driver(Instrument):
             **kwargs,
         )
 
+        self._pipeline_window = 0  # 0 => pipelining disabled
+        self._pending = deque()  # (command, t0, thread ident) waiting for reply in pipelined mode
+        self._pipeline_error = None  # error of a reply read by another thread
+
+        self.register_cache = register_cache
+        self._registers = {"dc1": None, "dc2": None, "ac": None}  # mV, None => unknown
+
+        self._metrics = None  # see enable_metrics
+        self._recorder = None  # see start_recording
+
+        self._lock = PriorityLock()
+
+        self._setup_fast_io(fast_io)
+
+    def _setup_fast_io(self, enabled):
+        # raw write and read of the connection bypassing the adapter (None - not available)
+        self._raw_write = None
+        self._raw_read = None
+        write_term = self.write_termination.encode()
+        read_term = self.read_termination.encode()
+        self._write_term = write_term
+        self._ok_reply = b"OK" + read_term
+        if not enabled or not write_term or not read_term:
+            return
+
+        connection = getattr(self.adapter, "connection", None)
+        if hasattr(connection, "readinto") and hasattr(connection, "write"):  # pyserial
+            buffer = bytearray(len(self._ok_reply))
+            view = memoryview(buffer)
+
+            def read():
+                return view[: connection.readinto(buffer)]
+
+            self._raw_write = connection.write
+            self._raw_read = read
+        elif hasattr(connection, "write_raw") and hasattr(connection, "read_bytes"):  # pyvisa
+            n = len(self._ok_reply)
+            self._raw_write = connection.write_raw
+            self._raw_read = lambda: connection.read_bytes(n)
+
+    @property
+    def fast_io(self) -> bool:
+        """
+        True if commands expecting ``OK`` reply are written directly to the connection
+        (pyserial or pyvisa) and the reply is compared with ``OK`` without decoding,
+        bypassing the logging and string handling of the adapter.
+
+        Queries (e.g. :attr:`frequency`) always use the adapter. Adapters without
+        a raw connection (e.g. ``ProtocolAdapter`` used in tests) use the adapter as well.
+        """
+        return self._raw_write is not None
+
     def _ask_ok(self, s):
-        response = self.ask(s)
+        tracer = tracing.active
+        if tracer is not None:
+            start = tracer.clock()
+        lock = self._lock
+        lock.acquire(PRIORITY_SETPOINT)
+        try:
+            pending = self._pending
+            if pending and pending[0][2] != get_ident():
+                self._flush_other_thread()
+            if self._raw_write is not None:
+                if self._recorder is not None:
+                    self._recorder.write(s)
+                t0 = None if self._metrics is None else perf_counter()
+                self._raw_write(s.encode() + self._write_term)
+                if self._pipeline_window:
+                    self._push_pending(s, t0)
+                    return
+                self._read_ok(s, t0)
+                return
+            if self._pipeline_window:
+                if self._recorder is not None:
+                    self._recorder.write(s)
+                t0 = None if self._metrics is None else perf_counter()
+                self.write(s)
+                self._push_pending(s, t0)
+                return
+            if self._metrics is None:
+                response = self._ask(s)
+            else:
+                response = self._timed_ask("ask_ok", s)
+        finally:
+            lock.release()
+            if tracer is not None:
+                tracer.add("serial", "serial", start)
+        if response != "OK":
+            self.invalidate_registers()
+            raise ConnectionError(f"Invalid response: {response} (command {s!r})")
+
+    def _ask_ok_bytes(self, command: bytes):
+        """
+        Write already encoded command (including write termination) and check
+        that the device replied ``OK``.
+
+        See :meth:`encode_voltages`.
+        """
+        tracer = tracing.active
+        if tracer is not None:
+            start = tracer.clock()
+        lock = self._lock
+        lock.acquire(PRIORITY_SETPOINT)
+        try:
+            pending = self._pending
+            if pending and pending[0][2] != get_ident():
+                self._flush_other_thread()
+            if self._recorder is not None:
+                self._recorder.write(command[: len(command) - len(self._write_term)])
+            t0 = None if self._metrics is None else perf_counter()
+            if self._raw_write is None:
+                self.write_bytes(command)
+            else:
+                self._raw_write(command)
+            if self._pipeline_window:
+                self._push_pending(command, t0)
+                return
+            self._read_ok(command, t0)
+        finally:
+            lock.release()
+            if tracer is not None:
+                tracer.add("serial", "serial", start)
+
+    def _push_pending(self, command, t0):
+        self._pending.append((command, t0, get_ident()))
+        while len(self._pending) >= self._pipeline_window:
+            self._read_pending()
+        if self._lock.contended():
+            # replies are read before the lock is handed over to another thread,
+            # so their errors are raised in the thread which sent the commands
+            self.flush_pending()
+
+    def _read_pending(self):
+        command, t0, _ = self._pending.popleft()
+        self._read_ok(command, t0)
+
+    def _flush_other_thread(self):
+        # read replies of commands sent by another thread (it acquired the lock before
+        # this thread started waiting), the error is raised when the pipelined block is left
+        try:
+            self.flush_pending()
+        except ConnectionError as e:
+            if self._pipeline_error is None:
+                self._pipeline_error = e
+
+    def _read_ok(self, command, t0):
+        # read reply of the command written at t0 (None - metrics disabled) and check it
+        if t0 is None:
+            response = self._read_reply()
+        else:
+            try:
+                response = self._read_reply()
+            except Exception as e:
+                self._metrics.record("ask_ok", command, perf_counter() - t0, None, repr(e))
+                raise
+            error = None if response == "OK" else f"Invalid response: {response}"
+            self._metrics.record("ask_ok", command, perf_counter() - t0, response, error)
+        if self._recorder is not None:
+            self._recorder.read(response)
         if response != "OK":
-            raise ConnectionError(f"Invalid response: {response}")
+            self.invalidate_registers()
+            raise ConnectionError(f"Invalid response: {response} (command {command!r})")
+
+    def _read_reply(self):
+        # read one reply, "OK" is compared in the raw buffer without decoding
+        if self._raw_read is None:
+            return self.read()
+        reply = self._raw_read()
+        if reply == self._ok_reply:
+            return "OK"
+        # other replies (e.g. "ERR") are longer, the rest is read by the adapter
+        response = bytes(reply).decode(errors="replace")
+        term = self.read_termination
+        if response.endswith(term):
+            return response[: -len(term)]
+        return response + self.read()
+
+    def flush_pending(self):
+        """
+        Read replies of all the commands sent in pipelined mode.
+
+        All the replies are read even if some of them are invalid, so the
+        request/response pairing stays in sync.
+        The first invalid reply is raised as :class:`ConnectionError`
+        naming the command which caused it.
+        """
+        error = None
+        with self._locked(PRIORITY_SETPOINT):
+            while self._pending:
+                try:
+                    self._read_pending()
+                except ConnectionError as e:
+                    if error is None:
+                        error = e
+        if error is not None:
+            raise error
+
+    @contextmanager
+    def _locked(self, priority):
+        self._lock.acquire(priority)
+        try:
+            yield
+        finally:
+            self._lock.release()
+
+    def priority(self, priority: int):
+        """
+        Context manager setting priority of all the commands sent by the calling thread
+        (see :mod:`qsource3.scheduler`).
+
+        .. code-block:: python
+
+            with driver.priority(PRIORITY_TELEMETRY):
+                current = driver.current
+
+        :param priority: priority (lower number - higher priority)
+        """
+        return self._lock.thread_priority(priority)
+
+    @contextmanager
+    def pipelined(self, window: int = 8):
+        """
+        Context manager for pipelined command mode.
+
+        Up to ``window`` commands expecting ``OK`` reply are sent before their
+        replies are read, so the serial round trip latency is not paid for every command.
+        The replies are matched with the commands in order. All the pending replies are read
+        at the latest when the context is left or before any query (e.g. :attr:`frequency`).
+
+        The mode applies to the commands of all threads (e.g. of
+        :class:`qsource3.scan.ScanPipeline` or :class:`qsource3.bus.QSource3Bus`).
+        The lock is held per command only; before it is handed over to another thread,
+        the pending replies of the sending thread are read, so an invalid reply is raised
+        in the thread which sent the command.
+
+        .. code-block:: python
+
+            with driver.pipelined(window=16):
+                plan.run()
+
+        :param window: maximum number of commands in flight
+        """
+        if window < 1:
+            raise ValueError(f"Invalid window: {window}")
+        with self._locked(PRIORITY_SETPOINT):
+            previous = self._pipeline_window
+            self._pipeline_window = window
+        try:
+            yield self
+        except BaseException:
+            with self._locked(PRIORITY_SETPOINT):
+                self._pipeline_window = previous
+                self._pipeline_error = None
+                try:
+                    self.flush_pending()
+                except ConnectionError:
+                    pass  # the original exception takes precedence
+            raise
+        else:
+            with self._locked(PRIORITY_SETPOINT):
+                self._pipeline_window = previous
+                error, self._pipeline_error = self._pipeline_error, None
+                self.flush_pending()
+            if error is not None:
+                raise error
+
+    def ask(self, command, query_delay=None):
+        tracer = tracing.active
+        if tracer is not None:
+            start = tracer.clock()
+        lock = self._lock
+        lock.acquire(PRIORITY_QUERY)
+        try:
+            pending = self._pending
+            if pending and pending[0][2] != get_ident():
+                self._flush_other_thread()
+            if self._metrics is None:
+                return self._ask(command, query_delay)
+            return self._timed_ask("ask", command, query_delay)
+        finally:
+            lock.release()
+            if tracer is not None:
+                tracer.add("serial", "serial", start)
+
+    def _ask(self, command, query_delay=None):
+        if self._pending:
+            self.flush_pending()
+        if self._recorder is None:
+            return super().ask(command, query_delay)
+        self._recorder.write(command)
+        self.write(command)
+        self.wait_for(query_delay)
+        response = self.read()
+        self._recorder.read(response)
+        return response
+
+    def _timed_ask(self, kind, command, query_delay=None):
+        t0 = perf_counter()
+        try:
+            response = self._ask(command, query_delay)
+        except Exception as e:
+            self._metrics.record(kind, command, perf_counter() - t0, None, repr(e))
+            raise
+        error = None if kind == "ask" or response == "OK" else f"Invalid response: {response}"
+        self._metrics.record(kind, command, perf_counter() - t0, response, error)
+        return response
+
+    @property
+    def metrics(self):
+        """
+        Instance of :class:`qsource3.metrics.DriverMetrics` (None if disabled).
+        """
+        return self._metrics
+
+    def enable_metrics(self, hooks=()):
+        """
+        Start counting commands, bytes, errors and latencies of the round trips
+        (see :class:`qsource3.metrics.DriverMetrics`). The counting is disabled by default,
+        so it costs nothing.
+
+        :param hooks: callables called with :class:`qsource3.metrics.CommandEvent`
+                      after every command
+        :returns: instance of :class:`qsource3.metrics.DriverMetrics`
+        """
+        if self._metrics is None:
+            self._metrics = DriverMetrics(termination_length=len(self.write_termination) or 1)
+        for hook in hooks:
+            self._metrics.add_hook(hook)
+        return self._metrics
+
+    def disable_metrics(self):
+        """
+        Stop counting started by :meth:`enable_metrics`.
+        """
+        self._metrics = None
+
+    @property
+    def recorder(self):
+        """
+        Instance of :class:`qsource3.recorder.CommandRecorder` (None if not recording).
+        """
+        return self._recorder
+
+    def start_recording(self, path):
+        """
+        Start recording of all the commands and replies with their times
+        to a binary log file (see :mod:`qsource3.recorder`). The log can be replayed
+        by :func:`qsource3.recorder.replay` against the device or the pymeasure protocol tester.
+
+        :param path: path to the log file (overwritten)
+        :returns: instance of :class:`qsource3.recorder.CommandRecorder`
+        """
+        with self._locked(PRIORITY_SETPOINT):
+            if self._recorder is not None:
+                self._recorder.close()
+            self._recorder = CommandRecorder(path)
+        return self._recorder
+
+    def stop_recording(self):
+        """
+        Stop recording started by :meth:`start_recording` and close the log file.
+        Pending replies of pipelined commands are read (and recorded) first.
+
+        :returns: the closed :class:`qsource3.recorder.CommandRecorder` (None if not recording)
+        """
+        with self._locked(PRIORITY_SETPOINT):
+            recorder = self._recorder
+            try:
+                if self._pending:
+                    self.flush_pending()
+            finally:
+                self._recorder = None
+        if recorder is not None:
+            recorder.close()
+        return recorder
+
+    @property
+    def registers(self) -> dict:
+        """
+        Copy of the register model ``{"dc1": mV, "dc2": mV, "ac": mV}``
+        (``None`` if the value is unknown).
+        """
+        return dict(self._registers)
+
+    def invalidate_registers(self):
+        """
+        Forget the register model, so the next setpoints are always sent.
+        """
+        self._registers = {"dc1": None, "dc2": None, "ac": None}
+
+    def _set_registers(self, dc1, dc2, ac):
+        # update register model after the setpoint in mV was sent by other means
+        self._registers = {"dc1": dc1, "dc2": dc2, "ac": ac}
 
     def test_communication(self):
         """
@@ -58,7 +478,17 @@ class QSource3Driver(Instrument):
         The values out of range are truncated.
         """
         v = int(round(truncated_range(voltage, [-self.MAX_DC, self.MAX_DC]) * 1000.0))  # convert to mV
-        self._ask_ok(f"#DC{output} {v}")
+        key = f"dc{output}"
+        # the model is compared and updated under the lock of the command
+        lock = self._lock
+        lock.acquire(PRIORITY_SETPOINT)
+        try:
+            if self.register_cache and self._registers.get(key) == v:
+                return
+            self._ask_ok(f"#DC{output} {v}")
+            self._registers[key] = v
+        finally:
+            lock.release()
 
     dc1 = property(
         fget=None,
@@ -86,7 +516,15 @@ class QSource3Driver(Instrument):
         v = int(
             round(truncated_range(ac, [0, self.MAX_RF_AMP_PP]) * 1000.0)
         )  # convert to mV
-        self._ask_ok(f"#AC {v}")
+        lock = self._lock
+        lock.acquire(PRIORITY_SETPOINT)
+        try:
+            if self.register_cache and self._registers["ac"] == v:
+                return
+            self._ask_ok(f"#AC {v}")
+            self._registers["ac"] = v
+        finally:
+            lock.release()
 
     ac = property(
         fget=None,
@@ -104,6 +542,9 @@ class QSource3Driver(Instrument):
         :param dc2: DC voltage of channel 2 in Volts (float from -75 to +75).
         :param ac: AC voltage with peak to peak value in Volts (float from 0 to +650).
         """
+        tracer = tracing.active
+        if tracer is not None:
+            start = tracer.clock()
         _dc1 = int(
             round(truncated_range(dc1, [-self.MAX_DC, self.MAX_DC]) * 1000.0)
         )  # convert to mV
@@ -113,7 +554,114 @@ class QSource3Driver(Instrument):
         _ac = int(
             round(truncated_range(ac, [0, self.MAX_RF_AMP_PP]) * 1000.0)
         )  # convert to mV
-        self._ask_ok(f"#C {_dc1} {_dc2} {_ac}")
+        if tracer is not None:
+            tracer.add("validators", "driver", start)
+        registers = {"dc1": _dc1, "dc2": _dc2, "ac": _ac}
+        lock = self._lock
+        lock.acquire(PRIORITY_SETPOINT)
+        try:
+            if self.register_cache and self._registers == registers:
+                return
+            if tracer is not None:
+                start = tracer.clock()
+            command = f"#C {_dc1} {_dc2} {_ac}"
+            if tracer is not None:
+                tracer.add("formatting", "driver", start)
+            self._ask_ok(command)
+            self._registers = registers
+        finally:
+            lock.release()
+
+    def update_voltages(self, dc1=None, dc2=None, ac=None):
+        """
+        Set DC and AC voltages using the smallest number of commands.
+
+        Only values which differ from the register model are sent (see :attr:`registers`):
+        one ``#C`` command if two or more values changed (and all are given),
+        otherwise ``#DC1``, ``#DC2`` or ``#AC`` for the changed value.
+
+        :param dc1: DC voltage of channel 1 in Volts (None - leave unchanged).
+        :param dc2: DC voltage of channel 2 in Volts (None - leave unchanged).
+        :param ac: AC voltage with peak to peak value in Volts (None - leave unchanged).
+        """
+        with self._locked(PRIORITY_SETPOINT):
+            values = {"dc1": dc1, "dc2": dc2, "ac": ac}
+            changed = []
+            for key, value in values.items():
+                if value is None:
+                    continue
+                if key == "ac":
+                    v = int(round(truncated_range(value, [0, self.MAX_RF_AMP_PP]) * 1000.0))
+                else:
+                    v = int(round(truncated_range(value, [-self.MAX_DC, self.MAX_DC]) * 1000.0))
+                if not self.register_cache or self._registers[key] != v:
+                    changed.append(key)
+
+            if len(changed) >= 2 and None not in values.values():
+                self.set_voltages(dc1, dc2, ac)
+                return
+
+            for key in changed:
+                if key == "ac":
+                    self.set_ac_voltage(ac)
+                else:
+                    self.set_dc_voltage(int(key[-1]), values[key])
+
+    def voltages_to_mv(self, dc1, dc2, ac):
+        """
+        Convert DC and AC voltages to integer millivolts exactly as :meth:`set_voltages` does.
+
+        Accepts scalars or numpy arrays. The values out of range are truncated.
+
+        :param dc1: DC voltage of channel 1 in Volts.
+        :param dc2: DC voltage of channel 2 in Volts.
+        :param ac: AC voltage with peak to peak value in Volts.
+        :returns: (dc1, dc2, ac) as numpy arrays of int in mV
+        """
+        _dc1 = np.rint(np.clip(dc1, -self.MAX_DC, self.MAX_DC) * 1000.0).astype(int)
+        _dc2 = np.rint(np.clip(dc2, -self.MAX_DC, self.MAX_DC) * 1000.0).astype(int)
+        _ac = np.rint(np.clip(ac, 0, self.MAX_RF_AMP_PP) * 1000.0).astype(int)
+        return _dc1, _dc2, _ac
+
+    def encode_voltages(self, dc1_mv, dc2_mv, ac_mv):
+        """
+        Encode ``#C`` commands for given DC and AC voltages in mV.
+
+        The write termination of the adapter is appended, so the commands can be
+        sent by :meth:`_ask_ok_bytes` without any further processing.
+
+        :param dc1_mv: iterable of DC voltages of channel 1 in mV (int).
+        :param dc2_mv: iterable of DC voltages of channel 2 in mV (int).
+        :param ac_mv: iterable of AC voltages (peak to peak) in mV (int).
+        :returns: list of bytes
+        """
+        term = self.write_termination.encode()
+        return [
+            b"#C %d %d %d" % (v1, v2, v3) + term
+            for v1, v2, v3 in zip(dc1_mv, dc2_mv, ac_mv)
+        ]
+
+    @property
+    def write_termination(self) -> str:
+        """
+        Write termination used by the adapter (empty if the adapter appends none).
+        """
+        return self._adapter_termination("write_termination")
+
+    @property
+    def read_termination(self) -> str:
+        """
+        Read termination used by the adapter (empty if the adapter strips none).
+        """
+        return self._adapter_termination("read_termination")
+
+    def _adapter_termination(self, name):
+        # pyvisa keeps the termination in the connection, SerialAdapter in the adapter
+        for obj in (getattr(self.adapter, "connection", None), self.adapter):
+            term = getattr(obj, name, None)
+            if isinstance(term, str):
+                return term
+        return ""
 
     voltages = property(
         fget=None,
@@ -153,6 +701,7 @@ class QSource3Driver(Instrument):
     def set_range(self, range):
         """ """
         _range = strict_discrete_set(range, [0, 1, 2])
+        self.invalidate_registers()
         self._ask_ok(f"#B {_range}")
 
     range = property(
@@ -0,0 +1,138 @@
+import time
+
+import numpy as np
+
+from qsource3.massfilter import Quadrupole
+from qsource3.scan import ScanExecutor
+
+
+class RangeManager:
+    r"""
+    Manager of frequency ranges of one QSource3 device.
+
+    On creation the frequency of each range is read once (``#B`` and ``#G`` commands)
+    and one :class:`qsource3.massfilter.Quadrupole` per range is created.
+    The ranges are switched by :meth:`select` only when needed, followed by
+    ``settle_time`` waiting.
+
+    Wide scans are split to segments covered by single ranges (see :meth:`compile_scan`),
+    so the whole scan needs at most one range switch per used range.
+
+    .. code-block:: python
+
+        ranges = RangeManager(driver, r0=3e-3)
+        segments = ranges.compile_scan(np.arange(1, 1000, 0.1), dwell=0.01)
+        ranges.run_scan(segments)
+
+    :param driver: instance of :class:`qsource3.qsource3driver.QSource3Driver`
+    :param r0: characteristic radius of the quadrupole :math:`r_0` in meters
+    :param settle_time: waiting time after switching the range in seconds
+    :param ranges: ranges to be used
+    :param quadrupole_kwargs: keyword arguments of the :class:`qsource3.massfilter.Quadrupole`
+        instances, e.g. calibration points
+    """
+
+    def __init__(self, driver, r0, settle_time=0.1, ranges=(0, 1, 2), **quadrupole_kwargs):
+        self._driver = driver
+        self.settle_time = settle_time
+
+        self.frequencies = {}
+        self.quadrupoles = {}
+        for n in ranges:
+            driver.set_range(n)
+            self.frequencies[n] = driver.frequency
+            self.quadrupoles[n] = Quadrupole(
+                frequency=self.frequencies[n],
+                r0=r0,
+                driver=driver,
+                **{"name": f"Quadrupole range {n}", **quadrupole_kwargs},
+            )
+        self._range = ranges[-1]
+
+    @property
+    def range(self) -> int:
+        """Actual range of the device."""
+        return self._range
+
+    def select(self, n: int) -> Quadrupole:
+        """
+        Switch the device to range ``n`` (if it is not actual) and wait ``settle_time``.
+
+        :param n: range
+        :returns: the quadrupole of the range
+        """
+        if n != self._range:
+            self._driver.set_range(n)
+            self._range = n
+            if self.settle_time > 0:
+                time.sleep(self.settle_time)
+        return self.quadrupoles[n]
+
+    def range_for_mz(self, mz_vec) -> np.ndarray:
+        r"""
+        Find range for each :math:`m/z`.
+
+        The range with the highest frequency (the best resolution) whose
+        :attr:`~qsource3.massfilter.Quadrupole.max_mz` is not exceeded is chosen.
+        :math:`m/z` above the maximum of all ranges are assigned to the range with
+        the highest :attr:`~qsource3.massfilter.Quadrupole.max_mz`.
+
+        :param mz_vec: 1D array of :math:`m/z`
+        :returns: 1D array of ranges
+        """
+        mz_vec = np.asarray(mz_vec, dtype=float)
+        # ranges ordered from the highest frequency
+        order = sorted(self.quadrupoles, key=lambda n: -self.frequencies[n])
+        result = np.full(mz_vec.shape, max(order, key=lambda n: self.quadrupoles[n].max_mz))
+        assigned = np.zeros(mz_vec.shape, dtype=bool)
+        for n in order:
+            mask = ~assigned & (mz_vec <= self.quadrupoles[n].max_mz)
+            result[mask] = n
+            assigned |= mask
+        return result
+
+    def compile_scan(self, mz_vec, dwell=0.0) -> list:
+        r"""
+        Split the scan to segments of single ranges and precompile them.
+
+        The segments are ordered to minimise range switching: the actual range goes
+        first, then the other ranges in order of their frequency. Points of one
+        segment keep their original order.
+
+        :param mz_vec: 1D array of :math:`m/z`
+        :param dwell: dwell time per point (scalar or 1D array)
+        :returns: list of (range, indices of the points, :class:`qsource3.scan.ScanPlan`)
+        """
+        mz_vec = np.asarray(mz_vec, dtype=float)
+        dwell = np.broadcast_to(np.asarray(dwell, dtype=float), mz_vec.shape)
+        point_ranges = self.range_for_mz(mz_vec)
+
+        order = sorted(
+            set(point_ranges.tolist()),
+            key=lambda n: (n != self._range, -self.frequencies[n]),
+        )
+        segments = []
+        for n in order:
+            indices = np.flatnonzero(point_ranges == n)
+            plan = self.quadrupoles[n].compile_scan(mz_vec[indices], dwell[indices])
+            segments.append((n, indices, plan))
+        return segments
+
+    def run_scan(self, segments, deadlines=True) -> list:
+        r"""
+        Run the segments created by :meth:`compile_scan`.
+
+        :param segments: list of segments
+        :param deadlines: run the plans by :class:`qsource3.scan.ScanExecutor`,
+                          otherwise by :meth:`qsource3.scan.ScanPlan.run`
+        :returns: list of :class:`qsource3.scan.ScanTiming` (None if ``deadlines`` is False)
+        """
+        timings = []
+        for n, indices, plan in segments:
+            self.select(n)
+            if deadlines:
+                timings.append(ScanExecutor(plan).run())
+            else:
+                plan.run()
+                timings.append(None)
+        return timings
@@ -0,0 +1,268 @@
+import struct
+import time
+from collections import namedtuple
+
+from qsource3.scan import wait_until
+
+_MAGIC = b"QS3CMDS1"
+_HEADER = struct.Struct("<8sd")  # magic, time.time() of the start of the recording
+_HEADER_SIZE = 64
+_RECORD = struct.Struct("<dBH")  # time since the start (s), kind, length of the data
+
+WRITE = 0
+READ = 1
+
+Record = namedtuple("Record", ["time", "kind", "data"])
+Record.__doc__ = """
+One command or reply of :class:`CommandLog`.
+
+:param time: time since the start of the recording in seconds (monotonic clock)
+:param kind: :data:`WRITE` (command) or :data:`READ` (reply)
+:param data: the command or reply without termination (bytes)
+"""
+
+ReplayResult = namedtuple("ReplayResult", ["commands", "replies", "mismatches", "elapsed", "max_lag"])
+ReplayResult.__doc__ = """
+Result of :func:`replay`.
+
+:param commands: number of the written commands
+:param replies: number of the read replies
+:param mismatches: list of ``(index of the record, recorded reply, actual reply)``
+:param elapsed: duration of the replay in seconds
+:param max_lag: maximum delay of a command after its original time in seconds
+                (0 when replayed as fast as possible)
+"""
+
+
+class CommandRecorder:
+    r"""
+    Writer of the commands and replies of :class:`qsource3.qsource3driver.QSource3Driver`
+    to a binary log file.
+
+    Started by :meth:`qsource3.qsource3driver.QSource3Driver.start_recording`.
+    Every record is 11 bytes (time as ``float64``, kind and length) followed by the command
+    or reply without termination. The times are taken by :func:`time.perf_counter`
+    relative to the start of the recording. The file is read by :meth:`CommandLog.load`.
+
+    .. code-block:: python
+
+        driver.start_recording("scan.qs3log")
+        plan.run()
+        driver.stop_recording()
+
+    :param path: path to the log file (overwritten)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = open(path, "wb")
+        self._file.write(_HEADER.pack(_MAGIC, time.time()).ljust(_HEADER_SIZE, b"\0"))
+        self.t0 = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, command):
+        """
+        Record command (``str`` or ``bytes`` without termination) written to the device.
+        """
+        self._add(WRITE, command)
+
+    def read(self, reply):
+        """
+        Record reply (``str`` or ``bytes`` without termination) read from the device.
+        """
+        self._add(READ, reply)
+
+    def _add(self, kind, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self._file.write(_RECORD.pack(time.perf_counter() - self.t0, kind, len(data)) + data)
+        self.count += 1
+
+    def flush(self):
+        """Write the buffered records to the file."""
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        """Close the file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class CommandLog:
+    r"""
+    Sequence of :class:`Record` written by :class:`CommandRecorder`.
+
+    .. code-block:: python
+
+        log = CommandLog.load("scan.qs3log")
+        print(log.command_counts())
+        replay(log, driver, speed=None)
+
+    :param records: list of :class:`Record`
+    :param start_time: :func:`time.time` of the start of the recording
+    """
+
+    def __init__(self, records, start_time=None):
+        self.records = list(records)
+        self.start_time = start_time
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read log file written by :class:`CommandRecorder`.
+        An incomplete last record (e.g. the recording was interrupted) is ignored.
+
+        :param path: path to the file
+        """
+        with open(path, "rb") as f:
+            content = f.read()
+        if len(content) < _HEADER_SIZE:
+            raise ValueError("Not a command log file")
+        magic, start_time = _HEADER.unpack_from(content)
+        if magic != _MAGIC:
+            raise ValueError("Not a command log file")
+        records = []
+        size = _RECORD.size
+        pos = _HEADER_SIZE
+        while pos + size <= len(content):
+            t, kind, n = _RECORD.unpack_from(content, pos)
+            pos += size
+            if pos + n > len(content):
+                break
+            records.append(Record(t, kind, content[pos : pos + n]))
+            pos += n
+        return cls(records, start_time)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, i):
+        return self.records[i]
+
+    @property
+    def duration(self) -> float:
+        """Time from the first to the last record in seconds."""
+        if not self.records:
+            return 0.0
+        return self.records[-1].time - self.records[0].time
+
+    def commands(self) -> list:
+        """The written commands as ``str``."""
+        return [r.data.decode() for r in self.records if r.kind == WRITE]
+
+    def command_counts(self) -> dict:
+        """
+        Number of the commands by type, e.g. ``{"#C": 1000, "#G": 1}``.
+        """
+        counts = {}
+        for command in self.commands():
+            name = command.split(None, 1)[0] if command.strip() else command
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def diff_counts(self, other) -> dict:
+        """
+        Command types whose number differs from log ``other``.
+
+        :param other: instance of :class:`CommandLog`
+        :returns: dictionary {command type: (count in this log, count in ``other``)}
+        """
+        a = self.command_counts()
+        b = other.command_counts()
+        return {
+            name: (a.get(name, 0), b.get(name, 0))
+            for name in sorted(set(a) | set(b))
+            if a.get(name, 0) != b.get(name, 0)
+        }
+
+    def comm_pairs(self) -> list:
+        """
+        The log as communication pairs of :func:`pymeasure.test.expected_protocol`
+        (or ``ProtocolAdapter``). A command immediately followed by its reply is one pair,
+        pipelined commands and replies are separate pairs with None.
+        """
+        pairs = []
+        records = self.records
+        outstanding = 0  # commands waiting for reply
+        i = 0
+        while i < len(records):
+            r = records[i]
+            if r.kind == WRITE:
+                if not outstanding and i + 1 < len(records) and records[i + 1].kind == READ:
+                    pairs.append((r.data.decode(), records[i + 1].data.decode()))
+                    i += 2
+                    continue
+                pairs.append((r.data.decode(), None))
+                outstanding += 1
+            else:
+                pairs.append((None, r.data.decode()))
+                outstanding = max(0, outstanding - 1)
+            i += 1
+        return pairs
+
+
+def replay(log, target, speed: float = 1.0, spin: float = 0.002) -> ReplayResult:
+    r"""
+    Re-issue the commands of the log and compare the replies with the recorded ones.
+
+    The commands and replies are written and read in the recorded order
+    (including pipelined commands), directly by the adapter of ``target``.
+    With ``speed`` given, every command is written at its recorded time
+    (relative to the first record) divided by ``speed``.
+
+    .. code-block:: python
+
+        log = CommandLog.load("scan.qs3log")
+        # offline, against the pymeasure protocol tester
+        replay(log, ProtocolAdapter(log.comm_pairs()), speed=None)
+        # against the device, with the original timing
+        result = replay(log, QSource3Driver("ASRL/dev/ttyUSB0::INSTR"))
+
+    :param log: instance of :class:`CommandLog` or path to the log file
+    :param target: :class:`qsource3.qsource3driver.QSource3Driver` or pymeasure adapter
+    :param speed: factor of the original timing (1.0 - original timing,
+                  None - as fast as possible)
+    :param spin: busy-wait interval before each command in seconds (see :func:`qsource3.scan.wait_until`)
+    :returns: instance of :class:`ReplayResult`
+    """
+    if not isinstance(log, CommandLog):
+        log = CommandLog.load(log)
+    if speed is not None and speed <= 0:
+        raise ValueError(f"Invalid speed: {speed}")
+    adapter = getattr(target, "adapter", target)
+    clock = time.perf_counter
+
+    commands = 0
+    replies = 0
+    mismatches = []
+    max_lag = 0.0
+    t_first = log[0].time if len(log) else 0.0
+    start = clock()
+    for i, (t, kind, data) in enumerate(log):
+        if kind == WRITE:
+            if speed is not None:
+                deadline = start + (t - t_first) / speed
+                wait_until(deadline, spin)
+                lag = clock() - deadline
+                if lag > max_lag:
+                    max_lag = lag
+            adapter.write(data.decode())
+            commands += 1
+        else:
+            reply = adapter.read()
+            replies += 1
+            expected = data.decode()
+            if reply != expected:
+                mismatches.append((i, expected, reply))
+    return ReplayResult(commands, replies, mismatches, clock() - start, max_lag)
@@ -0,0 +1,659 @@
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from qsource3 import tracing
+
+
+class ScanPlan:
+    r"""
+    Precompiled :math:`m/z` scan of :class:`qsource3.massfilter.Quadrupole`.
+
+    All the calibration math, range truncation, quantization to integer mV and
+    formatting of ``#C`` commands is done once when the plan is created
+    (see :meth:`qsource3.massfilter.Quadrupole.compile_scan`).
+    Running the plan only writes the pre-encoded commands and checks the ``OK`` replies.
+
+    The plan captures the state of the quadrupole at the time of compilation
+    (:attr:`~qsource3.qsource3.QSource3.dc_offst`,
+    :attr:`~qsource3.massfilter.Quadrupole.is_dc_on`,
+    :attr:`~qsource3.massfilter.Quadrupole.is_rod_polarity_positive` and calibration).
+    Compile a new plan if any of them changes.
+
+    :param quadrupole: instance of :class:`qsource3.massfilter.Quadrupole`
+    :param mz_vec: 1D array of :math:`m/z` values
+    :param dwell: dwell time per point in seconds, scalar or 1D array of the same length as ``mz_vec``
+    """
+
+    def __init__(self, quadrupole, mz_vec, dwell=0.0):
+        self._quadrupole = quadrupole
+        self._driver = quadrupole._driver
+
+        self.mz = np.maximum(np.asarray(mz_vec, dtype=float), 0.0)
+        self.dc1, self.dc2, self.rf = quadrupole.calc_voltages_array(self.mz)
+        self.dc1_mv, self.dc2_mv, self.ac_mv = self._driver.voltages_to_mv(
+            self.dc1, self.dc2, 2.0 * self.rf  # amp 0-P to amp P-P
+        )
+        self.dwell = np.broadcast_to(np.asarray(dwell, dtype=float), self.mz.shape).copy()
+
+        self.commands = self._driver.encode_voltages(
+            self.dc1_mv.tolist(), self.dc2_mv.tolist(), self.ac_mv.tolist()
+        )
+        self._dwell_list = self.dwell.tolist()
+
+    @classmethod
+    def from_tables(cls, quadrupole, mz, dc1_mv, dc2_mv, ac_mv, dwell):
+        """
+        Create plan from already computed tables of DAC codes without any calibration math
+        (see :mod:`qsource3.config`).
+
+        The voltages of the quadrupole state are derived from the codes
+        (i.e. they are quantized to 1 mV).
+
+        :param quadrupole: instance of :class:`qsource3.massfilter.Quadrupole`
+        :param mz: 1D array of :math:`m/z` values
+        :param dc1_mv: 1D array of DC voltages of channel 1 in mV (int)
+        :param dc2_mv: 1D array of DC voltages of channel 2 in mV (int)
+        :param ac_mv: 1D array of AC voltages (peak to peak) in mV (int)
+        :param dwell: 1D array of dwell times in seconds
+        """
+        plan = cls.__new__(cls)
+        plan._quadrupole = quadrupole
+        plan._driver = quadrupole._driver
+        plan.mz = mz
+        plan.dc1_mv = dc1_mv
+        plan.dc2_mv = dc2_mv
+        plan.ac_mv = ac_mv
+        plan.dc1 = dc1_mv / 1000.0
+        plan.dc2 = dc2_mv / 1000.0
+        plan.rf = ac_mv / 2000.0  # amp P-P to amp 0-P
+        plan.dwell = dwell
+        plan.commands = plan._driver.encode_voltages(
+            dc1_mv.tolist(), dc2_mv.tolist(), ac_mv.tolist()
+        )
+        plan._dwell_list = dwell.tolist()
+        return plan
+
+    def __len__(self):
+        return len(self.commands)
+
+    @property
+    def duration(self) -> float:
+        """Sum of dwell times in seconds (serial I/O is not accounted)."""
+        return float(np.sum(self.dwell))
+
+    def compact(self):
+        """
+        Merge runs of consecutive points with identical DAC codes (integer mV of
+        ``#C`` command) into one point with summed dwell time.
+
+        The merged point keeps :math:`m/z` of the first point of the run.
+        Detector data measured with the compacted plan can be assigned back
+        to the original points by ``data[mapping]``.
+
+        :returns: (compacted :class:`ScanPlan`, ``mapping``) where ``mapping[i]``
+                  is the index of the merged point containing original point ``i``
+        """
+        n = len(self)
+        new_run = np.ones(n, dtype=bool)
+        new_run[1:] = (
+            (self.dc1_mv[1:] != self.dc1_mv[:-1])
+            | (self.dc2_mv[1:] != self.dc2_mv[:-1])
+            | (self.ac_mv[1:] != self.ac_mv[:-1])
+        )
+        starts = np.flatnonzero(new_run)
+        mapping = np.cumsum(new_run) - 1
+
+        plan = ScanPlan.__new__(ScanPlan)
+        plan._quadrupole = self._quadrupole
+        plan._driver = self._driver
+        for name in ("mz", "dc1", "dc2", "rf", "dc1_mv", "dc2_mv", "ac_mv"):
+            setattr(plan, name, getattr(self, name)[starts])
+        plan.dwell = np.add.reduceat(self.dwell, starts) if n else self.dwell.copy()
+        plan.commands = [self.commands[k] for k in starts.tolist()]
+        plan._dwell_list = plan.dwell.tolist()
+        return plan, mapping
+
+    def set_point(self, k: int):
+        """
+        Send the setpoint ``k`` to the device and update the quadrupole state.
+
+        :param k: index of the point
+        """
+        self._driver._ask_ok_bytes(self.commands[k])
+        self._commit(k)
+
+    def run(self, start: int = 0, stop: int = None):
+        """
+        Run the scan: send each setpoint and wait the dwell time.
+
+        The plan can be run in pipelined mode of the driver
+        (see :meth:`qsource3.qsource3driver.QSource3Driver.pipelined`).
+        In that case an invalid reply may be reported after the following setpoints were sent.
+
+        :param start: index of the first point
+        :param stop: index after the last point (default: end of the plan)
+        """
+        ask = self._driver._ask_ok_bytes
+        commands = self.commands
+        dwell = self._dwell_list
+        sleep = time.sleep if tracing.active is None else tracing.active.sleep
+        if stop is None:
+            stop = len(commands)
+
+        last = -1
+        completed = False
+        try:
+            for k in range(start, stop):
+                ask(commands[k])
+                last = k
+                if dwell[k] > 0:
+                    sleep(dwell[k])
+            completed = True
+        finally:
+            if last >= 0:
+                self._commit(last, completed)
+
+    def _commit(self, k: int, completed: bool = True):
+        # keep the quadrupole state consistent with the last sent setpoint,
+        # the state of the device is unknown if the scan was interrupted
+        q = self._quadrupole
+        q._dc1 = float(self.dc1[k])
+        q._dc2 = float(self.dc2[k])
+        q._rf = float(self.rf[k])
+        q._mz = float(self.mz[k])
+        if completed:
+            self._driver._set_registers(
+                int(self.dc1_mv[k]), int(self.dc2_mv[k]), int(self.ac_mv[k])
+            )
+        else:
+            self._driver.invalidate_registers()
+
+
+def wait_until(deadline: float, spin: float = 0.002):
+    """
+    Wait until :func:`time.perf_counter` reaches ``deadline``.
+
+    The thread sleeps until ``spin`` seconds before the deadline and
+    then busy-waits, so the wake up jitter of the OS scheduler is avoided.
+
+    :param deadline: absolute time in seconds (:func:`time.perf_counter` clock)
+    :param spin: busy-wait interval in seconds
+    """
+    clock = time.perf_counter
+    remaining = deadline - clock() - spin
+    if remaining > 0:
+        time.sleep(remaining)
+    while clock() < deadline:
+        pass
+
+
+class ScanTiming:
+    """
+    Timing statistics of a scan run by :class:`ScanExecutor`.
+
+    :param deadlines: planned times of the setpoints relative to the start of the scan (s)
+    :param errors: actual time of sending the setpoint minus its deadline (s)
+    :param duration: total duration of the scan (s)
+    """
+
+    def __init__(self, deadlines, errors, duration):
+        self.deadlines = deadlines
+        self.errors = errors
+        self.duration = duration
+
+    @property
+    def mean_error(self) -> float:
+        """Mean timing error (s)"""
+        return float(np.mean(self.errors)) if len(self.errors) else 0.0
+
+    @property
+    def std_error(self) -> float:
+        """Standard deviation of timing error (s)"""
+        return float(np.std(self.errors)) if len(self.errors) else 0.0
+
+    @property
+    def max_error(self) -> float:
+        """Maximum absolute timing error (s)"""
+        return float(np.max(np.abs(self.errors))) if len(self.errors) else 0.0
+
+    def summary(self) -> dict:
+        """
+        Return the statistics as dictionary.
+        """
+        return {
+            "points": len(self.errors),
+            "duration": self.duration,
+            "mean_error": self.mean_error,
+            "std_error": self.std_error,
+            "max_error": self.max_error,
+        }
+
+
+class ScanExecutor:
+    """
+    Run :class:`ScanPlan` against absolute deadlines.
+
+    The setpoint ``k`` is sent at ``t0 + sum(dwell[:k])`` where ``t0`` is the start of
+    the scan, so the time spent by serial I/O does not accumulate and the duration
+    of the scan is given by the dwell times only (as long as the I/O of a point is shorter
+    than its dwell time). Waiting is done by :func:`wait_until`.
+
+    .. code-block:: python
+
+        plan = q.compile_scan(mz_vec, dwell=0.01)
+        timing = ScanExecutor(plan).run()
+        print(timing.summary())
+
+    :param plan: instance of :class:`ScanPlan`
+    :param spin: busy-wait interval before each deadline in seconds
+    """
+
+    def __init__(self, plan: ScanPlan, spin: float = 0.002):
+        self.plan = plan
+        self.spin = spin
+
+    def run(self, start: int = 0, stop: int = None) -> ScanTiming:
+        """
+        Run the scan.
+
+        :param start: index of the first point
+        :param stop: index after the last point (default: end of the plan)
+        :returns: instance of :class:`ScanTiming`
+        """
+        plan = self.plan
+        if stop is None:
+            stop = len(plan)
+
+        # deadline of point k and the end of the scan (relative to t0)
+        offsets = np.concatenate(([0.0], np.cumsum(plan.dwell[start:stop])))
+        errors = np.zeros(stop - start)
+
+        ask = plan._driver._ask_ok_bytes
+        commands = plan.commands
+        clock = time.perf_counter
+        spin = self.spin
+
+        wait = wait_until
+        tracer = tracing.active
+        if tracer is not None:
+
+            def wait(deadline, spin):
+                start = tracer.clock()
+                wait_until(deadline, spin)
+                tracer.add("sleep", "sleep", start)
+
+        t0 = clock()
+        deadlines = (t0 + offsets).tolist()
+        last = -1
+        completed = False
+        try:
+            for i, k in enumerate(range(start, stop)):
+                wait(deadlines[i], spin)
+                errors[i] = clock() - deadlines[i]
+                ask(commands[k])
+                last = k
+            wait(deadlines[-1], spin)
+            completed = True
+        finally:
+            if last >= 0:
+                plan._commit(last, completed)
+
+        return ScanTiming(offsets[:-1], errors, clock() - t0)
+
+
+_END = object()  # end of stream marker of ScanPipeline
+
+
+class ScanPipeline:
+    r"""
+    Run :class:`ScanPlan` with reading of a detector, overlapping the setpoints
+    with the detector read-out.
+
+    For every point the setpoint is sent, ``settle_time`` is waited and ``detector(mz)``
+    is called to acquire the signal. The detector returns either the value, or a callable
+    returning the value (deferred read-out). A deferred read-out is evaluated by a reader
+    thread while the setpoint of the next point is already being sent and settled,
+    so the read-out does not add dead time to the scan.
+
+    The results are streamed by :meth:`run` as chunks ``(mz, values)`` of numpy arrays.
+    The queues between the scan, the reader and the consumer are bounded, so the scan
+    waits if the consumer does not keep up (backpressure).
+
+    .. code-block:: python
+
+        def detector(mz):
+            digitizer.acquire()  # the signal at the actual setpoint
+            return digitizer.fetch  # read out while the next setpoint is settling
+
+        pipeline = ScanPipeline(plan, detector, settle_time=1e-3)
+        for mz, values in pipeline.run():
+            spectrum.update(mz, values)
+
+    The dwell times of the plan are not used, the acquisition time is given by the detector.
+
+    :param plan: instance of :class:`ScanPlan`
+    :param detector: callable ``detector(mz)`` returning the value or a callable returning the value
+    :param settle_time: waiting time after each setpoint in seconds
+    :param chunk_size: number of points per chunk
+    :param max_chunks: number of chunks waiting for the consumer before the scan is paused
+    :param spin: busy-wait interval of the settle time in seconds (see :func:`wait_until`)
+    """
+
+    def __init__(
+        self, plan: ScanPlan, detector, settle_time=0.0, chunk_size=64, max_chunks=4, spin=0.002
+    ):
+        if chunk_size < 1 or max_chunks < 1:
+            raise ValueError("chunk_size and max_chunks must be positive")
+        self.plan = plan
+        self.detector = detector
+        self.settle_time = settle_time
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.spin = spin
+
+    def run(self, start: int = 0, stop: int = None):
+        """
+        Run the scan and yield chunks of results.
+
+        An exception raised by the device or the detector stops the scan and is raised
+        by the generator after the chunks completed before. Closing the generator
+        (e.g. ``break`` in the ``for`` loop) stops the scan.
+
+        :param start: index of the first point
+        :param stop: index after the last point (default: end of the plan)
+        :returns: generator of ``(mz, values)`` tuples of numpy arrays
+        """
+        plan = self.plan
+        if stop is None:
+            stop = len(plan)
+
+        reads = queue.Queue(maxsize=self.chunk_size)  # (index, value or read-out)
+        chunks = queue.Queue(maxsize=self.max_chunks)
+        stopped = threading.Event()
+        errors = []
+
+        def put(q, item):
+            # blocking put which gives up when the pipeline is stopped
+            while not stopped.is_set():
+                try:
+                    q.put(item, timeout=0.05)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def scan():
+            ask = plan._driver._ask_ok_bytes
+            commands = plan.commands
+            mz = plan.mz.tolist()
+            detector = self.detector
+            settle_time = self.settle_time
+            spin = self.spin
+            clock = time.perf_counter
+
+            last = -1
+            completed = False
+            try:
+                for k in range(start, stop):
+                    ask(commands[k])
+                    last = k
+                    if settle_time > 0:
+                        wait_until(clock() + settle_time, spin)
+                    if not put(reads, (k, detector(mz[k]))):
+                        break
+                else:
+                    completed = True
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                if last >= 0:
+                    plan._commit(last, completed)
+                put(reads, _END)
+
+        def read():
+            indices = []
+            values = []
+            try:
+                while True:
+                    try:
+                        item = reads.get(timeout=0.05)
+                    except queue.Empty:
+                        if stopped.is_set():
+                            break
+                        continue
+                    if item is _END:
+                        break
+                    k, value = item
+                    indices.append(k)
+                    values.append(value() if callable(value) else value)
+                    if len(indices) == self.chunk_size:
+                        if not put(chunks, (plan.mz[indices], np.asarray(values))):
+                            break
+                        indices = []
+                        values = []
+                if indices:
+                    put(chunks, (plan.mz[indices], np.asarray(values)))
+            except BaseException as e:
+                errors.append(e)
+                stopped.set()
+            finally:
+                chunks.put(_END)
+
+        threads = [
+            threading.Thread(target=scan, name="ScanPipeline scan", daemon=True),
+            threading.Thread(target=read, name="ScanPipeline read", daemon=True),
+        ]
+        for t in threads:
+            t.start()
+        try:
+            while True:
+                item = chunks.get()
+                if item is _END:
+                    break
+                yield item
+            if errors:
+                raise errors[0]
+        finally:
+            stopped.set()
+            for t in threads:
+                while t.is_alive():
+                    # make room for the end marker of the reader
+                    for q in (chunks, reads):
+                        try:
+                            while True:
+                                q.get_nowait()
+                        except queue.Empty:
+                            pass
+                    t.join(0.05)
+
+    def collect(self, start: int = 0, stop: int = None):
+        """
+        Run the scan and return all the results.
+
+        :param start: index of the first point
+        :param stop: index after the last point (default: end of the plan)
+        :returns: tuple ``(mz, values)`` of numpy arrays
+        """
+        mz = []
+        values = []
+        for chunk_mz, chunk_values in self.run(start, stop):
+            mz.append(chunk_mz)
+            values.append(chunk_values)
+        if not mz:
+            return np.zeros(0), np.zeros(0)
+        return np.concatenate(mz), np.concatenate(values)
+
+
+class ScanCheckpoint:
+    """
+    Progress of a scan run by :class:`ResumableScan`.
+
+    If ``path`` is given, the checkpoint is saved to the JSON file by :meth:`save`
+    and loaded from it on creation (if the file exists), so the scan can be resumed
+    even after restart of the process.
+
+    :param path: path to the JSON file (None - the checkpoint is kept in memory only)
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.next_point = 0  # index of the first point not completed
+        self.retries = 0  # number of retried commands
+        self.errors = []  # [index of the point, description of the error]
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.next_point = data["next_point"]
+            self.retries = data["retries"]
+            self.errors = data["errors"]
+
+    def save(self):
+        """Save the checkpoint to the file (written atomically)."""
+        if self.path is None:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(
+                {"next_point": self.next_point, "retries": self.retries, "errors": self.errors},
+                f,
+            )
+        os.replace(tmp, self.path)
+
+    def reset(self):
+        """Start the scan from the beginning."""
+        self.next_point = 0
+        self.retries = 0
+        self.errors = []
+        self.save()
+
+
+class ResumableScan:
+    r"""
+    Run :class:`ScanPlan` with retrying of failed setpoints and checkpoints of the progress.
+
+    A ``#C`` command sets all the DC and AC registers to absolute values, so it is
+    idempotent and can be repeated. If a setpoint fails (invalid reply or timeout),
+    the input buffer of the adapter is flushed, the register model of the driver is
+    invalidated and the setpoint is sent again after a backoff delay (doubled after
+    every failure up to ``max_backoff``). The device state is thereby restored from the
+    precompiled setpoint and the dwell time of the point starts again.
+
+    If the setpoint fails ``max_retries`` times, the checkpoint is saved and the error
+    is raised. The next :meth:`run` resumes at the failed point.
+
+    .. code-block:: python
+
+        scan = ResumableScan(plan, ScanCheckpoint("scan.json"))
+        scan.run()  # resumes where the previous run stopped
+
+    Do not run the scan in pipelined mode of the driver, the errors would be reported
+    after the following setpoints were sent.
+
+    :param plan: instance of :class:`ScanPlan`
+    :param checkpoint: instance of :class:`ScanCheckpoint` (None - new one in memory)
+    :param max_retries: maximum number of retries of one setpoint
+    :param backoff: delay before the first retry in seconds
+    :param max_backoff: maximum delay before a retry in seconds
+    :param checkpoint_interval: minimum time between saving of the checkpoint in seconds
+    :param retry_on: exception types causing retry
+    """
+
+    def __init__(
+        self,
+        plan: ScanPlan,
+        checkpoint: ScanCheckpoint = None,
+        max_retries=5,
+        backoff=0.01,
+        max_backoff=1.0,
+        checkpoint_interval=1.0,
+        retry_on=(ConnectionError, TimeoutError),
+    ):
+        self.plan = plan
+        self.checkpoint = ScanCheckpoint() if checkpoint is None else checkpoint
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.checkpoint_interval = checkpoint_interval
+        self.retry_on = retry_on
+
+    @property
+    def completed(self) -> bool:
+        """True if all the points of the plan were completed."""
+        return self.checkpoint.next_point >= len(self.plan)
+
+    def run(self, start: int = None, stop: int = None) -> ScanCheckpoint:
+        """
+        Run (or resume) the scan.
+
+        :param start: index of the first point (default: :attr:`ScanCheckpoint.next_point`)
+        :param stop: index after the last point (default: end of the plan)
+        :returns: the checkpoint
+        """
+        plan = self.plan
+        checkpoint = self.checkpoint
+        if start is None:
+            start = checkpoint.next_point
+        if stop is None:
+            stop = len(plan)
+
+        ask = plan._driver._ask_ok_bytes
+        commands = plan.commands
+        dwell = plan._dwell_list
+        sleep = time.sleep if tracing.active is None else tracing.active.sleep
+        clock = time.perf_counter
+        saved = clock()
+
+        last = -1
+        completed = False
+        try:
+            for k in range(start, stop):
+                try:
+                    ask(commands[k])
+                except self.retry_on as e:
+                    self._retry(k, e)
+                last = k
+                if dwell[k] > 0:
+                    sleep(dwell[k])
+                checkpoint.next_point = k + 1
+                if clock() - saved >= self.checkpoint_interval:
+                    checkpoint.save()
+                    saved = clock()
+            completed = True
+        finally:
+            checkpoint.save()
+            if last >= 0:
+                plan._commit(last, completed)
+        return checkpoint
+
+    def _retry(self, k, error):
+        # resend setpoint k until it succeeds or the retries are exhausted
+        driver = self.plan._driver
+        checkpoint = self.checkpoint
+        delay = self.backoff
+        for _ in range(self.max_retries):
+            checkpoint.errors.append([k, repr(error)])
+            checkpoint.retries += 1
+            time.sleep(delay)
+            delay = min(2.0 * delay, self.max_backoff)
+            self._resync()
+            try:
+                driver._ask_ok_bytes(self.plan.commands[k])
+                return
+            except self.retry_on as e:
+                error = e
+        checkpoint.errors.append([k, repr(error)])
+        raise error
+
+    def _resync(self):
+        # discard late replies of the failed command, the device state is unknown
+        driver = self.plan._driver
+        driver.invalidate_registers()
+        try:
+            driver.adapter.flush_read_buffer()
+        except Exception:
+            pass
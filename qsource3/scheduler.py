@@ -0,0 +1,191 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from threading import get_ident
+
+PRIORITY_SETPOINT = 0
+PRIORITY_QUERY = 1
+PRIORITY_TELEMETRY = 2
+
+Reading = namedtuple("Reading", ["value", "timestamp"])
+Reading.__doc__ = """
+Cached reading of :class:`Poller`.
+
+:param value: the value
+:param timestamp: time of the reading (:func:`time.time`)
+"""
+
+
+class PriorityLock:
+    r"""
+    Reentrant lock granted to the waiting thread with the highest priority
+    (the lowest number), threads of the same priority are served in order of arrival.
+
+    Used by :class:`qsource3.qsource3driver.QSource3Driver` to serialize the commands,
+    so the request/response pairing is kept when the driver is shared by several threads.
+    The priority given to :meth:`acquire` can be overridden for all the acquisitions
+    of a thread by :meth:`thread_priority`.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._state = threading.Lock()
+        self._owner = None
+        self._count = 0
+        self._waiters = []  # heap of (priority, order, thread ident, lock)
+        self._order = itertools.count()
+
+    def acquire(self, priority: int = PRIORITY_SETPOINT):
+        """
+        Acquire the lock, block until it is granted.
+
+        :param priority: priority of the caller (lower number - higher priority)
+        """
+        me = get_ident()
+        with self._state:
+            if self._owner == me:
+                self._count += 1
+                return
+            if self._owner is None:
+                self._owner = me
+                self._count = 1
+                return
+            priority = getattr(self._local, "priority", priority)
+            waiter = threading.Lock()
+            waiter.acquire()
+            heapq.heappush(self._waiters, (priority, next(self._order), me, waiter))
+        # released by release() after the ownership was handed over
+        waiter.acquire()
+
+    def release(self):
+        """
+        Release the lock. The lock is handed over to the waiting thread with the highest priority.
+        """
+        with self._state:
+            if self._owner != get_ident():
+                raise RuntimeError("Cannot release un-acquired lock")
+            self._count -= 1
+            if self._count:
+                return
+            if self._waiters:
+                _, _, self._owner, waiter = heapq.heappop(self._waiters)
+                self._count = 1
+                waiter.release()
+            else:
+                self._owner = None
+
+    @contextmanager
+    def thread_priority(self, priority: int):
+        """
+        Context manager setting the priority of all the acquisitions by the calling thread.
+
+        :param priority: priority (lower number - higher priority)
+        """
+        local = self._local
+        previous = getattr(local, "priority", None)
+        local.priority = priority
+        try:
+            yield
+        finally:
+            if previous is None:
+                del local.priority
+            else:
+                local.priority = previous
+
+    def contended(self) -> bool:
+        """True if any other thread waits for the lock."""
+        return bool(self._waiters)
+
+    def locked(self) -> bool:
+        """True if the lock is held by any thread."""
+        return self._owner is not None
+
+
+class Poller:
+    r"""
+    Background reading of telemetry of :class:`qsource3.qsource3driver.QSource3Driver`.
+
+    The quantities are read every ``interval`` seconds with the lowest priority
+    (:data:`PRIORITY_TELEMETRY`), so a scan running in another thread waits at most
+    for one query in progress (a pipelined scan reads its pending replies first).
+    The last readings are cached with their timestamps and can be read at any time
+    without communication with the device.
+
+    .. code-block:: python
+
+        with Poller(driver, interval=1.0) as poller:
+            plan.run()
+            print(poller.readings["current"])
+
+    :param driver: instance of :class:`qsource3.qsource3driver.QSource3Driver`
+    :param interval: period of reading in seconds
+    :param quantities: names of the properties of the driver to be read
+    """
+
+    def __init__(self, driver, interval=1.0, quantities=("current", "frequency", "serial_number")):
+        self._driver = driver
+        self.interval = interval
+        self.quantities = tuple(quantities)
+        self.readings = {}  # name => Reading
+        self.errors = {}  # name => last exception
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        """Start the polling thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="QSource3 poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the polling thread (waits for the query in progress)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def poll(self):
+        """
+        Read all the quantities once (in the calling thread).
+        An exception of a reading is stored in :attr:`errors` and does not stop the polling.
+        """
+        driver = self._driver
+        with driver.priority(PRIORITY_TELEMETRY):
+            for name in self.quantities:
+                try:
+                    value = getattr(driver, name)
+                except Exception as e:
+                    self.errors[name] = e
+                else:
+                    self.readings[name] = Reading(value, time.time())
+
+    def reading(self, name: str, max_age: float = None) -> Reading:
+        """
+        Cached reading of quantity ``name``.
+
+        :param name: name of the quantity
+        :param max_age: maximum age of the reading in seconds (None - any)
+        :returns: instance of :class:`Reading` or None if there is no (recent) reading
+        """
+        reading = self.readings.get(name)
+        if reading is None or (max_age is not None and time.time() - reading.timestamp > max_age):
+            return None
+        return reading
+
+    def _run(self):
+        while not self._stop.is_set():
+            t0 = time.perf_counter()
+            self.poll()
+            self._stop.wait(max(0.0, self.interval - (time.perf_counter() - t0)))
@@ -0,0 +1,213 @@
+import random
+import time
+from collections import deque
+
+from pymeasure.adapters import Adapter
+
+from qsource3.scan import wait_until
+
+
+class SimulatedQSource3:
+    r"""
+    Model of QSource3 device processing commands.
+
+    Implements the command set used by :class:`qsource3.qsource3driver.QSource3Driver`
+    (``#C``, ``#DC1``, ``#DC2``, ``#AC``, ``#F``, ``#G``, ``#B``, ``#U``, ``#N``,
+    ``#Q``, ``#R``, ``#S``) and keeps the state of the device.
+    Invalid commands and values out of range are answered by ``ERR``.
+
+    :param serial_number: three character serial number
+    :param frequencies: frequencies of the ranges 0, 1, 2 in Hz (stored in Flash memory)
+    """
+
+    MAX_DC_MV = 100000
+    MAX_AC_MV = 650000
+
+    def __init__(self, serial_number="001", frequencies=(1050e3, 480e3, 240e3)):
+        self.serial_number = serial_number
+        self.stored_frequencies = list(frequencies)
+        self.frequencies = list(frequencies)
+        self.range = 0
+        self.dc1 = 0  # mV
+        self.dc2 = 0  # mV
+        self.ac = 0  # mV peak-to-peak
+        self.rs485_mode = False
+        self.command_counts = {}
+
+    @property
+    def current(self) -> float:
+        """Excitation current in mA (proportional to AC voltage)."""
+        return 0.2 * self.ac / 1000.0
+
+    def process(self, command: str) -> str:
+        """
+        Process one command (without termination) and return the reply.
+        """
+        parts = command.split()
+        name = parts[0] if parts else ""
+        self.command_counts[name] = self.command_counts.get(name, 0) + 1
+        try:
+            args = [int(p) for p in parts[1:]]
+            return self._process(name, args)
+        except (ValueError, IndexError):
+            return "ERR"
+
+    def _process(self, name, args):
+        if name == "#C" and len(args) == 3:
+            self._check_dc(args[0])
+            self._check_dc(args[1])
+            self._check_ac(args[2])
+            self.dc1, self.dc2, self.ac = args
+        elif name in ("#DC1", "#DC2") and len(args) == 1:
+            self._check_dc(args[0])
+            setattr(self, name[1:].lower(), args[0])
+        elif name == "#AC" and len(args) == 1:
+            self._check_ac(args[0])
+            self.ac = args[0]
+        elif name == "#F" and len(args) == 1:
+            self.frequencies[self.range] = args[0] * 100.0
+        elif name == "#G" and not args:
+            return str(int(round(self.frequencies[self.range] / 100.0)))
+        elif name == "#B" and len(args) == 1:
+            if args[0] not in (0, 1, 2):
+                raise ValueError(args[0])
+            self.range = args[0]
+            self.frequencies[self.range] = self.stored_frequencies[self.range]
+        elif name == "#U" and not args:
+            return str(int(round(self.current * 10.0)))
+        elif name == "#N" and not args:
+            return self.serial_number
+        elif name == "#Q" and not args:
+            pass
+        elif name == "#R" and args == [1]:
+            self.rs485_mode = True
+        elif name == "#S" and not args:
+            self.stored_frequencies[self.range] = self.frequencies[self.range]
+        else:
+            raise ValueError(name)
+        return "OK"
+
+    def _check_dc(self, v):
+        if not -self.MAX_DC_MV <= v <= self.MAX_DC_MV:
+            raise ValueError(v)
+
+    def _check_ac(self, v):
+        if not 0 <= v <= self.MAX_AC_MV:
+            raise ValueError(v)
+
+
+class SimulatedQSource3Adapter(Adapter):
+    r"""
+    Pymeasure adapter connected to :class:`SimulatedQSource3` with a latency model.
+
+    Every command is transmitted over the serial line (10 bits per byte at ``baud_rate``,
+    including the termination character), processed by the device one after another
+    (``processing_delay`` plus uniformly distributed ``jitter``) and the reply is
+    transmitted back. Commands can be pipelined, i.e. written before the previous
+    replies are read.
+
+    With ``realtime=True`` reading blocks until the reply would arrive. Otherwise the
+    adapter only advances the simulated clock :attr:`elapsed`, so long scans can be
+    simulated fast and the simulated duration compared.
+
+    .. code-block:: python
+
+        adapter = SimulatedQSource3Adapter(processing_delay=200e-6)
+        driver = QSource3Driver(adapter)
+
+    :param device: instance of :class:`SimulatedQSource3` (a new one if None)
+    :param baud_rate: baud rate of the serial line
+    :param processing_delay: time of processing one command by the device in seconds
+    :param jitter: maximum random extra processing time in seconds
+    :param realtime: wait for replies in real time
+    :param seed: seed of the random generator of the jitter
+    """
+
+    def __init__(
+        self,
+        device=None,
+        baud_rate=1000000,
+        processing_delay=100e-6,
+        jitter=0.0,
+        realtime=True,
+        seed=None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.device = SimulatedQSource3() if device is None else device
+        self.baud_rate = baud_rate
+        self.processing_delay = processing_delay
+        self.jitter = jitter
+        self.realtime = realtime
+        self._random = random.Random(seed)
+
+        self._replies = deque()  # (time when reply is received, reply)
+        self._errors_to_inject = 0
+        self._t0 = time.perf_counter()
+        self._now = 0.0  # simulated clock (realtime=False)
+        self._line_free = 0.0  # host => device line
+        self._device_free = 0.0
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    @property
+    def elapsed(self) -> float:
+        """Time since creation of the adapter in seconds (simulated if not realtime)."""
+        if self.realtime:
+            return time.perf_counter() - self._t0
+        return self._now
+
+    def inject_errors(self, n: int = 1):
+        """
+        Reply ``ERR`` to the next ``n`` commands without processing them.
+        """
+        self._errors_to_inject += n
+
+    def _transmit_time(self, n_bytes):
+        return 10.0 * n_bytes / self.baud_rate
+
+    def _write(self, command: str, **kwargs):
+        self._write_bytes(command.encode(), **kwargs)
+
+    def _write_bytes(self, content: bytes, **kwargs):
+        for line in content.split(b"\r"):
+            if line:
+                self._command(line.decode())
+
+    def _command(self, command):
+        n_bytes = len(command) + 1  # termination
+        self.bytes_written += n_bytes
+        sent = max(self.elapsed, self._line_free) + self._transmit_time(n_bytes)
+        self._line_free = sent
+
+        start = max(sent, self._device_free)
+        done = start + self.processing_delay
+        if self.jitter:
+            done += self._random.uniform(0.0, self.jitter)
+        self._device_free = done
+
+        if self._errors_to_inject:
+            self._errors_to_inject -= 1
+            reply = "ERR"
+        else:
+            reply = self.device.process(command)
+        received = done + self._transmit_time(len(reply) + 1)
+        self._replies.append((received, reply))
+
+    def _read(self, **kwargs) -> str:
+        if not self._replies:
+            raise TimeoutError("No reply from simulated QSource3")
+        received, reply = self._replies.popleft()
+        self.bytes_read += len(reply) + 1
+        if self.realtime:
+            wait_until(self._t0 + received)
+        else:
+            self._now = max(self._now, received)
+        return reply
+
+    def _read_bytes(self, count, break_on_termchar=False, **kwargs) -> bytes:
+        reply = (self._read() + "\r").encode()
+        return reply if count < 0 else reply[:count]
+
+    def flush_read_buffer(self):
+        self._replies.clear()
@@ -0,0 +1,233 @@
+import struct
+
+import numpy as np
+
+_MAGIC = b"QS3SPEC1"
+_HEADER = struct.Struct("<8sQ16s")  # magic, number of points, dtype of the scans
+_HEADER_SIZE = 64
+_MZ_DTYPE = np.dtype("<f8")  # the m/z row is float64 for any dtype of the scans
+
+
+def _header_bytes(n_points, dtype):
+    header = _HEADER.pack(_MAGIC, n_points, np.dtype(dtype).str.encode())
+    return header.ljust(_HEADER_SIZE, b"\0")
+
+
+def _read_header(f):
+    magic, n_points, dtype = _HEADER.unpack(f.read(_HEADER_SIZE)[: _HEADER.size])
+    if magic != _MAGIC:
+        raise ValueError("Not a spectrum store file")
+    return n_points, np.dtype(dtype.rstrip(b"\0").decode())
+
+
+def load_spectra(path):
+    r"""
+    Open the file written by :class:`SpectrumStore` for reading.
+
+    The scans are memory mapped, so they are not loaded into memory
+    until they are accessed.
+
+    :param path: path to the file
+    :returns: tuple ``(mz, scans)`` where ``mz`` is float64 array (for any dtype of the scans)
+              and ``scans`` is read-only 2D array (scan, point)
+    """
+    with open(path, "rb") as f:
+        n_points, dtype = _read_header(f)
+        f.seek(0, 2)
+        size = f.tell()
+    offset = _HEADER_SIZE + n_points * _MZ_DTYPE.itemsize
+    row = n_points * dtype.itemsize
+    mz = np.fromfile(path, dtype=_MZ_DTYPE, count=n_points, offset=_HEADER_SIZE)
+    n_scans = (size - offset) // row if row else 0
+    if n_scans == 0:
+        return mz, np.zeros((0, n_points), dtype=dtype)
+    scans = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(n_scans, n_points))
+    return mz, scans
+
+
+class SpectrumStore:
+    r"""
+    Store of repeated scans over the same :math:`m/z` axis.
+
+    The most recent ``capacity`` scans are kept in a preallocated ring buffer,
+    so repeating the scan does not allocate memory. If ``path`` is given,
+    every completed scan is also appended to a file, which is memory mapped for reading
+    (see :attr:`archive` and :func:`load_spectra`). The resident memory is therefore
+    constant for any number of scans.
+
+    The scans are indexed by the number of the scan since the creation of the store
+    (negative indices count from the last scan). :meth:`scan` returns a view
+    (no copy) of the ring buffer or of the memory mapped file.
+
+    .. code-block:: python
+
+        plan = q.compile_scan(mz_vec)
+        store = SpectrumStore.from_plan(plan, capacity=100, path="run.spec")
+        pipeline = ScanPipeline(plan, detector)
+        while True:
+            spectrum = store.acquire(pipeline)
+
+    :param mz: 1D array of :math:`m/z` (shared axis of all the scans)
+    :param capacity: number of the scans in the ring buffer
+    :param path: file for all the scans (None - only the ring buffer is kept)
+    :param dtype: data type of the values
+    """
+
+    def __init__(self, mz, capacity=100, path=None, dtype=np.float64):
+        if capacity < 1:
+            raise ValueError(f"Invalid capacity: {capacity}")
+        self.mz = np.array(mz, dtype=float)
+        self.mz.flags.writeable = False
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.path = path
+
+        self._ring = np.zeros((capacity, len(self.mz)), dtype=self.dtype)
+        self._count = 0  # completed scans
+        self._open = False  # scan started by begin_scan
+
+        self._file = None
+        self._archive = None  # memory map of the file, refreshed when needed
+        if path is not None:
+            self._file = open(path, "wb")
+            self._file.write(_header_bytes(len(self.mz), self.dtype))
+            self._file.write(self.mz.astype(_MZ_DTYPE).tobytes())
+            self._file.flush()
+
+    @classmethod
+    def from_plan(cls, plan, capacity=100, path=None, dtype=np.float64):
+        """
+        Create store for the scans of :class:`qsource3.scan.ScanPlan`.
+
+        :param plan: instance of :class:`qsource3.scan.ScanPlan`
+        :param capacity: number of the scans in the ring buffer
+        :param path: file for all the scans (None - only the ring buffer is kept)
+        :param dtype: data type of the values
+        """
+        return cls(plan.mz, capacity, path, dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Close the file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._archive = None
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def n_points(self) -> int:
+        """Number of points of a scan."""
+        return len(self.mz)
+
+    def begin_scan(self) -> np.ndarray:
+        """
+        Start a new scan.
+
+        :returns: writable row of the ring buffer to be filled with the values
+                  (the oldest scan in the ring buffer is overwritten)
+        """
+        self._open = True
+        row = self._ring[self._count % self.capacity]
+        row[:] = 0
+        return row
+
+    def end_scan(self) -> np.ndarray:
+        """
+        Complete the scan started by :meth:`begin_scan` (and write it to the file).
+
+        :returns: read-only view of the completed scan
+        """
+        if not self._open:
+            raise RuntimeError("No scan started")
+        row = self._ring[self._count % self.capacity]
+        if self._file is not None:
+            self._file.write(row.tobytes())
+        self._count += 1
+        self._open = False
+        return self.scan(-1)
+
+    def append(self, values) -> np.ndarray:
+        """
+        Store one complete scan.
+
+        :param values: 1D array of the values (one per point)
+        :returns: read-only view of the stored scan
+        """
+        values = np.asarray(values)
+        if values.shape != (self.n_points,):
+            raise ValueError(f"Expected {self.n_points} values, got shape {values.shape}")
+        self.begin_scan()[:] = values
+        return self.end_scan()
+
+    def acquire(self, pipeline, start: int = 0, stop: int = None) -> np.ndarray:
+        """
+        Run :class:`qsource3.scan.ScanPipeline` and store its results as one scan.
+        The chunks are copied directly into the ring buffer.
+
+        :param pipeline: instance of :class:`qsource3.scan.ScanPipeline` with the same :math:`m/z`
+        :param start: index of the first point
+        :param stop: index after the last point (default: end of the plan)
+        :returns: read-only view of the stored scan
+        """
+        if len(pipeline.plan) != self.n_points:
+            raise ValueError("The pipeline does not match m/z axis of the store")
+        row = self.begin_scan()
+        k = start
+        try:
+            for _, values in pipeline.run(start, stop):
+                row[k : k + len(values)] = values
+                k += len(values)
+        except BaseException:
+            self._open = False
+            raise
+        return self.end_scan()
+
+    def scan(self, i: int) -> np.ndarray:
+        """
+        Completed scan ``i`` as read-only view (no copy).
+
+        :param i: number of the scan since creation of the store (negative - from the last)
+        """
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(f"Scan {i} out of range")
+        # the oldest slot of the ring buffer is overwritten by a started scan
+        if i >= self._count - self.capacity + self._open:
+            view = self._ring[i % self.capacity].view()
+            view.flags.writeable = False
+            return view
+        return self.archive[i]
+
+    __getitem__ = scan
+
+    def recent(self) -> np.ndarray:
+        """
+        The scans in the ring buffer from the oldest to the last one (copy).
+
+        :returns: 2D array (scan, point)
+        """
+        n = min(self._count, self.capacity)
+        first = (self._count - n) % self.capacity
+        return np.roll(self._ring, -first, axis=0)[:n]
+
+    @property
+    def archive(self) -> np.ndarray:
+        """
+        All the completed scans memory mapped from the file (read-only 2D array).
+        """
+        if self.path is None:
+            raise IndexError("Scans older than the ring buffer are not kept (no path given)")
+        if self._archive is None or len(self._archive) != self._count:
+            if self._file is not None:
+                self._file.flush()
+            self._archive = load_spectra(self.path)[1]
+        return self._archive
@@ -0,0 +1,190 @@
+"""
+Opt-in tracing of the time spent in the layers of the package.
+
+When tracing is enabled (:func:`enable_tracing` or :func:`trace`), the instrumented
+code records spans:
+
+- ``mz`` - one point set by :attr:`qsource3.massfilter.Quadrupole.mz`
+- ``calc_uv`` - calibration math (:meth:`qsource3.massfilter.QuadrupoleCalibration.calc_uv`)
+- ``validators`` - truncation and rounding of the values in
+  :meth:`qsource3.qsource3driver.QSource3Driver.set_voltages`
+- ``formatting`` - formatting of the command in
+  :meth:`qsource3.qsource3driver.QSource3Driver.set_voltages`
+- ``serial`` - write of a command and waiting for its reply
+- ``sleep`` - dwell times of :class:`qsource3.scan.ScanPlan` and :class:`qsource3.scan.ScanExecutor`
+  (use :meth:`Tracer.sleep` for sleeps of your own loop)
+
+.. code-block:: python
+
+    with trace() as tracer:
+        for mz in mz_vec:
+            q.mz = mz
+    print(tracer.summary())
+    tracer.export_chrome("scan.json")  # open in chrome://tracing or Perfetto
+
+When tracing is disabled, the instrumented code only checks that :data:`active` is None.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+active = None  # the enabled Tracer (None - tracing disabled)
+
+
+class Tracer:
+    r"""
+    Recorder of spans (name, category, start, end, thread).
+
+    :param max_events: maximum number of recorded spans, further spans are counted in
+                       :attr:`dropped` only
+    """
+
+    clock = staticmethod(time.perf_counter)
+
+    def __init__(self, max_events=1000000):
+        self.max_events = max_events
+        self.events = []  # (name, category, start, end, thread ident)
+        self.dropped = 0
+        self.t0 = self.clock()
+
+    def add(self, name: str, category: str, start: float, end: float = None):
+        """
+        Record span which started at ``start`` (:attr:`clock`).
+
+        :param name: name of the span
+        :param category: category (layer) of the span
+        :param start: start time
+        :param end: end time (None - now)
+        """
+        if end is None:
+            end = self.clock()
+        if len(self.events) < self.max_events:
+            self.events.append((name, category, start, end, threading.get_ident()))
+        else:
+            self.dropped += 1
+
+    @contextmanager
+    def span(self, name: str, category: str = "user"):
+        """
+        Context manager recording span of the code inside the context.
+        """
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add(name, category, start)
+
+    def sleep(self, seconds: float):
+        """:func:`time.sleep` recorded as ``sleep`` span."""
+        start = self.clock()
+        time.sleep(seconds)
+        self.add("sleep", "sleep", start)
+
+    def to_chrome(self) -> dict:
+        """
+        Spans in `Chrome trace event format
+        <https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU>`_
+        (complete events, times in microseconds from creation of the tracer).
+        """
+        pid = os.getpid()
+        return {
+            "traceEvents": [
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": (start - self.t0) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": pid,
+                    "tid": tid,
+                }
+                for name, category, start, end, tid in self.events
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+    def export_chrome(self, path):
+        """
+        Write the spans to JSON file in Chrome trace event format (see :meth:`to_chrome`).
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_chrome(), f)
+
+    def stats(self) -> dict:
+        """
+        Statistics of the spans by name.
+
+        :returns: dictionary {name: {"count", "total", "mean", "max"}} (times in seconds)
+        """
+        stats = {}
+        for name, _, start, end, _ in self.events:
+            d = end - start
+            s = stats.get(name)
+            if s is None:
+                stats[name] = {"count": 1, "total": d, "max": d}
+            else:
+                s["count"] += 1
+                s["total"] += d
+                if d > s["max"]:
+                    s["max"] = d
+        for s in stats.values():
+            s["mean"] = s["total"] / s["count"]
+        return stats
+
+    def summary(self) -> str:
+        """
+        Table of the statistics of the spans, sorted by total time.
+        """
+        stats = self.stats()
+        lines = [
+            f"{'span':12s} {'count':>8s} {'total ms':>10s} {'mean us':>10s} {'max us':>10s}"
+        ]
+        for name, s in sorted(stats.items(), key=lambda item: -item[1]["total"]):
+            lines.append(
+                f"{name:12s} {s['count']:8d} {s['total'] * 1e3:10.3f}"
+                f" {s['mean'] * 1e6:10.2f} {s['max'] * 1e6:10.2f}"
+            )
+        if self.dropped:
+            lines.append(f"{self.dropped} spans dropped")
+        return "\n".join(lines)
+
+
+def enable_tracing(max_events=1000000) -> Tracer:
+    """
+    Enable tracing with a new :class:`Tracer`.
+
+    :param max_events: maximum number of recorded spans
+    :returns: the tracer
+    """
+    global active
+    active = Tracer(max_events)
+    return active
+
+
+def disable_tracing() -> Tracer:
+    """
+    Disable tracing.
+
+    :returns: the tracer which was enabled (or None)
+    """
+    global active
+    tracer = active
+    active = None
+    return tracer
+
+
+@contextmanager
+def trace(max_events=1000000):
+    """
+    Context manager enabling tracing inside the context.
+
+    :param max_events: maximum number of recorded spans
+    :returns: the tracer
+    """
+    tracer = enable_tracing(max_events)
+    try:
+        yield tracer
+    finally:
+        disable_tracing()
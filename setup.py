@@ -11,6 +11,9 @@ setup(
         "scipy",
         "pymeasure"
     ],
+    extras_require={
+        "asyncio": ["pyserial-asyncio"],
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
@@ -0,0 +1,30 @@
+import pytest
+
+from qsource3.massfilter import Quadrupole
+from qsource3.qsource3driver import QSource3Driver
+from qsource3.simulator import SimulatedQSource3Adapter
+
+
+@pytest.fixture
+def simulated_driver():
+    """Factory of drivers connected to a new simulated device."""
+
+    def make(processing_delay=0.0, realtime=True, **kwargs):
+        adapter = SimulatedQSource3Adapter(
+            processing_delay=processing_delay, realtime=realtime, **kwargs
+        )
+        return QSource3Driver(adapter)
+
+    return make
+
+
+@pytest.fixture
+def simulated_quadrupole(simulated_driver):
+    """Factory of quadrupoles (1 MHz, r0 = 3 mm) with a simulated device."""
+
+    def make(processing_delay=0.0, realtime=True, driver=None, **kwargs):
+        if driver is None:
+            driver = simulated_driver(processing_delay, realtime)
+        return Quadrupole(frequency=1e6, r0=3e-3, driver=driver, **kwargs)
+
+    return make
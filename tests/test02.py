@@ -1,7 +1,7 @@
-import time
 import numpy as np
 from qsource3.qsource3driver import QSource3Driver
 from qsource3.massfilter import Quadrupole
+from qsource3.scan import ScanExecutor
 
 
 def make_full_scan(q: Quadrupole):
@@ -11,10 +11,12 @@ def make_full_scan(q: Quadrupole):
     # create vector of m/z values from 0 to max_mz with step 0.1
     mz_vec = np.arange(0, max_mz, 0.1)
 
-    #  scan over mz_vec
-    for mz in mz_vec:
-        q.mz = mz
-        time.sleep(0.1)
+    # precompile the scan with dwell 0.1 s per point
+    plan = q.compile_scan(mz_vec, dwell=0.1)
+
+    # run the scan against absolute deadlines
+    timing = ScanExecutor(plan).run()
+    print(timing.summary())
 
 
 # characteristic radius of the quadrupole
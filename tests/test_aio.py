@@ -0,0 +1,172 @@
+import asyncio
+
+import pytest
+
+from qsource3.aio import AsyncQSource3Driver, AsyncQuadrupole
+
+
+class ProtocolWriter:
+    """Stream writer checking the written commands and feeding the replies."""
+
+    def __init__(self, reader, comm_pairs):
+        self._reader = reader
+        self._comm_pairs = list(comm_pairs)
+
+    def write(self, data):
+        command, reply, *delay = self._comm_pairs.pop(0)
+        assert data == command.encode() + b"\r"
+        if delay:  # reply after delay in seconds
+            asyncio.get_running_loop().call_later(
+                delay[0], self._reader.feed_data, reply.encode() + b"\r"
+            )
+        else:
+            self._reader.feed_data(reply.encode() + b"\r")
+
+    async def drain(self):
+        pass
+
+
+def run_protocol(comm_pairs, coro_fnc, **kwargs):
+    async def main():
+        reader = asyncio.StreamReader()
+        writer = ProtocolWriter(reader, comm_pairs)
+        await coro_fnc(AsyncQSource3Driver(reader, writer, **kwargs))
+        assert writer._comm_pairs == []
+
+    asyncio.run(main())
+
+
+def test_driver():
+    async def scenario(driver):
+        await driver.test_communication()
+        await driver.set_voltages(1.0, -1.0, 1000.0)
+        await driver.set_dc_voltage(1, 2.0)
+        await driver.set_dc_voltage(1, 2.0)
+        await driver.set_ac_voltage(1.0)
+        assert await driver.get_frequency() == 1e6
+        assert await driver.get_current() == 123.4
+        await driver.set_range(1)
+        with pytest.raises(ValueError):
+            await driver.set_range(3)
+
+    run_protocol(
+        [
+            ("#Q", "OK"),
+            ("#C 1000 -1000 650000", "OK"),
+            ("#DC1 2000", "OK"),
+            ("#AC 1000", "OK"),
+            ("#G", "10000"),
+            ("#U", "1234"),
+            ("#B 1", "OK"),
+        ],
+        scenario,
+    )
+
+
+def test_driver_error():
+    async def scenario(driver):
+        with pytest.raises(ConnectionError, match="#Q"):
+            await driver.test_communication()
+
+    run_protocol([("#Q", "ERR")], scenario)
+
+
+def test_driver_concurrent_setters():
+    async def scenario(driver):
+        await driver.set_voltages(0, 0, 0)
+        await asyncio.gather(driver.set_voltages(1, 1, 1), driver.set_voltages(0, 0, 0))
+        assert driver.registers == {"dc1": 0, "dc2": 0, "ac": 0}
+        await asyncio.gather(driver.set_dc_voltage(1, 2), driver.set_dc_voltage(1, 0))
+        await asyncio.gather(driver.set_ac_voltage(2), driver.set_ac_voltage(0))
+        assert driver.registers == {"dc1": 0, "dc2": 0, "ac": 0}
+
+    run_protocol(
+        [
+            ("#C 0 0 0", "OK"),
+            ("#C 1000 1000 1000", "OK"),
+            ("#C 0 0 0", "OK"),
+            ("#DC1 2000", "OK"),
+            ("#DC1 0", "OK"),
+            ("#AC 2000", "OK"),
+            ("#AC 0", "OK"),
+        ],
+        scenario,
+    )
+
+
+def test_driver_late_reply():
+    async def scenario(driver):
+        await driver.set_voltages(1.0, 2.0, 3.0)
+        with pytest.raises(asyncio.TimeoutError):
+            await driver.set_voltages(4.0, 5.0, 6.0)
+        assert driver.registers == {"dc1": None, "dc2": None, "ac": None}
+        # the late "ERR" is discarded, the reply of "#G" is read
+        assert await driver.get_frequency() == 1e6
+        await driver.set_voltages(4.0, 5.0, 6.0)  # sent again
+
+        # the late reply does not arrive in time, the command is not sent
+        with pytest.raises(asyncio.TimeoutError):
+            await driver.test_communication()
+        with pytest.raises(ConnectionError, match="not sent"):
+            await driver.get_frequency()
+        await asyncio.sleep(0.1)
+        assert await driver.get_frequency() == 1e6
+
+        # cancelled task
+        task = asyncio.ensure_future(driver.test_communication())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await driver.test_communication()
+
+    run_protocol(
+        [
+            ("#C 1000 2000 3000", "OK"),
+            ("#C 4000 5000 6000", "ERR", 0.1),
+            ("#G", "10000"),
+            ("#C 4000 5000 6000", "OK"),
+            ("#Q", "OK", 0.15),
+            ("#G", "10000"),
+            ("#Q", "OK", 0.03),
+            ("#Q", "OK"),
+        ],
+        scenario,
+        timeout=0.05,
+    )
+
+
+def test_quadrupole():
+    async def scenario(driver):
+        q = await AsyncQuadrupole.create(frequency=1e6, r0=3e-3, driver=driver)
+        assert 500.03188840522085 == pytest.approx(q.max_mz)
+
+        await q.set_mz(100)
+        assert 64.99585477169073 == pytest.approx(q.rf)
+        assert 10.909360892982084 == pytest.approx(q.dc_diff)
+
+        await q.set_dc_offst(-10)
+        assert -10.0 == pytest.approx(q.dc_offst)
+
+        await q.set_is_rod_polarity_positive(False)
+        assert -10.909360892982084 == pytest.approx(q.dc_diff)
+
+        await q.set_is_dc_on(False)
+        assert 0.0 == pytest.approx(q.dc_diff)
+
+        await q.set_is_dc_on(True)
+        assert -10.909360892982084 == pytest.approx(q.dc_diff)
+
+    run_protocol(
+        [
+            ("#C 0 0 0", "OK"),
+            ("#C 10909 -10909 129992", "OK"),
+            ("#DC1 909", "OK"),
+            ("#DC2 -20909", "OK"),
+            ("#DC1 -20909", "OK"),
+            ("#DC2 909", "OK"),
+            ("#C -10000 -10000 129992", "OK"),
+            ("#C -20909 909 129992", "OK"),
+        ],
+        scenario,
+    )
@@ -0,0 +1,50 @@
+import time
+
+import numpy as np
+import pytest
+
+from qsource3.bus import QSource3Bus
+
+
+def test_set_mz(simulated_quadrupole):
+    units = [simulated_quadrupole(), simulated_quadrupole()]
+    units.append(simulated_quadrupole(driver=units[1]._driver))  # two units on one port
+    with QSource3Bus(units) as bus:
+        bus.set_mz([10.0, 20.0, 30.0])
+        assert [q.mz for q in units] == [10.0, 20.0, 30.0]
+        assert units[0]._driver.adapter.device.ac == 12999
+        assert units[1]._driver.adapter.device.ac == 38998
+
+        bus.set_voltages([(1, 1, 1), (2, 2, 2), (3, 3, 3)])
+        assert [q.dc1 for q in units] == [1, 2, 3]
+
+        with pytest.raises(ValueError):
+            bus.set_mz([1.0])
+
+
+def test_concurrent_latency(simulated_quadrupole):
+    delay = 0.02
+    units = [simulated_quadrupole(processing_delay=delay) for _ in range(4)]
+    with QSource3Bus(units) as bus:
+        bus.compile_scans([np.array([1.0, 2.0, 3.0])] * 4)
+        t0 = time.perf_counter()
+        for k in range(3):
+            bus.set_point(k)
+        elapsed = time.perf_counter() - t0
+    # each step is limited by the slowest unit, not the sum over units
+    assert elapsed < 3 * 2 * delay
+    assert [q.mz for q in units] == [3.0] * 4
+
+
+def test_run_and_errors(simulated_quadrupole):
+    units = [simulated_quadrupole(), simulated_quadrupole()]
+    with QSource3Bus(units) as bus:
+        bus.compile_scans([np.linspace(1, 10, 5), np.linspace(10, 20, 5)], dwell=0.001)
+        timing = bus.run()
+        assert timing.duration >= 0.005
+        assert units[1].mz == 20.0
+
+        units[1]._driver.adapter.inject_errors(1)
+        with pytest.raises(ConnectionError):
+            bus.set_mz([5.0, 5.0])
+        assert units[0].mz == 5.0
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from qsource3.config import QuadrupoleCache, QuadrupoleConfig
+
+CALIB_PNTS = [[100, 0.95], [200, 0.98], [300, 0.955], [400, 0.97]]
+
+
+def test_save_load(tmp_path, simulated_driver, simulated_quadrupole):
+    q = simulated_quadrupole(
+        realtime=False, calib_pnts_rf=CALIB_PNTS, calib_pnts_dc=[[100, -0.01]]
+    )
+    q.is_rod_polarity_positive = False
+    plan = q.compile_scan(np.linspace(1, 300, 100), dwell=0.01)
+
+    config = QuadrupoleConfig.from_quadrupole(q, [plan])
+    path = tmp_path / "q.qs3"
+    config.save(path)
+    loaded = QuadrupoleConfig.load(path, verify=True)
+    assert loaded.key == config.key
+    assert isinstance(loaded.scans[0]["ac_mv"], np.memmap)
+
+    q2 = loaded.create_quadrupole(simulated_driver(realtime=False))
+    assert q2.frequency == q.frequency
+    assert not q2.is_rod_polarity_positive
+    np.testing.assert_array_equal(q2.calib_pnts_rf, q.calib_pnts_rf)
+    mz = np.linspace(0, 400, 57)
+    np.testing.assert_array_equal(q2.calc_uv_array(mz)[1], q.calc_uv_array(mz)[1])
+    assert q2.calc_uv(123.4) == q.calc_uv(123.4)
+
+    plan2 = loaded.plans(q2)[0]
+    assert plan2.commands == plan.commands
+    np.testing.assert_array_equal(plan2.dwell, plan.dwell)
+    plan2.run()
+    device = q2._driver.adapter.device
+    assert device.ac == plan.ac_mv[-1]
+    assert q2.mz == plan.mz[-1]
+
+    # a different configuration has a different key
+    q.calib_pnts_dc = [[100, -0.02]]
+    assert QuadrupoleConfig.from_quadrupole(q, [plan]).key != config.key
+
+
+def test_load_invalid(tmp_path):
+    path = tmp_path / "q.qs3"
+    path.write_bytes(b"nothing")
+    with pytest.raises(ValueError):
+        QuadrupoleConfig.load(path)
+
+
+def test_cache(tmp_path, simulated_driver):
+    cache = QuadrupoleCache(tmp_path)
+    args = dict(
+        frequency=1e6, r0=3e-3, calib_pnts_rf=CALIB_PNTS, mz_vecs=[np.linspace(1, 100, 10)]
+    )
+    q, plans = cache.load_or_create(simulated_driver(realtime=False), **args)
+    files = list(tmp_path.iterdir())
+    assert len(files) == 1
+    assert files[0].stem == QuadrupoleConfig.from_quadrupole(q, plans).key
+
+    # warm start
+    q2, plans2 = cache.load_or_create(simulated_driver(realtime=False), **args)
+    assert isinstance(plans2[0].ac_mv, np.memmap)
+    assert plans2[0].commands == plans[0].commands
+    assert len(list(tmp_path.iterdir())) == 1
+
+    cache.load_or_create(simulated_driver(realtime=False), **{**args, "r0": 4e-3})
+    assert len(list(tmp_path.iterdir())) == 2
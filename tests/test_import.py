@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+
+# generous limit of cold import time, tune by environment variable on slow machines
+IMPORT_TIME_BUDGET = float(os.environ.get("QSOURCE3_IMPORT_TIME_BUDGET", "2.0"))  # s
+
+
+def run_python(code):
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    return result.stdout.strip()
+
+
+def test_scipy_is_not_imported():
+    out = run_python(
+        "import sys\n"
+        "import qsource3.massfilter, qsource3.scan, qsource3.aio\n"
+        "from qsource3.massfilter import interp_fnc\n"
+        "interp_fnc([[1, 2], [3, 4]])\n"
+        "print(sorted(m for m in sys.modules if m.split('.')[0] == 'scipy'))"
+    )
+    assert out == "[]"
+
+
+def test_scipy_is_imported_for_spline():
+    out = run_python(
+        "import sys\n"
+        "from qsource3.massfilter import interp_fnc\n"
+        "interp_fnc([[1, 2], [3, 4], [5, 5]])\n"
+        "print('scipy.interpolate' in sys.modules)"
+    )
+    assert out == "True"
+
+
+def test_import_time():
+    out = run_python(
+        "import time\n"
+        "t0 = time.perf_counter()\n"
+        "import qsource3.massfilter\n"
+        "print(time.perf_counter() - t0)"
+    )
+    import_time = float(out)
+    print(f"import qsource3.massfilter: {import_time * 1e3:.1f} ms")
+    assert import_time < IMPORT_TIME_BUDGET
@@ -1,5 +1,7 @@
 import numpy as np
+import pytest
 import matplotlib.pyplot as plt
+from scipy import interpolate
 from qsource3.massfilter import interp_fnc
 
 # Define calibration points for mass
@@ -23,3 +25,32 @@ plt.legend()
 plt.grid(True)
 plt.title('Resolution calibration function rho(m/z) (Interpolated)')
 plt.show()
+
+
+@pytest.mark.parametrize(
+    "xy, kind",
+    [
+        ([[100, 0.95], [200, 0.98], [300, 0.955], [400, 0.97]], "quadratic"),
+        ([[50, 0.3], [10, 0.1], [5, 0.2]], "quadratic"),
+        ([[1, 2], [3, 5]], "slinear"),
+        ([[3, 5], [1, 2]], "slinear"),
+    ],
+)
+def test_interp_fnc_matches_interp1d(xy, kind):
+    xy = np.array(xy, dtype=float)
+    expected = interpolate.interp1d(
+        xy[:, 0], xy[:, 1], fill_value="extrapolate", kind=kind
+    )
+    f = interp_fnc(xy)
+
+    x = np.linspace(-100, 600, 1001)  # including extrapolation
+    assert f(x) == pytest.approx(expected(x), rel=1e-12, abs=1e-12)
+    for v in x[::50]:
+        assert f(float(v)) == pytest.approx(float(expected(v)), rel=1e-12, abs=1e-12)
+
+
+def test_interp_fnc_constant():
+    assert interp_fnc([[1.0, 3.0]])(5.0) == 3.0
+    assert interp_fnc([[1.0, 3.0]])(np.arange(3)).tolist() == [3.0, 3.0, 3.0]
+    assert interp_fnc([])(5.0) == 0.0
+    assert interp_fnc([])(np.arange(3)).tolist() == [0.0, 0.0, 0.0]
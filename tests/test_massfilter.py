@@ -1,3 +1,4 @@
+import numpy as np
 import pytest
 
 from pymeasure.test import expected_protocol
@@ -18,8 +19,7 @@ with expected_protocol(
         (r"#DC1 -20909", r"OK"),
         (r"#DC2 909", r"OK"),  # 3 ... q.is_rod_polarity_positive = False
         (r"#C -10000 -10000 129992", r"OK"),  # 4 ... q.is_dc_on = False
-        (r"#DC1 -10000", r"OK"),
-        (r"#DC2 -10000", r"OK"),  # 5 ... q.is_rod_polarity_positive = False
+        # 5 ... q.is_rod_polarity_positive = True => no change of DC voltages
         (r"#C 909 -20909 129992", r"OK"),  # 6 ... q.is_dc_on = True
     ],
 ) as driver:
@@ -77,3 +77,175 @@ with expected_protocol(
     assert 64.99585477169073 == pytest.approx(q.rf)
     assert 10.909360892982084 == pytest.approx(q.dc_diff)
     assert -10.0 == pytest.approx(q.dc_offst)
+
+
+def test_calc_uv_array():
+    with expected_protocol(
+        QSource3Driver,
+        [(r"#C 0 0 0", r"OK")],
+    ) as driver:
+        q = Quadrupole(
+            frequency=1e6,
+            r0=3e-3,
+            driver=driver,
+            calib_pnts_rf=[[10, 0.01], [100, 0.02], [400, 0.015]],
+            calib_pnts_dc=[[10, -0.01], [500, -0.02]],
+        )
+        mz_vec = np.linspace(0, 500, 51)
+        u, v = q.calc_uv_array(mz_vec)
+        for mz, u_i, v_i in zip(mz_vec, u, v):
+            assert (u_i, v_i) == pytest.approx(q.calc_uv(mz))
+
+
+def test_calc_voltages_array():
+    with expected_protocol(
+        QSource3Driver,
+        [
+            (r"#C 0 0 0", r"OK"),
+            (r"#DC1 -10000", r"OK"),
+            (r"#DC2 -10000", r"OK"),
+        ],
+    ) as driver:
+        q = Quadrupole(frequency=1e6, r0=3e-3, driver=driver)
+        q.dc_offst = -10
+        mz_vec = np.array([-1.0, 0.0, 100.0])
+
+        dc1, dc2, rf = q.calc_voltages_array(mz_vec)
+        assert rf == pytest.approx([0.0, 0.0, 64.99585477169073])
+        assert dc1 == pytest.approx([-10.0, -10.0, -10.0 + 10.909360892982084])
+        assert dc2 == pytest.approx([-10.0, -10.0, -10.0 - 10.909360892982084])
+
+        q._is_rod_polarity_positive = False
+        dc1, dc2, rf = q.calc_voltages_array(mz_vec)
+        assert dc1[2] == pytest.approx(-10.0 - 10.909360892982084)
+        assert dc2[2] == pytest.approx(-10.0 + 10.909360892982084)
+
+        q._is_dc_on = False
+        dc1, dc2, rf = q.calc_voltages_array(mz_vec)
+        assert dc1 == pytest.approx([-10.0] * 3)
+        assert dc2 == pytest.approx([-10.0] * 3)
+
+
+def test_shared_driver_register_cache():
+    with expected_protocol(
+        QSource3Driver,
+        [
+            (r"#C 0 0 0", r"OK"),  # q1 reset, q2 reset is suppressed
+            (r"#C 10909 -10909 129992", r"OK"),  # q1.mz = 100
+            (r"#C 0 0 0", r"OK"),  # q2.mz = 0
+            (r"#C 10909 -10909 129992", r"OK"),  # q2.mz = 100
+        ],
+    ) as driver:
+        q1 = Quadrupole(frequency=1e6, r0=3e-3, driver=driver, name="Q1")
+        q2 = Quadrupole(frequency=1e6, r0=3e-3, driver=driver, name="Q2")
+        q1.mz = 100
+        q1.mz = 100
+        q2.mz = 0
+        q2.mz = 100
+        q1.mz = 100
+        q1.dc_offst = 0
+
+
+def test_batch():
+    with expected_protocol(
+        QSource3Driver,
+        [
+            (r"#C 0 0 0", r"OK"),
+            (r"#C 10909 -10909 129992", r"OK"),  # q.mz = 100
+            (r"#C -20909 909 129992", r"OK"),  # dc_offst + polarity in one command
+            (r"#AC 0", r"OK"),  # only RF changed
+            (r"#C -10000 -10000 129992", r"ERR"),  # failed batch is rolled back
+        ],
+    ) as driver:
+        q = Quadrupole(frequency=1e6, r0=3e-3, driver=driver)
+        q.mz = 100
+
+        with q.batch():
+            q.dc_offst = -10
+            with q.batch():
+                q.is_rod_polarity_positive = False
+            assert -10.909360892982084 == pytest.approx(q.dc_diff)
+        assert -10.0 == pytest.approx(q.dc_offst)
+
+        with q.batch():
+            q.rf = 0
+            q.dc_diff = -10.909360892982084
+
+        with q.batch():
+            q.rf = 64.99585477169073
+            q.rf = 0  # no change
+
+        with pytest.raises(ValueError):
+            with q.batch():
+                q.dc_offst = 100
+                raise ValueError()
+        assert -10.0 == pytest.approx(q.dc_offst)
+
+        with pytest.raises(ConnectionError):
+            with q.batch():
+                q.is_dc_on = False
+        assert q.is_dc_on
+        assert -10.909360892982084 == pytest.approx(q.dc_diff)
+
+
+def test_mz_from_rf():
+    with expected_protocol(
+        QSource3Driver,
+        [(r"#C 0 0 0", r"OK")],
+    ) as driver:
+        q = Quadrupole(
+            frequency=1e6,
+            r0=3e-3,
+            driver=driver,
+            calib_pnts_rf=[[10, 0.01], [100, 0.02], [400, -0.015]],
+        )
+        mz_vec = np.linspace(0, 480, 4801)
+        _, v = q.calc_uv_array(mz_vec)
+        assert q.mz_from_rf(v) == pytest.approx(mz_vec, abs=1e-6)
+        assert q.mz_from_rf_error < 1e-6
+        assert q.mz_from_rf(-1.0) == 0.0
+
+        # the table is refreshed with new calibration
+        q.calib_pnts_rf = [[10, 0.1], [500, 0.1]]
+        _, v = q.calc_uv_array(mz_vec)
+        assert q.mz_from_rf(v) == pytest.approx(mz_vec, abs=1e-6)
+
+        q.calib_pnts_rf = [[10, 0.0], [100, -0.9], [200, 0.0]]
+        with pytest.raises(ValueError):
+            q.mz_from_rf(10.0)
+
+
+def test_calc_uv_cache():
+    with expected_protocol(
+        QSource3Driver,
+        [(r"#C 0 0 0", r"OK")],
+    ) as driver:
+        q = Quadrupole(
+            frequency=1e6,
+            r0=3e-3,
+            driver=driver,
+            calib_pnts_rf=[[10, 0.01], [100, 0.02], [400, 0.015]],
+            uv_cache_size=2,
+        )
+        u0, v0 = q._calc_uv(100.0)
+
+        u, v = q.calc_uv(100.0)
+        # error is below the resolution of the device
+        assert abs(v - v0) <= driver.AC_RESOLUTION / 4
+        assert abs(u - u0) <= driver.DC_RESOLUTION / 2
+        assert q.calc_uv(100.0 + 1e-6) == (u, v)
+        q.calc_uv(200.0)
+        q.calc_uv(300.0)  # drops 100.0
+        q.calc_uv(100.0)
+        assert q.uv_cache_info() == {"hits": 1, "misses": 4, "size": 2, "maxsize": 2}
+
+        q.calib_pnts_dc = [[10, -0.1]]
+        assert q.uv_cache_info()["size"] == 0
+        assert q.calc_uv(100.0)[0] == pytest.approx(0.9 * u, abs=driver.DC_RESOLUTION)
+
+        q.frequency = 0.5e6
+        assert q.uv_cache_info()["size"] == 0
+        assert q.calc_uv(100.0)[1] == pytest.approx(v / 4, abs=driver.AC_RESOLUTION)
+
+        q.uv_cache_size = 0
+        assert q.calc_uv(100.0) == q._calc_uv(100.0)
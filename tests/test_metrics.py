@@ -0,0 +1,79 @@
+import pytest
+
+from pymeasure.test import expected_protocol
+from qsource3.metrics import LatencyHistogram
+from qsource3.qsource3driver import QSource3Driver
+from qsource3.simulator import SimulatedQSource3Adapter
+
+
+def test_metrics_disabled():
+    with expected_protocol(QSource3Driver, [("#Q", "OK")]) as inst:
+        assert inst.metrics is None
+        inst.test_communication()
+        assert inst.metrics is None
+
+
+def test_metrics():
+    events = []
+    with expected_protocol(
+        QSource3Driver,
+        [
+            ("#C 1000 2000 3000", "OK"),
+            ("#DC1 5000", "ERR"),
+            ("#G", "10000"),
+            ("#DC1 1000", None),
+            ("#DC2 1000", None),
+            (None, "OK"),
+            (None, "OK"),
+        ],
+    ) as inst:
+        metrics = inst.enable_metrics(hooks=[events.append])
+        inst.set_voltages(1.0, 2.0, 3.0)
+        with pytest.raises(ConnectionError):
+            inst.dc1 = 5.0
+        assert inst.frequency == 1e6
+        with inst.pipelined(window=2):
+            inst.dc1 = 1.0
+            inst.dc2 = 1.0
+
+    assert metrics.commands == {"#C": 1, "#DC1": 2, "#G": 1, "#DC2": 1}
+    assert metrics.errors == {"#DC1": 1}
+    assert metrics.bytes_sent == 18 + 10 + 3 + 10 + 10
+    assert metrics.bytes_received == 3 + 4 + 6 + 3 + 3
+    assert metrics.latency["ask_ok"].count == 4
+    assert metrics.latency["ask"].count == 1
+
+    assert [e.command for e in events] == ["#C", "#DC1", "#G", "#DC1", "#DC2"]
+    assert events[1].error == "Invalid response: ERR"
+    assert events[2].kind == "ask"
+    assert "#DC1" in metrics.summary()
+
+    inst.disable_metrics()
+    assert inst.metrics is None
+
+
+def test_metrics_scan_plan():
+    from qsource3.massfilter import Quadrupole
+
+    adapter = SimulatedQSource3Adapter(processing_delay=0.0, realtime=False)
+    q = Quadrupole(frequency=1e6, r0=3e-3, driver=QSource3Driver(adapter))
+    metrics = q._driver.enable_metrics()
+    plan = q.compile_scan([1.0, 2.0, 3.0])
+    plan.run()
+    assert metrics.commands == {"#C": 3}
+    assert metrics.bytes_sent == sum(len(c) for c in plan.commands)
+    assert metrics.bytes_received == 3 * 3
+
+
+def test_latency_histogram():
+    h = LatencyHistogram()
+    assert h.edges[0] == 1e-6
+    assert h.edges[-1] == pytest.approx(10.0)
+    for latency in [1e-4] * 99 + [1e-2]:
+        h.record(latency)
+    assert h.count == 100
+    assert h.mean == pytest.approx((99e-4 + 1e-2) / 100)
+    assert h.percentile(50) == pytest.approx(1e-4, rel=0.3)
+    assert h.percentile(100) == 1e-2
+    h.record(100.0)  # overflow
+    assert h.counts[-1] == 1
@@ -1,7 +1,11 @@
 import pytest
 
+from pymeasure.adapters import SerialAdapter
 from pymeasure.test import expected_protocol
+from serial.urlhandler import protocol_loop
+
 from qsource3.qsource3driver import QSource3Driver
+from qsource3.simulator import SimulatedQSource3
 
 
 def test_test_communication():
@@ -83,3 +87,139 @@ def test_store_frequency():
         [("#S", "OK")],
     ) as inst:
         inst.store_frequency()
+
+
+def test_pipelined():
+    with expected_protocol(
+        QSource3Driver,
+        [
+            ("#DC1 1000", None),
+            ("#DC2 2000", None),
+            (None, "OK"),
+            ("#AC 1000", None),
+            (None, "OK"),
+            (None, "OK"),
+            ("#G", "10000"),
+        ],
+    ) as inst:
+        with inst.pipelined(window=2):
+            inst.dc1 = 1.0
+            inst.dc2 = 2.0
+            inst.ac = 1.0
+        assert inst.frequency == 1e6
+
+
+def test_pipelined_flush_before_query():
+    with expected_protocol(
+        QSource3Driver,
+        [
+            ("#DC1 1000", None),
+            (None, "OK"),
+            ("#G", "10000"),
+        ],
+    ) as inst:
+        with inst.pipelined(window=4):
+            inst.dc1 = 1.0
+            assert inst.frequency == 1e6
+
+
+def test_pipelined_error():
+    with expected_protocol(
+        QSource3Driver,
+        [
+            ("#DC1 1000", None),
+            ("#DC2 2000", None),
+            ("#AC 1000", None),
+            (None, "OK"),
+            (None, "ERR"),
+            (None, "OK"),
+        ],
+    ) as inst:
+        with pytest.raises(ConnectionError, match="#DC2 2000"):
+            with inst.pipelined(window=4):
+                inst.dc1 = 1.0
+                inst.dc2 = 2.0
+                inst.ac = 1.0
+
+
+def test_register_cache():
+    with expected_protocol(
+        QSource3Driver,
+        [
+            ("#C 1000 1000 1000", "OK"),
+            ("#DC1 2000", "OK"),
+            ("#AC 2000", "ERR"),
+            ("#AC 2000", "OK"),
+            ("#DC1 2000", "OK"),
+            ("#B 1", "OK"),
+            ("#C 2000 1000 2000", "OK"),
+        ],
+    ) as inst:
+        inst.voltages = (1.0, 1.0, 1.0)
+        inst.voltages = (1.0, 1.0, 1.0)
+        inst.dc1 = 1.0
+        inst.dc2 = 1.0004
+        inst.ac = 1.0
+        inst.dc1 = 2.0
+        inst.dc1 = 2.0
+        assert inst.registers == {"dc1": 2000, "dc2": 1000, "ac": 1000}
+        with pytest.raises(ConnectionError):
+            inst.ac = 2.0
+        assert inst.registers == {"dc1": None, "dc2": None, "ac": None}
+        inst.ac = 2.0
+        inst.dc1 = 2.0
+        inst.range = 1
+        inst.voltages = (2.0, 1.0, 2.0)
+
+
+def test_register_cache_disabled():
+    with expected_protocol(
+        QSource3Driver,
+        [("#DC1 1000", "OK"), ("#DC1 1000", "OK")],
+        register_cache=False,
+    ) as inst:
+        inst.dc1 = 1.0
+        inst.dc1 = 1.0
+
+
+class DeviceLoop(protocol_loop.Serial):
+    """pyserial loop connection answering by the simulated device"""
+
+    def __init__(self):
+        super().__init__("loop://", timeout=0.1)
+        self.device = SimulatedQSource3()
+
+    def write(self, data):
+        for line in bytes(data).split(b"\r"):
+            if line:
+                super().write((self.device.process(line.decode()) + "\r").encode())
+        return len(data)
+
+
+@pytest.mark.parametrize("fast_io", [True, False])
+def test_fast_io(fast_io):
+    connection = DeviceLoop()
+    adapter = SerialAdapter(connection, write_termination="\r", read_termination="\r")
+    inst = QSource3Driver(adapter, fast_io=fast_io)
+    assert inst.fast_io == fast_io
+    assert inst.encode_voltages([1], [2], [3]) == [b"#C 1 2 3\r"]
+
+    inst.set_voltages(1.0, 2.0, 3.0)
+    assert (connection.device.dc1, connection.device.dc2, connection.device.ac) == (
+        1000, 2000, 3000,
+    )
+    with pytest.raises(ConnectionError, match="Invalid response: ERR"):
+        inst._ask_ok("#X")
+    with inst.pipelined(window=2):
+        inst.dc1 = 4.0
+        inst.dc2 = 5.0
+        inst._ask_ok_bytes(b"#AC 6000\r")
+    assert inst.frequency == 1050e3
+    assert connection.device.ac == 6000
+
+
+def test_fast_io_not_available():
+    # ProtocolAdapter has no raw connection
+    with expected_protocol(QSource3Driver, [("#Q", "OK")]) as inst:
+        assert not inst.fast_io
+        inst.test_communication()
@@ -0,0 +1,41 @@
+import numpy as np
+
+from qsource3.ranges import RangeManager
+
+
+def test_frequencies_read_once(simulated_driver):
+    ranges = RangeManager(simulated_driver(realtime=False), r0=3e-3, settle_time=0.0)
+    device = ranges._driver.adapter.device
+    assert ranges.frequencies == {0: 1050e3, 1: 480e3, 2: 240e3}
+    assert [q.frequency for q in ranges.quadrupoles.values()] == [1050e3, 480e3, 240e3]
+    assert device.command_counts["#G"] == 3
+    assert ranges.range == 2
+
+    # selecting the actual range does not send #B
+    ranges.select(2)
+    assert device.command_counts["#B"] == 3
+    assert ranges.select(0) is ranges.quadrupoles[0]
+    assert device.range == 0
+    assert device.command_counts["#B"] == 4
+
+
+def test_split_scan(simulated_driver):
+    ranges = RangeManager(simulated_driver(realtime=False), r0=3e-3, settle_time=0.0)
+    max_mz = [ranges.quadrupoles[n].max_mz for n in range(3)]
+    assert max_mz[0] < max_mz[1] < max_mz[2]
+
+    mz_vec = np.array([1.0, max_mz[1] + 1, max_mz[0] + 1, 2.0, max_mz[2] + 1])
+    np.testing.assert_array_equal(ranges.range_for_mz(mz_vec), [0, 2, 1, 0, 2])
+
+    # actual range 2 goes first, one segment per range
+    segments = ranges.compile_scan(mz_vec, dwell=0.0)
+    assert [n for n, _, _ in segments] == [2, 0, 1]
+    np.testing.assert_array_equal(segments[0][1], [1, 4])
+    np.testing.assert_array_equal(segments[1][1], [0, 3])
+    np.testing.assert_array_equal(segments[1][2].mz, [1.0, 2.0])
+
+    ranges.run_scan(segments, deadlines=False)
+    device = ranges._driver.adapter.device
+    assert device.command_counts["#B"] == 3 + 2
+    assert device.range == 1
+    assert ranges.quadrupoles[1].mz == max_mz[0] + 1
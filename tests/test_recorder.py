@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from pymeasure.adapters import ProtocolAdapter
+from pymeasure.test import expected_protocol
+from qsource3.massfilter import Quadrupole
+from qsource3.qsource3driver import QSource3Driver
+from qsource3.recorder import READ, WRITE, CommandLog, replay
+from qsource3.simulator import SimulatedQSource3Adapter
+
+PROTOCOL = [
+    ("#C 1000 2000 3000", "OK"),
+    ("#G", "10000"),
+    ("#DC1 4000", None),
+    ("#DC2 5000", None),
+    (None, "OK"),
+    (None, "OK"),
+]
+
+
+def test_record(tmp_path):
+    path = tmp_path / "commands.qs3log"
+    with expected_protocol(QSource3Driver, PROTOCOL) as inst:
+        recorder = inst.start_recording(path)
+        assert inst.recorder is recorder
+        inst.set_voltages(1.0, 2.0, 3.0)
+        assert inst.frequency == 1e6
+        with inst.pipelined(window=4):
+            inst.dc1 = 4.0
+            inst.dc2 = 5.0
+            assert inst.stop_recording() is recorder
+        assert inst.recorder is None
+
+    log = CommandLog.load(path)
+    assert [r.kind for r in log] == [WRITE, READ, WRITE, READ, WRITE, WRITE, READ, READ]
+    assert log[0].data == b"#C 1000 2000 3000"
+    assert all(a.time <= b.time for a, b in zip(log, log[1:]))
+    assert log.comm_pairs() == PROTOCOL
+    assert log.command_counts() == {"#C": 1, "#G": 1, "#DC1": 1, "#DC2": 1}
+
+    result = replay(log, ProtocolAdapter(log.comm_pairs()), speed=None)
+    assert (result.commands, result.replies, result.mismatches) == (4, 4, [])
+
+    result = replay(path, ProtocolAdapter([(c, "ERR" if r else r) for c, r in PROTOCOL]), speed=None)
+    assert result.mismatches[0] == (1, "OK", "ERR")
+
+    # interrupted recording
+    path.write_bytes(path.read_bytes()[:-3])
+    assert len(CommandLog.load(path)) == 7
+
+
+def test_replay_scan(tmp_path):
+    path = tmp_path / "scan.qs3log"
+    adapter = SimulatedQSource3Adapter(processing_delay=0.0, realtime=False)
+    q = Quadrupole(frequency=1e6, r0=3e-3, driver=QSource3Driver(adapter))
+    plan = q.compile_scan(np.linspace(10, 20, 10), dwell=0.002)
+    q._driver.start_recording(path)
+    plan.run()
+    q._driver.stop_recording()
+
+    log = CommandLog.load(path)
+    assert log.command_counts() == {"#C": 10}
+    assert log.duration >= 0.018
+
+    device = SimulatedQSource3Adapter(processing_delay=0.0, realtime=False)
+    result = replay(log, QSource3Driver(device))
+    assert (result.commands, result.mismatches) == (10, [])
+    assert result.elapsed >= log[-2].time - log[0].time  # the last command
+    assert device.device.command_counts == log.command_counts()
+
+    with pytest.raises(ValueError):
+        replay(log, device, speed=0)
+
+    other = CommandLog(log.records[:-2])
+    assert log.diff_counts(other) == {"#C": (10, 9)}
@@ -0,0 +1,229 @@
+import time
+
+import numpy as np
+import pytest
+
+from pymeasure.test import expected_protocol
+
+from qsource3.qsource3driver import QSource3Driver
+from qsource3.massfilter import Quadrupole
+from qsource3.scan import ResumableScan, ScanCheckpoint, ScanExecutor, ScanPipeline
+
+
+def test_voltages_to_mv():
+    with expected_protocol(QSource3Driver, []) as driver:
+        dc1, dc2, ac = driver.voltages_to_mv(
+            np.array([1.0, -200.0, 0.0015]),
+            np.array([-1.0, 200.0, 0.0025]),
+            np.array([1.0, 1000.0, -1.0]),
+        )
+        assert dc1.tolist() == [1000, -100000, 2]
+        assert dc2.tolist() == [-1000, 100000, 2]
+        assert ac.tolist() == [1000, 650000, 0]
+
+
+def test_encode_voltages():
+    with expected_protocol(QSource3Driver, []) as driver:
+        assert driver.encode_voltages([1, -2], [3, 4], [5, 6]) == [
+            b"#C 1 3 5",
+            b"#C -2 4 6",
+        ]
+
+
+def test_scan_plan():
+    with expected_protocol(
+        QSource3Driver,
+        [
+            (r"#C 0 0 0", r"OK"),
+            (r"#C 0 0 0", r"OK"),
+            (r"#C 10909 -10909 129992", r"OK"),
+        ],
+    ) as driver:
+        q = Quadrupole(frequency=1e6, r0=3e-3, driver=driver)
+
+        plan = q.compile_scan([-5.0, 100.0], dwell=0.0)
+        assert len(plan) == 2
+        assert plan.duration == 0.0
+        plan.run()
+
+        assert 100.0 == pytest.approx(q.mz)
+        assert 64.99585477169073 == pytest.approx(q.rf)
+        assert 10.909360892982084 == pytest.approx(q.dc_diff)
+
+
+def test_scan_plan_error():
+    with expected_protocol(
+        QSource3Driver,
+        [
+            (r"#C 0 0 0", r"OK"),
+            (r"#C 0 0 0", r"OK"),
+            (r"#C 10909 -10909 129992", r"ERR"),
+        ],
+    ) as driver:
+        q = Quadrupole(frequency=1e6, r0=3e-3, driver=driver)
+
+        plan = q.compile_scan([1e-6, 100.0])
+        with pytest.raises(ConnectionError, match="#C 10909 -10909 129992"):
+            plan.run()
+        assert q.mz == pytest.approx(1e-6)
+
+
+def test_scan_executor():
+    with expected_protocol(
+        QSource3Driver,
+        [
+            (r"#C 0 0 0", r"OK"),
+            (r"#C 0 0 0", r"OK"),
+            (r"#C 10909 -10909 129992", r"OK"),
+            (r"#C 0 0 0", r"OK"),
+        ],
+    ) as driver:
+        q = Quadrupole(frequency=1e6, r0=3e-3, driver=driver)
+
+        plan = q.compile_scan([0.0, 100.0, 0.0], dwell=0.01)
+        timing = ScanExecutor(plan).run()
+
+        assert timing.deadlines == pytest.approx([0.0, 0.01, 0.02])
+        assert timing.duration >= 0.03
+        assert timing.max_error < 0.01
+        assert timing.summary()["points"] == 3
+        assert q.mz == 0.0
+
+
+def test_scan_plan_compact():
+    with expected_protocol(
+        QSource3Driver,
+        [
+            (r"#C 0 0 0", r"OK"),
+            (r"#C 0 0 0", r"OK"),
+            (r"#C 10909 -10909 129992", r"OK"),
+            (r"#C 0 0 0", r"OK"),
+        ],
+    ) as driver:
+        q = Quadrupole(frequency=1e6, r0=3e-3, driver=driver)
+
+        plan = q.compile_scan([-1.0, 0.0, 1e-5, 100.0, 100.0000001, 0.0], dwell=0.001)
+        compacted, mapping = plan.compact()
+
+        assert len(compacted) == 3
+        assert mapping.tolist() == [0, 0, 0, 1, 1, 2]
+        assert compacted.dwell == pytest.approx([0.003, 0.002, 0.001])
+        assert compacted.mz.tolist() == [0.0, 100.0, 0.0]
+        assert compacted.duration == pytest.approx(plan.duration)
+
+        compacted.run()
+        assert q.mz == 0.0
+
+        data = np.array([1.0, 2.0, 3.0])
+        assert data[mapping].tolist() == [1.0, 1.0, 1.0, 2.0, 2.0, 3.0]
+
+
+def test_scan_pipeline(simulated_quadrupole):
+    q = simulated_quadrupole()
+    plan = q.compile_scan(np.linspace(1, 100, 50))
+    device = q._driver.adapter.device
+
+    def detector(mz):
+        ac = device.ac  # the signal at the actual setpoint
+        return lambda: ac
+
+    chunks = list(ScanPipeline(plan, detector, chunk_size=16).run())
+    assert [len(mz) for mz, _ in chunks] == [16, 16, 16, 2]
+    mz, values = ScanPipeline(plan, detector, chunk_size=16).collect()
+    np.testing.assert_array_equal(mz, plan.mz)
+    np.testing.assert_array_equal(values, plan.ac_mv)
+    assert q.mz == 100.0
+
+
+def test_scan_pipeline_overlap(simulated_quadrupole):
+    delay = 0.005
+    q = simulated_quadrupole(processing_delay=delay)
+    plan = q.compile_scan(np.linspace(1, 100, 10))
+
+    def detector(mz):
+        def read_out():
+            time.sleep(delay)
+            return mz
+
+        return read_out
+
+    t0 = time.perf_counter()
+    mz, values = ScanPipeline(plan, detector).collect()
+    elapsed = time.perf_counter() - t0
+    np.testing.assert_array_equal(values, plan.mz)
+    # the read-out is overlapped with the setpoints
+    assert elapsed < 10 * 2 * delay
+
+
+def test_scan_pipeline_backpressure_and_close(simulated_quadrupole):
+    q = simulated_quadrupole()
+    plan = q.compile_scan(np.linspace(1, 100, 1000))
+    calls = []
+
+    def detector(mz):
+        calls.append(mz)
+        return mz
+
+    stream = ScanPipeline(plan, detector, chunk_size=10, max_chunks=2).run()
+    next(stream)
+    time.sleep(0.05)
+    # the scan waits for the consumer
+    assert len(calls) < 10 * (1 + 2 + 2) + 2
+    stream.close()
+    assert len(calls) < 100
+    assert q._driver.registers["ac"] is None  # interrupted
+
+
+def test_scan_pipeline_errors(simulated_quadrupole):
+    q = simulated_quadrupole()
+    plan = q.compile_scan(np.linspace(1, 100, 20))
+
+    def detector(mz):
+        if mz > 50:
+            raise RuntimeError("detector failed")
+        return mz
+
+    stream = ScanPipeline(plan, detector, chunk_size=4).run()
+    received = []
+    with pytest.raises(RuntimeError, match="detector failed"):
+        for mz, values in stream:
+            received.extend(values)
+    # the points measured before the error are delivered
+    assert received == plan.mz[plan.mz <= 50].tolist()
+
+    q._driver.adapter.inject_errors(1)
+    with pytest.raises(ConnectionError):
+        ScanPipeline(plan, lambda mz: mz).collect()
+
+
+def test_resumable_scan(tmp_path, simulated_quadrupole):
+    q = simulated_quadrupole()
+    adapter = q._driver.adapter
+    plan = q.compile_scan(np.linspace(1, 100, 20))
+    path = tmp_path / "scan.json"
+
+    scan = ResumableScan(plan, ScanCheckpoint(path), max_retries=2, backoff=0.001)
+    scan.run(stop=5)
+    assert scan.checkpoint.next_point == 5
+
+    # glitch recovered by retries
+    adapter.inject_errors(2)
+    scan.run(stop=10)
+    assert scan.checkpoint.next_point == 10
+    assert scan.checkpoint.retries == 2
+    assert [k for k, _ in scan.checkpoint.errors] == [5, 5]
+
+    # retries exhausted, resumed from the failed point by a new runner
+    adapter.inject_errors(3)
+    with pytest.raises(ConnectionError):
+        scan.run()
+    assert q._driver.registers["ac"] is None
+    scan = ResumableScan(plan, ScanCheckpoint(path), max_retries=2, backoff=0.001)
+    assert scan.checkpoint.next_point == 10
+    assert not scan.completed
+    scan.run()
+    assert scan.completed
+    assert q.mz == 100.0
+    assert adapter.device.ac == plan.ac_mv[-1]
+    # initial #C of Quadrupole and every point once (the failed commands were not processed)
+    assert adapter.device.command_counts["#C"] == 1 + 20
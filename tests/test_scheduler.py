@@ -0,0 +1,170 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pytest
+
+from qsource3.massfilter import Quadrupole
+from qsource3.qsource3driver import QSource3Driver
+from qsource3.scheduler import PRIORITY_TELEMETRY, Poller, PriorityLock
+from qsource3.simulator import SimulatedQSource3Adapter
+
+
+def test_priority_lock():
+    lock = PriorityLock()
+    order = []
+
+    def worker(priority):
+        lock.acquire(priority)
+        order.append(priority)
+        lock.release()
+
+    lock.acquire()
+    lock.acquire()  # reentrant
+    threads = []
+    for priority in (2, 1, 2, 0):
+        t = threading.Thread(target=worker, args=(priority,))
+        t.start()
+        threads.append(t)
+        while len(lock._waiters) < len(threads):
+            time.sleep(0.001)
+    lock.release()
+    assert order == []
+    lock.release()
+    for t in threads:
+        t.join()
+    assert order == [0, 1, 2, 2]
+    assert not lock.locked()
+
+    with pytest.raises(RuntimeError):
+        lock.release()
+
+
+def test_thread_priority():
+    lock = PriorityLock()
+    with lock.thread_priority(PRIORITY_TELEMETRY):
+        assert lock._local.priority == PRIORITY_TELEMETRY
+    assert not hasattr(lock._local, "priority")
+
+
+def test_poller():
+    adapter = SimulatedQSource3Adapter(processing_delay=100e-6)
+    driver = QSource3Driver(adapter)
+    q = Quadrupole(frequency=1e6, r0=3e-3, driver=driver)
+    plan = q.compile_scan(np.linspace(1, 100, 200))
+
+    poller = Poller(driver, interval=0.0)
+    poller.poll()
+    assert poller.readings["frequency"].value == 1050e3
+    assert poller.reading("serial_number").timestamp <= time.time()
+    assert poller.reading("current", max_age=-1) is None
+
+    # telemetry runs concurrently with the scan without breaking the pairing of replies
+    with poller:
+        plan.run()
+        with driver.pipelined(window=4):
+            plan.run()
+        time.sleep(0.01)
+    assert poller.errors == {}
+    assert adapter.device.command_counts["#U"] > 1
+    assert adapter.device.command_counts["#C"] == 1 + 2 * 200
+    assert q.mz == 100.0
+
+
+def run_with_timeout(fnc, timeout=10.0):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(fnc()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "deadlock"
+    return result[0]
+
+
+def test_pipelined_other_threads():
+    from qsource3.bus import QSource3Bus
+    from qsource3.scan import ScanPipeline
+
+    adapter = SimulatedQSource3Adapter(processing_delay=0.0)
+    driver = QSource3Driver(adapter)
+    q1 = Quadrupole(frequency=1e6, r0=3e-3, driver=driver)
+    q2 = Quadrupole(frequency=1e6, r0=3e-3, driver=driver)
+    plan = q1.compile_scan(np.linspace(1, 100, 50))
+
+    # commands of the scan thread of the pipeline are pipelined
+    def scan():
+        with driver.pipelined(window=8):
+            return ScanPipeline(plan, lambda mz: mz).collect()
+
+    mz, values = run_with_timeout(scan)
+    np.testing.assert_array_equal(values, plan.mz)
+    assert adapter.device.command_counts["#C"] == 1 + 50  # 1 on creation of the units (then cached)
+
+    # two units on one driver served by the worker thread of the bus
+    def set_mz():
+        with QSource3Bus([q1, q2]) as bus, driver.pipelined(window=8):
+            bus.set_mz([10.0, 20.0])
+            bus.set_mz([30.0, 40.0])
+
+    run_with_timeout(set_mz)
+    assert (q1.mz, q2.mz) == (30.0, 40.0)
+    assert adapter.device.ac == 51997
+
+
+def test_pipelined_error_of_other_thread():
+    adapter = SimulatedQSource3Adapter(processing_delay=0.0)
+    driver = QSource3Driver(adapter)
+
+    def worker():
+        driver.dc1 = 1.0
+        adapter.inject_errors(1)
+        driver.dc1 = 2.0
+        driver.dc2 = 3.0
+
+    with pytest.raises(ConnectionError, match="#DC1 2000"):
+        with driver.pipelined(window=8):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+            assert len(driver._pending) == 3
+            driver.dc2 = 4.0  # the replies of the worker are read first
+            assert [command for command, _, _ in driver._pending] == ["#DC2 4000"]
+    # the error of the worker is raised when the block is left, all replies were read
+    assert driver._pending == deque()
+    assert adapter.device.dc2 == 4000
+
+
+def test_register_model_shared_driver():
+    from qsource3 import tracing
+
+    adapter = SimulatedQSource3Adapter(processing_delay=0.0)
+    driver = QSource3Driver(adapter)
+    device = adapter.device
+    paused = threading.Event()
+    resume = threading.Event()
+
+    class PausingTracer(tracing.Tracer):
+        # pause the main thread after its command was answered
+        def add(self, name, category, start, end=None):
+            if name == "serial" and threading.current_thread() is threading.main_thread():
+                paused.set()
+                resume.wait(0.5)
+
+    def other():
+        paused.wait()
+        driver.set_voltages(7, 8, 9)
+        driver.dc1 = 4
+        resume.set()
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    tracing.active = PausingTracer()
+    try:
+        driver.set_voltages(1, 2, 3)
+    finally:
+        tracing.disable_tracing()
+    thread.join()
+    # the model is compared and updated together with the command
+    assert driver.registers == {"dc1": device.dc1, "dc2": device.dc2, "ac": device.ac}
+    driver.set_voltages(1, 2, 3)
+    assert (device.dc1, device.dc2, device.ac) == (1000, 2000, 3000)
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from qsource3.qsource3driver import QSource3Driver
+from qsource3.massfilter import Quadrupole
+from qsource3.simulator import SimulatedQSource3, SimulatedQSource3Adapter
+
+
+def test_command_set():
+    device = SimulatedQSource3(serial_number="042", frequencies=(1e6, 5e5, 2.5e5))
+    driver = QSource3Driver(SimulatedQSource3Adapter(device, realtime=False))
+
+    driver.test_communication()
+    driver.set_rs485_mode()
+    assert driver.serial_number == 42
+    assert device.rs485_mode
+
+    driver.voltages = (1.0, -2.0, 3.0)
+    assert (device.dc1, device.dc2, device.ac) == (1000, -2000, 3000)
+    driver.dc1 = 5.0
+    driver.dc2 = -5.0
+    driver.ac = 100.0
+    assert (device.dc1, device.dc2, device.ac) == (5000, -5000, 100000)
+    assert driver.current == pytest.approx(20.0)
+
+    assert driver.frequency == 1e6
+    driver.range = 1
+    assert driver.frequency == 5e5
+    driver.frequency = 5.1e5
+    driver.store_frequency()
+    driver.range = 0
+    driver.range = 1
+    assert driver.frequency == 5.1e5
+
+    with pytest.raises(ConnectionError):
+        driver._ask_ok("#X")
+    assert device.command_counts["#C"] == 1
+
+
+def test_latency_model():
+    adapter = SimulatedQSource3Adapter(
+        baud_rate=1000000, processing_delay=100e-6, realtime=False
+    )
+    driver = QSource3Driver(adapter, register_cache=False)
+
+    # command "#Q\r" and reply "OK\r": 2 * 30 us transmission + 100 us processing
+    driver.test_communication()
+    assert adapter.elapsed == pytest.approx(160e-6)
+
+    # pipelined commands overlap transmission with processing
+    with driver.pipelined(window=10):
+        for _ in range(10):
+            driver.test_communication()
+    assert adapter.elapsed == pytest.approx(160e-6 + 30e-6 + 10 * 100e-6 + 30e-6)
+
+
+def test_realtime_scan():
+    adapter = SimulatedQSource3Adapter(processing_delay=200e-6, jitter=50e-6, seed=1)
+    driver = QSource3Driver(adapter)
+    q = Quadrupole(frequency=1e6, r0=3e-3, driver=driver)
+
+    plan = q.compile_scan(np.linspace(1, 100, 50))
+    plan.run()
+    assert adapter.elapsed >= 50 * 200e-6
+    assert adapter.device.ac == plan.ac_mv[-1]
+
+
+def test_inject_errors():
+    adapter = SimulatedQSource3Adapter(realtime=False)
+    driver = QSource3Driver(adapter)
+    adapter.inject_errors(1)
+    with pytest.raises(ConnectionError):
+        driver.dc1 = 1.0
+    assert adapter.device.dc1 == 0
+    driver.dc1 = 1.0
+    assert adapter.device.dc1 == 1000
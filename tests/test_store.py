@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from qsource3.massfilter import Quadrupole
+from qsource3.qsource3driver import QSource3Driver
+from qsource3.scan import ScanPipeline
+from qsource3.simulator import SimulatedQSource3Adapter
+from qsource3.store import SpectrumStore, load_spectra
+
+
+def test_ring_buffer():
+    store = SpectrumStore(np.arange(4), capacity=3)
+    for i in range(5):
+        store.append(np.full(4, i))
+    assert len(store) == 5
+    assert store.scan(-1).tolist() == [4] * 4
+    assert store[2].tolist() == [2] * 4
+    assert store.recent()[:, 0].tolist() == [2, 3, 4]
+    with pytest.raises(IndexError):
+        store.scan(1)  # not kept without file
+    with pytest.raises(ValueError):
+        store.append([1, 2])
+
+    # no copy
+    view = store.scan(-1)
+    assert np.shares_memory(view, store._ring)
+    assert not view.flags.writeable
+
+
+def test_file(tmp_path):
+    path = tmp_path / "run.spec"
+    mz = np.linspace(1, 10, 5)
+    with SpectrumStore(mz, capacity=2, path=path) as store:
+        for i in range(6):
+            row = store.begin_scan()
+            row[:] = i
+            # the scan being overwritten is read from the file
+            if i >= 2:
+                assert store.scan(i - 2).tolist() == [i - 2] * 5
+            store.end_scan()
+        assert isinstance(store.scan(0), np.memmap)
+        assert store.archive.shape == (6, 5)
+
+    mz_loaded, scans = load_spectra(path)
+    np.testing.assert_array_equal(mz_loaded, mz)
+    assert scans[:, 0].tolist() == [0, 1, 2, 3, 4, 5]
+    assert not scans.flags.writeable
+
+
+def test_file_integer_dtype(tmp_path):
+    path = tmp_path / "counts.spec"
+    mz = [10.5, 10.6, 10.7]
+    with SpectrumStore(mz, capacity=1, path=path, dtype=np.uint32) as store:
+        store.append([1, 2, 3])
+        store.append([4, 5, 6])
+        assert store.scan(0).tolist() == [1, 2, 3]  # from the file
+
+    mz_loaded, scans = load_spectra(path)
+    assert mz_loaded.tolist() == mz
+    assert scans.dtype == np.uint32
+    assert scans.tolist() == [[1, 2, 3], [4, 5, 6]]
+
+
+def test_acquire():
+    adapter = SimulatedQSource3Adapter(processing_delay=0.0)
+    q = Quadrupole(frequency=1e6, r0=3e-3, driver=QSource3Driver(adapter))
+    plan = q.compile_scan(np.linspace(1, 100, 50))
+    store = SpectrumStore.from_plan(plan, capacity=4)
+    pipeline = ScanPipeline(plan, lambda mz: 2 * mz, chunk_size=16)
+    spectrum = store.acquire(pipeline)
+    np.testing.assert_array_equal(spectrum, 2 * plan.mz)
+    np.testing.assert_array_equal(store.mz, plan.mz)
@@ -0,0 +1,59 @@
+import json
+
+import numpy as np
+
+from qsource3 import tracing
+from qsource3.scan import ScanExecutor
+
+
+def test_disabled(simulated_quadrupole):
+    q = simulated_quadrupole()
+    assert tracing.active is None
+    q.mz = 10.0
+    assert tracing.active is None
+
+
+def test_trace_points(tmp_path, simulated_quadrupole):
+    q = simulated_quadrupole()
+    with tracing.trace() as tracer:
+        assert tracing.active is tracer
+        for mz in (1.0, 2.0, 3.0):
+            q.mz = mz
+            tracer.sleep(0.001)
+        q._driver.frequency
+    assert tracing.active is None
+
+    stats = tracer.stats()
+    for name in ("mz", "calc_uv", "validators", "formatting", "sleep"):
+        assert stats[name]["count"] == 3
+    assert stats["serial"]["count"] == 4  # 3 setpoints and 1 query
+    assert stats["sleep"]["total"] >= 0.003
+    assert stats["mz"]["total"] >= stats["calc_uv"]["total"]
+
+    summary = tracer.summary()
+    assert summary.splitlines()[1].startswith("sleep")
+
+    path = tmp_path / "trace.json"
+    tracer.export_chrome(path)
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+    assert len(events) == len(tracer.events)
+    assert {e["ph"] for e in events} == {"X"}
+    assert all(e["dur"] >= 0 for e in events)
+
+
+def test_trace_scan(simulated_quadrupole):
+    q = simulated_quadrupole()
+    plan = q.compile_scan(np.linspace(1, 10, 5), dwell=0.001)
+    with tracing.trace() as tracer:
+        plan.run()
+        ScanExecutor(plan).run()
+    stats = tracer.stats()
+    assert stats["serial"]["count"] == 5 + 5
+    assert stats["sleep"]["count"] == 5 + 6  # ScanExecutor waits for the end of the last point
+
+    with tracing.trace(max_events=8) as tracer:
+        ScanExecutor(plan).run()
+    assert len(tracer.events) == 8
+    assert tracer.dropped == 5 + 6 - 8
+    assert "3 spans dropped" in tracer.summary()